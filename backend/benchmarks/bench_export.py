@@ -0,0 +1,73 @@
+"""
+Alarko Enerji - streaming export benchmark
+Seeds a throwaway database with transactions, drains the /admin/export
+generator (the same one StreamingResponse consumes) and reports throughput
+and resident memory, which should stay flat regardless of row count.
+
+Usage: MONGO_URL=mongodb://localhost:27017 python benchmarks/bench_export.py
+Env: BENCH_ROWS (default 1000000), BENCH_FORMAT (csv|ndjson)
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ['DB_NAME'] = os.environ.get('BENCH_DB_NAME', 'alarko_bench')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+ROWS = int(os.environ.get('BENCH_ROWS', '1000000'))
+FORMAT = os.environ.get('BENCH_FORMAT', 'csv')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss_mb() -> float:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE / 1024 / 1024
+
+
+async def seed():
+    await server.db.transactions.delete_many({})
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    batch = []
+    for i in range(ROWS):
+        batch.append({"transaction_id": str(uuid.uuid4()), "user_id": f"user_{i % 5000:05d}", "user_name": f"Bench {i % 5000}",
+                      "type": random.choice(["deposit", "withdrawal"]), "amount": float(random.randint(100, 100000)),
+                      "status": random.choice(["pending", "approved", "rejected"]),
+                      "created_at": (start + timedelta(seconds=i)).isoformat()})
+        if len(batch) == 10000:
+            await server.db.transactions.insert_many(batch)
+            batch = []
+    if batch:
+        await server.db.transactions.insert_many(batch)
+    await server.ensure_indexes()
+
+
+async def main():
+    try:
+        await seed()
+        spec = server.EXPORTS['transactions']
+        baseline = peak = rss_mb()
+        rows = size = 0
+        start = time.perf_counter()
+        async for chunk in server.export_rows(spec, server.export_query(spec), FORMAT):
+            size += len(chunk)
+            rows += chunk.count('\n')
+            peak = max(peak, rss_mb())
+        elapsed = time.perf_counter() - start
+        print(f"{ROWS} transactions as {FORMAT}: {rows} lines, {size / 1024 / 1024:.1f} MB in {elapsed:.1f} s "
+              f"({rows / elapsed:,.0f} rows/s)")
+        print(f"RSS baseline {baseline:.1f} MB, peak {peak:.1f} MB (+{peak - baseline:.1f} MB)")
+    finally:
+        await server.client.drop_database(os.environ['DB_NAME'])
+        server.client.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+"""
+Alarko Enerji - /admin/investor-overview benchmark
+Compares the legacy per-investor portfolio lookup (N+1) with the aggregation
+pipeline over portfolio_summaries at 1k, 10k and 100k investors, reporting
+round trips and latency (plus the one-off summary rebuild time).
+
+Usage: MONGO_URL=mongodb://localhost:27017 python benchmarks/bench_investor_overview.py
+Runs against a throwaway database (DB_NAME, default alarko_bench) that is dropped afterwards.
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from pymongo import monitoring
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ['DB_NAME'] = os.environ.get('BENCH_DB_NAME', 'alarko_bench')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+counter = CommandCounter()
+monitoring.register(counter)
+
+import server  # noqa: E402
+
+db = server.db
+SIZES = [int(s) for s in os.environ.get('BENCH_SIZES', '1000,10000,100000').split(',')]
+
+
+async def seed(n: int):
+    await db.users.delete_many({})
+    await db.portfolios.delete_many({})
+    await db.portfolio_summaries.delete_many({})
+    users, portfolios = [], []
+    for i in range(n):
+        uid = f"user_{uuid.uuid4().hex[:12]}"
+        users.append({"user_id": uid, "email": f"bench{i}@test.com", "name": f"Bench {i}", "role": "investor",
+                      "kyc_status": "approved", "balance": float(random.randint(0, 500000)), "tc_kimlik": "", "phone": ""})
+        for _ in range(random.randint(0, 3)):
+            shares = random.randint(1, 12)
+            portfolios.append({"portfolio_id": str(uuid.uuid4()), "user_id": uid, "project_id": "bench",
+                               "amount": shares * server.SHARE_PRICE, "shares": shares,
+                               "monthly_return": shares * server.SHARE_PRICE * 0.07, "status": "active"})
+        if len(users) >= 5000:
+            await db.users.insert_many(users)
+            users = []
+        if len(portfolios) >= 5000:
+            await db.portfolios.insert_many(portfolios)
+            portfolios = []
+    if users:
+        await db.users.insert_many(users)
+    if portfolios:
+        await db.portfolios.insert_many(portfolios)
+    await db.portfolios.create_index("user_id")
+    await db.portfolio_summaries.create_index("user_id", unique=True)
+    start = time.perf_counter()
+    await server.rebuild_portfolio_summaries()
+    print(f"{n:>7} investors | summaries rebuilt in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+async def legacy_overview(limit: int):
+    investors = await db.users.find({"role": "investor"}, {"_id": 0, "password_hash": 0}).to_list(limit)
+    result = []
+    for inv in investors:
+        portfolios = await db.portfolios.find({"user_id": inv['user_id']}, {"_id": 0}).to_list(100)
+        result.append({"user_id": inv['user_id'], "balance": inv.get('balance', 0),
+                       "total_invested": sum(p.get('amount', 0) for p in portfolios), "portfolios": portfolios})
+    result.sort(key=lambda x: x['total_invested'] + x['balance'], reverse=True)
+    return result
+
+
+async def measure(label: str, n: int, coro_fn):
+    before = counter.count
+    start = time.perf_counter()
+    rows = await coro_fn()
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"{n:>7} investors | {label:<10} | {counter.count - before:>7} round trips | {elapsed:>9.1f} ms | {len(rows)} rows")
+
+
+async def main():
+    admin = {"user_id": "bench_admin", "role": "admin"}
+    try:
+        for n in SIZES:
+            await seed(n)
+            # Legacy path only ever saw the first 1000 investors; give it the full set so totals are comparable
+            await measure("n+1", n, lambda: legacy_overview(n))
+            await measure("pipeline", n, lambda: server.get_investor_overview(skip=0, limit=1000, admin=admin))
+    finally:
+        await server.client.drop_database(os.environ['DB_NAME'])
+        server.client.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+Alarko Enerji - bcrypt login storm benchmark
+Fires a burst of password verifications while a probe coroutine stands in for an
+unrelated endpoint, and reports the probe's p50/p99 latency with bcrypt running
+inline on the event loop (before) and on the bounded worker pool (after).
+
+Usage: python benchmarks/bench_login_storm.py
+Env: BENCH_LOGINS (default 50), BCRYPT_ROUNDS, BCRYPT_WORKERS
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import bcrypt
+
+# The pool path never touches MongoDB; the client is created lazily
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'alarko_bench')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+LOGINS = int(os.environ.get('BENCH_LOGINS', '50'))
+PASSWORD = "admin123"
+
+
+async def probe(latencies: list, stop: asyncio.Event):
+    # An "unrelated endpoint": a tiny handler that should answer within a millisecond
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.005)
+        latencies.append((time.perf_counter() - start) * 1000 - 5)
+
+
+async def inline_login(hashed: str):
+    bcrypt.checkpw(PASSWORD.encode(), hashed.encode())
+
+
+async def pooled_login(hashed: str):
+    await server.verify_password(PASSWORD, hashed)
+
+
+async def storm(label: str, login_fn, hashed: str):
+    latencies, stop = [], asyncio.Event()
+    probe_task = asyncio.create_task(probe(latencies, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(login_fn(hashed) for _ in range(LOGINS)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:<8} | {LOGINS} logins in {elapsed:6.2f} s | probe samples {len(latencies):>5} | "
+          f"p50 {statistics.median(latencies):8.2f} ms | p99 {p99:8.2f} ms")
+
+
+async def main():
+    hashed = server._hash_password_sync(PASSWORD)
+    print(f"bcrypt rounds={server.BCRYPT_ROUNDS} workers={server.BCRYPT_WORKERS}")
+    await storm("before", inline_login, hashed)
+    await storm("after", pooled_login, hashed)
+    print(f"pool stats: {server._bcrypt_stats}")
+    server._bcrypt_pool.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
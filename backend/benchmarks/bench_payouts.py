@@ -0,0 +1,73 @@
+"""
+Alarko Enerji - monthly payout benchmark
+Seeds a throwaway database with investors and active holdings, runs a dry run
+and a real payout run through execute_payout_run and reports throughput.
+A second run of the same period must credit nobody.
+
+Usage: MONGO_URL=mongodb://localhost:27017 python benchmarks/bench_payouts.py
+Env: BENCH_PORTFOLIOS (default 100000), PAYOUT_CHUNK_USERS
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ['DB_NAME'] = os.environ.get('BENCH_DB_NAME', 'alarko_bench')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+PORTFOLIOS = int(os.environ.get('BENCH_PORTFOLIOS', '100000'))
+PERIOD = "2025-01"
+
+
+async def seed():
+    db = server.db
+    for name in ("users", "portfolios", "transactions", "notifications", "payout_runs"):
+        await db[name].delete_many({})
+    await server.ensure_indexes()
+    users, portfolios = [], []
+    user_ids = [f"user_{i:06d}" for i in range(max(PORTFOLIOS // 3, 1))]
+    for uid in user_ids:
+        users.append({"user_id": uid, "email": f"{uid}@bench.test", "name": uid, "role": "investor", "balance": 0.0, "unread_count": 0})
+    for _ in range(PORTFOLIOS):
+        shares = random.randint(1, 12)
+        portfolios.append(server.new_portfolio_entry(random.choice(user_ids), "bench", "Bench", "GES", shares,
+                                                     shares * server.SHARE_PRICE, 38.0))
+        if len(portfolios) == 10000:
+            await db.portfolios.insert_many(portfolios)
+            portfolios = []
+    if portfolios:
+        await db.portfolios.insert_many(portfolios)
+    await db.users.insert_many(users)
+
+
+async def main():
+    try:
+        await seed()
+        dry = await server.execute_payout_run({"period": PERIOD, "usd_rate": 40.0, "dry_run": True})
+        print(f"dry run  | {dry['portfolios']:>7} portfolios | {dry['users']:>6} investors | {dry['seconds']:>7.2f} s | {dry['portfolios_per_second']:>9.0f} portfolios/s")
+
+        run = await server.claim_payout_run(PERIOD, "bench_admin")
+        start = time.perf_counter()
+        result = await server.execute_payout_run(run)
+        print(f"real run | {result['portfolios']:>7} portfolios | {result['users']:>6} investors | {time.perf_counter() - start:>7.2f} s | {result['portfolios_per_second']:>9.0f} portfolios/s")
+
+        paid = await server.db.users.aggregate([{"$group": {"_id": None, "total": {"$sum": "$balance"}}}]).to_list(1)
+        assert abs(paid[0]['total'] - result['amount']) < 1, (paid, result['amount'])
+
+        # Replaying the whole period (as a crashed run would) must not pay anyone again
+        await server.execute_payout_run({**run, "last_user_id": None, "totals": None})
+        replay = await server.db.users.aggregate([{"$group": {"_id": None, "total": {"$sum": "$balance"}}}]).to_list(1)
+        assert abs(replay[0]['total'] - paid[0]['total']) < 1e-6
+        print(f"replay   | balances unchanged, {await server.db.transactions.count_documents({})} payout transactions")
+    finally:
+        await server.client.drop_database(os.environ['DB_NAME'])
+        server.client.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
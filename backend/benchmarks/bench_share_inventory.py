@@ -0,0 +1,101 @@
+"""
+Alarko Enerji - project share inventory load test
+Seeds a throwaway database with one project and many funded investors, fires
+thousands of concurrent buy requests at it through create_buy_request and
+checks that reserved + sold shares never exceed the project's total. Half of
+the accepted requests are then approved and half rejected, and a second wave
+must only be able to take the shares the rejections freed.
+
+Usage: MONGO_URL=mongodb://localhost:27017 python benchmarks/bench_share_inventory.py
+Env: BENCH_BUYS (default 5000), BENCH_PROJECT_SHARES (default 400)
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ['DB_NAME'] = os.environ.get('BENCH_DB_NAME', 'alarko_bench')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi import HTTPException  # noqa: E402
+import server  # noqa: E402
+
+BUYS = int(os.environ.get('BENCH_BUYS', '5000'))
+PROJECT_SHARES = int(os.environ.get('BENCH_PROJECT_SHARES', '400'))
+PROJECT_ID = "bench_project"
+
+
+async def seed() -> list:
+    db = server.db
+    for name in ("users", "projects", "trade_requests", "notifications", "portfolios", "project_investors", "ledger_entries"):
+        await db[name].delete_many({})
+    await server.ensure_indexes()
+    await db.projects.insert_one({
+        "project_id": PROJECT_ID, "name": "Bench GES", "type": "GES", "total_target": PROJECT_SHARES * server.SHARE_PRICE,
+        "funded_amount": 0.0, "funded_shares": 0, "investors_count": 0, "funding_baseline": {"amount": 0.0, "investors": 0},
+        "total_shares": PROJECT_SHARES, "reserved_shares": 0, "share_holds": [], "created_at": "2025-01-01T00:00:00+00:00"})
+    users = [{"user_id": f"user_{i:05d}", "email": f"user_{i:05d}@bench.test", "name": f"user_{i:05d}", "role": "investor",
+              "kyc_status": "approved", "balance": 3.0 * server.SHARE_PRICE, "unread_count": 0} for i in range(BUYS)]
+    await db.users.insert_many([dict(u) for u in users])
+    return users
+
+
+async def buy_wave(users: list) -> dict:
+    async def buy(user):
+        shares = random.randint(1, 3)
+        data = server.InvestRequest(project_id=PROJECT_ID, amount=shares * server.SHARE_PRICE)
+        try:
+            result = await server.create_buy_request(data, user, str(uuid.uuid4()))
+            return result["request"]
+        except HTTPException as e:
+            assert e.status_code == 400, e.detail
+            return None
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[buy(u) for u in users])
+    accepted = [r for r in results if r]
+    return {"accepted": accepted, "seconds": time.perf_counter() - start}
+
+
+async def check_inventory(label: str):
+    project = await server.db.projects.find_one({"project_id": PROJECT_ID})
+    holds = sum(h['shares'] for h in project['share_holds'])
+    open_shares = sum(r['shares'] async for r in server.db.trade_requests.find({"status": "pending"}))
+    assert project['reserved_shares'] == holds == open_shares, (project['reserved_shares'], holds, open_shares)
+    assert project['funded_shares'] + project['reserved_shares'] <= project['total_shares'], project
+    print(f"{label:<14}| funded {project['funded_shares']:>5} | reserved {project['reserved_shares']:>5} | "
+          f"total {project['total_shares']:>5} | available {server.available_shares(project):>5}")
+    return project
+
+
+async def main():
+    try:
+        users = await seed()
+        wave = await buy_wave(users)
+        print(f"wave 1        | {BUYS} concurrent buys | {len(wave['accepted'])} accepted | {wave['seconds']:.2f} s | "
+              f"{BUYS / wave['seconds']:.0f} requests/s")
+        await check_inventory("after wave 1")
+
+        accepted = wave['accepted']
+        approve, reject = accepted[::2], accepted[1::2]
+        await server.settle("trade_requests", [r['request_id'] for r in approve], "approved", "bench_admin")
+        await server.settle("trade_requests", [r['request_id'] for r in reject], "rejected", "bench_admin")
+        project = await check_inventory("after settle")
+        assert project['funded_shares'] == sum(r['shares'] for r in approve)
+
+        buyers = {r['user_id'] for r in accepted}
+        wave = await buy_wave([await server.db.users.find_one({"user_id": u['user_id']}, {"_id": 0})
+                               for u in users if u['user_id'] not in buyers])
+        print(f"wave 2        | {len(users) - len(buyers)} concurrent buys | {len(wave['accepted'])} accepted | {wave['seconds']:.2f} s")
+        await check_inventory("after wave 2")
+    finally:
+        await server.client.drop_database(os.environ['DB_NAME'])
+        server.client.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
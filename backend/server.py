@@ -1,8 +1,12 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, UploadFile, File
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
@@ -13,9 +17,21 @@ from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 import requests
-import shutil
 import asyncio
+import base64
+import bisect
+import csv
+import hashlib
+import io
+import json
+import math
+import re
+import threading
+import time
 import resend
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -44,6 +60,8 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
+# Runtime counters per subsystem, exposed on /api/admin/metrics
+METRICS = {}
 
 # ===== MODELS =====
 class UserRegister(BaseModel):
@@ -119,6 +137,14 @@ class RoleUpdate(BaseModel):
 class TransactionStatusUpdate(BaseModel):
     status: str
 
+class BulkStatusUpdate(BaseModel):
+    ids: List[str]
+    status: str
+
+class PayoutRunRequest(BaseModel):
+    period: str
+    dry_run: bool = False
+
 class PasswordChange(BaseModel):
     current_password: str
     new_password: str
@@ -130,11 +156,60 @@ class UserInfoUpdate(BaseModel):
     new_password: str = ""
 
 # ===== AUTH HELPERS =====
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', '4'))
+BCRYPT_MAX_QUEUE = int(os.environ.get('BCRYPT_MAX_QUEUE', '256'))
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+_bcrypt_pool = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix='bcrypt')
+_bcrypt_stats = {"workers": BCRYPT_WORKERS, "rounds": BCRYPT_ROUNDS, "queued": 0, "running": 0,
+                 "completed": 0, "rejected": 0, "rehashed": 0, "total_ms": 0.0}
+METRICS["bcrypt"] = _bcrypt_stats
+# "queued" counts admitted jobs and is only touched on the event loop; worker threads update the rest under the lock
+_bcrypt_lock = threading.Lock()
+
+def _bcrypt_call(fn, *args):
+    with _bcrypt_lock:
+        _bcrypt_stats["running"] += 1
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with _bcrypt_lock:
+            _bcrypt_stats["running"] -= 1
+            _bcrypt_stats["completed"] += 1
+            _bcrypt_stats["total_ms"] += elapsed_ms
+
+async def _run_bcrypt(fn, *args):
+    if _bcrypt_stats["queued"] >= BCRYPT_MAX_QUEUE:
+        _bcrypt_stats["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Sunucu yogun, lutfen tekrar deneyin")
+    _bcrypt_stats["queued"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_bcrypt_pool, _bcrypt_call, fn, *args)
+    finally:
+        # Also runs when the waiting request is cancelled before its job starts
+        _bcrypt_stats["queued"] -= 1
+
+def _hash_password_sync(password: str) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+async def hash_password(password: str) -> str:
+    return await _run_bcrypt(_hash_password_sync, password)
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode(), hashed.encode())
+async def verify_password(password: str, hashed: str) -> bool:
+    return await _run_bcrypt(bcrypt.checkpw, password.encode(), hashed.encode())
+
+def password_needs_rehash(hashed: str) -> bool:
+    try:
+        return int(hashed.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+async def rehash_if_needed(user: dict, password: str):
+    if password_needs_rehash(user['password_hash']):
+        await update_user(user['user_id'], {"$set": {"password_hash": await hash_password(password)}})
+        _bcrypt_stats["rehashed"] += 1
 
 def create_token(user_id: str, role: str) -> str:
     payload = {
@@ -144,41 +219,340 @@ def create_token(user_id: str, role: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_user(request: Request):
+# ===== USER CACHE =====
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '30'))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+# Opt-in: read-only routes over the caller's own data take their identity from the JWT without touching MongoDB
+AUTH_TRUST_TOKEN_CLAIMS = os.environ.get('AUTH_TRUST_TOKEN_CLAIMS', '').lower() in ('1', 'true', 'yes')
+_user_cache = OrderedDict()
+
+async def load_user(user_id: str):
+    now = time.monotonic()
+    entry = _user_cache.get(user_id)
+    if entry and entry[0] > now:
+        _user_cache.move_to_end(user_id)
+        return dict(entry[1])
+    user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+    if user:
+        _user_cache[user_id] = (now + USER_CACHE_TTL, user)
+        _user_cache.move_to_end(user_id)
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+        return dict(user)
+    _user_cache.pop(user_id, None)
+    return None
+
+def invalidate_user(user_id: str):
+    _user_cache.pop(user_id, None)
+
+async def update_user(user_id: str, update: dict, extra_filter: dict = None):
+    # Every users write goes through here so the auth cache never serves a stale document
+    result = await db.users.update_one({"user_id": user_id, **(extra_filter or {})}, update)
+    invalidate_user(user_id)
+    return result
+
+def decode_token(request: Request) -> dict:
     auth_header = request.headers.get('Authorization', '')
     token = auth_header.replace('Bearer ', '') if auth_header.startswith('Bearer ') else ''
+    payload = decode_jwt(token)
+    # Scoped tokens (e.g. the notification stream's) never authenticate regular requests
+    if payload.get('scope'):
+        raise HTTPException(status_code=401, detail="Gecersiz token")
+    return payload
+
+def decode_jwt(token: str) -> dict:
     if not token:
         raise HTTPException(status_code=401, detail="Token gerekli")
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user = await db.users.find_one({"user_id": payload['user_id']}, {"_id": 0})
-        if not user:
-            raise HTTPException(status_code=401, detail="Kullanici bulunamadi")
-        return user
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token suresi dolmus")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Gecersiz token")
 
+async def get_current_user(request: Request):
+    payload = decode_token(request)
+    user = await load_user(payload['user_id'])
+    if not user:
+        raise HTTPException(status_code=401, detail="Kullanici bulunamadi")
+    return user
+
 async def get_admin_user(request: Request):
     user = await get_current_user(request)
     if user.get('role') != 'admin':
         raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
     return user
 
-# ===== EMAIL HELPER =====
-async def send_email(to_email: str, subject: str, html: str):
-    if not RESEND_API_KEY:
-        logger.info(f"E-posta gonderilmedi (API key yok): {to_email} - {subject}")
+async def get_token_identity(request: Request):
+    # Only for a caller reading their own data; admin routes always check the role in MongoDB (get_admin_user)
+    if not AUTH_TRUST_TOKEN_CLAIMS:
+        return await get_current_user(request)
+    payload = decode_token(request)
+    return {"user_id": payload['user_id'], "role": payload.get('role', 'investor')}
+
+# ===== EMAIL OUTBOX =====
+# Handlers only enqueue into db.email_outbox; background workers deliver with retries,
+# exponential backoff and a dead-letter state, so a slow provider never holds a response.
+EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', '2'))
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', '20'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '6'))
+EMAIL_BACKOFF_SECONDS = float(os.environ.get('EMAIL_BACKOFF_SECONDS', '30'))
+EMAIL_POLL_SECONDS = float(os.environ.get('EMAIL_POLL_SECONDS', '5'))
+EMAIL_SENDING_TIMEOUT_SECONDS = 300
+_email_stats = {"enqueued": 0, "sent": 0, "failed_attempts": 0, "dead": 0}
+_email_workers = {"tasks": [], "wakeup": None}
+METRICS["email"] = _email_stats
+
+async def resend_email_sender(msg: dict):
+    params = {"from": SENDER_EMAIL, "to": [msg['to']], "subject": msg['subject'], "html": msg['html']}
+    await asyncio.to_thread(resend.Emails.send, params)
+
+async def log_email_sender(msg: dict):
+    logger.info(f"E-posta gonderilmedi (API key yok): {msg['to']} - {msg['subject']}")
+
+def file_email_sender(path: str):
+    def append(line: str):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    async def send(msg: dict):
+        line = json.dumps({**msg, "sent_at": datetime.now(timezone.utc).isoformat()}, ensure_ascii=False, default=str) + "\n"
+        await asyncio.to_thread(append, line)
+    return send
+
+memory_email_sink = []
+
+async def memory_email_sender(msg: dict):
+    memory_email_sink.append(msg)
+
+def _default_email_sender():
+    provider = os.environ.get('EMAIL_PROVIDER', 'resend' if RESEND_API_KEY else 'log')
+    if provider == 'file':
+        return file_email_sender(os.environ.get('EMAIL_SINK_FILE', str(ROOT_DIR / 'email_outbox.jsonl')))
+    return {"resend": resend_email_sender, "memory": memory_email_sender}.get(provider, log_email_sender)
+
+# Swappable in tests/benchmarks via set_email_sender(async_fn)
+email_sender = _default_email_sender()
+
+def set_email_sender(sender):
+    global email_sender
+    email_sender = sender
+
+async def send_email(to_email: str, subject: str, html: str, email_id: str = None):
+    now = datetime.now(timezone.utc)
+    # A fixed email_id makes a re-run of the same operation enqueue the message only once
+    if not await insert_many_once(db.email_outbox, [{
+        "email_id": email_id or str(uuid.uuid4()), "to": to_email, "subject": subject, "html": html,
+        "status": "pending", "attempts": 0, "next_attempt_at": now, "last_error": None,
+        "created_at": now.isoformat()
+    }]):
         return
+    _email_stats["enqueued"] += 1
+    if _email_workers["wakeup"]:
+        _email_workers["wakeup"].set()
+
+async def _claim_email_batch() -> list:
+    now = datetime.now(timezone.utc)
+    due = {"$or": [{"status": "pending", "next_attempt_at": {"$lte": now}},
+                   {"status": "sending", "claimed_at": {"$lt": now - timedelta(seconds=EMAIL_SENDING_TIMEOUT_SECONDS)}}]}
+    ids = [d['email_id'] async for d in db.email_outbox.find(due, {"_id": 0, "email_id": 1}).sort("next_attempt_at", 1).limit(EMAIL_BATCH_SIZE)]
+    if not ids:
+        return []
+    claim_id = uuid.uuid4().hex
+    await db.email_outbox.update_many({"email_id": {"$in": ids}, **due},
+                                      {"$set": {"status": "sending", "claim_id": claim_id, "claimed_at": now}})
+    return await db.email_outbox.find({"email_id": {"$in": ids}, "claim_id": claim_id}, {"_id": 0}).to_list(len(ids))
+
+async def _deliver_email(msg: dict):
     try:
-        params = {"from": SENDER_EMAIL, "to": [to_email], "subject": subject, "html": html}
-        await asyncio.to_thread(resend.Emails.send, params)
-        logger.info(f"E-posta gonderildi: {to_email} - {subject}")
+        await email_sender(msg)
     except Exception as e:
-        logger.error(f"E-posta gonderilemedi: {to_email} - {e}")
+        attempts = msg.get('attempts', 0) + 1
+        _email_stats["failed_attempts"] += 1
+        if attempts >= EMAIL_MAX_ATTEMPTS:
+            _email_stats["dead"] += 1
+            logger.error(f"E-posta gonderilemedi, dead-letter: {msg['to']} - {e}")
+            update = {"status": "dead", "attempts": attempts, "last_error": str(e)}
+        else:
+            logger.warning(f"E-posta gonderilemedi, tekrar denenecek ({attempts}): {msg['to']} - {e}")
+            retry_at = datetime.now(timezone.utc) + timedelta(seconds=EMAIL_BACKOFF_SECONDS * 2 ** (attempts - 1))
+            update = {"status": "pending", "attempts": attempts, "last_error": str(e), "next_attempt_at": retry_at}
+        await db.email_outbox.update_one({"email_id": msg['email_id']}, {"$set": update})
+        return
+    _email_stats["sent"] += 1
+    logger.info(f"E-posta gonderildi: {msg['to']} - {msg['subject']}")
+    # Bodies can carry credentials (new account emails); drop them once delivered
+    await db.email_outbox.update_one({"email_id": msg['email_id']}, {
+        "$set": {"status": "sent", "sent_at": datetime.now(timezone.utc).isoformat(), "attempts": msg.get('attempts', 0) + 1},
+        "$unset": {"html": "", "claim_id": ""}})
+
+async def email_worker():
+    while True:
+        try:
+            batch = await _claim_email_batch()
+            if batch:
+                await asyncio.gather(*(_deliver_email(m) for m in batch))
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"E-posta kuyrugu hatasi: {e}")
+        _email_workers["wakeup"].clear()
+        try:
+            await asyncio.wait_for(_email_workers["wakeup"].wait(), EMAIL_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+@app.on_event("startup")
+async def start_email_workers():
+    _email_workers["wakeup"] = asyncio.Event()
+    _email_workers["tasks"] = [asyncio.create_task(email_worker()) for _ in range(EMAIL_WORKERS)]
+
+@app.on_event("shutdown")
+async def stop_email_workers():
+    for task in _email_workers["tasks"]:
+        task.cancel()
+
+# ===== USER ENRICHMENT =====
+USER_FIELD_MAP = {"name": "user_name", "email": "user_email"}
+
+async def attach_user_fields(rows: list, fields: dict = None, key: str = 'user_id') -> list:
+    # Decorates rows with user fields using one $in query instead of a find_one per row
+    fields = fields or USER_FIELD_MAP
+    user_ids = list({r[key] for r in rows if r.get(key)})
+    if not user_ids:
+        return rows
+    projection = {"_id": 0, "user_id": 1, **{f: 1 for f in fields}}
+    users = {u['user_id']: u async for u in db.users.find({"user_id": {"$in": user_ids}}, projection)}
+    for r in rows:
+        u = users.get(r.get(key))
+        if u:
+            for src, dst in fields.items():
+                r[dst] = u.get(src, '')
+    return rows
+
+# ===== PAGINATION =====
+MAX_PAGE_LIMIT = 1000
+
+def encode_cursor(sort_value, id_value) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort_value, id_value]).encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        sort_value, id_value = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return sort_value, id_value
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Gecersiz sayfa imleci")
+
+async def keyset_page(collection, query: dict, id_field: str, cursor: str = None, limit: int = 100,
+                      sort_field: str = 'created_at', direction: int = -1, projection: dict = None):
+    # Stable (sort_field, id_field) ordering; returns the page and an opaque cursor for the next one
+    limit = min(max(limit, 1), MAX_PAGE_LIMIT)
+    if cursor:
+        sort_value, id_value = decode_cursor(cursor)
+        op = '$lt' if direction < 0 else '$gt'
+        after = {"$or": [{sort_field: {op: sort_value}}, {sort_field: sort_value, id_field: {op: id_value}}]}
+        query = {"$and": [query, after]} if query else after
+    items = await collection.find(query, projection or {"_id": 0}).sort([(sort_field, direction), (id_field, direction)]).to_list(limit + 1)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1].get(sort_field), items[-1].get(id_field))
+    return items, next_cursor
+
+def page_from_list(items: list, id_field: str, cursor: str = None, limit: int = 100, sort_field: str = 'created_at'):
+    # keyset_page over an in-memory list already sorted ascending by (sort_field, id_field)
+    limit = min(max(limit, 1), MAX_PAGE_LIMIT)
+    start = 0
+    if cursor:
+        after = tuple(v or '' for v in decode_cursor(cursor))
+        start = bisect.bisect_right([(i.get(sort_field) or '', i[id_field]) for i in items], after)
+    page = items[start:start + limit]
+    next_cursor = None
+    if start + limit < len(items):
+        next_cursor = encode_cursor(page[-1].get(sort_field), page[-1].get(id_field))
+    return page, next_cursor
+
+def set_next_cursor(response: Response, next_cursor: str):
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+
+# ===== IDEMPOTENCY KEYS =====
+# Create endpoints accept an Idempotency-Key header. The first request claims the key with a
+# unique insert and stores its response; a retry with the same key gets that response back
+# without running the handler again. Documents a keyed request creates take ids derived from
+# the key, so re-running a request whose holder died mid-way cannot create them twice.
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '60'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+_idempotency_stats = {"claimed": 0, "replayed": 0, "in_progress": 0, "mismatched": 0, "released": 0, "taken_over": 0}
+METRICS["idempotency"] = _idempotency_stats
+
+def request_fingerprint(request: Request, payload: dict) -> str:
+    return hashlib.sha256(json.dumps([request.method, request.url.path, payload], sort_keys=True, default=str).encode()).hexdigest()
+
+async def claim_idempotency_key(key_id: str, fingerprint: str):
+    # Returns None once this request holds the key, otherwise the stored record
+    for _ in range(2):
+        now = datetime.now(timezone.utc)
+        try:
+            await db.idempotency_keys.insert_one({"key_id": key_id, "fingerprint": fingerprint, "status": "processing",
+                                                  "created_at": now, "locked_at": now})
+            _idempotency_stats["claimed"] += 1
+            return None
+        except DuplicateKeyError:
+            pass
+        # A holder that crashed leaves its lock behind; after IDEMPOTENCY_LOCK_SECONDS a retry takes over
+        if await db.idempotency_keys.find_one_and_update(
+                {"key_id": key_id, "fingerprint": fingerprint, "status": "processing",
+                 "locked_at": {"$lt": now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}},
+                {"$set": {"locked_at": now}}):
+            _idempotency_stats["taken_over"] += 1
+            return None
+        existing = await db.idempotency_keys.find_one({"key_id": key_id}, {"_id": 0})
+        if existing:
+            return existing
+    raise HTTPException(status_code=409, detail="Ayni istek hala isleniyor")
+
+async def idempotent(request: Request, user_id: str, payload: dict, handler):
+    # handler(new_id) runs the request; new_id is the id for the document it creates
+    key = request.headers.get('Idempotency-Key')
+    if not key:
+        return await handler(str(uuid.uuid4()))
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key en fazla {IDEMPOTENCY_KEY_MAX_LENGTH} karakter olabilir")
+    key_id = f"{user_id}:{request.url.path}:{key}"
+    fingerprint = request_fingerprint(request, payload)
+    existing = await claim_idempotency_key(key_id, fingerprint)
+    if existing:
+        if existing['fingerprint'] != fingerprint:
+            _idempotency_stats["mismatched"] += 1
+            raise HTTPException(status_code=422, detail="Idempotency-Key farkli bir istek icin kullanilmis")
+        if existing['status'] == 'processing':
+            _idempotency_stats["in_progress"] += 1
+            raise HTTPException(status_code=409, detail="Ayni istek hala isleniyor")
+        _idempotency_stats["replayed"] += 1
+        return JSONResponse(existing['response'], status_code=existing['status_code'], headers={"Idempotent-Replayed": "true"})
+    try:
+        result = await handler(derived_id(key_id, 'idempotency'))
+    except HTTPException:
+        # Rejected requests write nothing, so the key is freed for a corrected retry
+        await db.idempotency_keys.delete_one({"key_id": key_id})
+        _idempotency_stats["released"] += 1
+        raise
+    await db.idempotency_keys.update_one({"key_id": key_id}, {"$set": {
+        "status": "done", "status_code": 200, "response": jsonable_encoder(result),
+        "completed_at": datetime.now(timezone.utc)}})
+    return result
 
 # ===== AUTH ROUTES =====
+# Credentials and ledger/hold bookkeeping stay server-side
+HIDDEN_USER_FIELDS = ('password_hash', 'holds', 'pending_ops', 'ledger_pending', 'ledger_seq', 'last_payout_period')
+USER_PROJECTION = {"_id": 0, **dict.fromkeys(HIDDEN_USER_FIELDS, 0)}
+
+def public_user(user: dict) -> dict:
+    return {k: v for k, v in user.items() if k != '_id' and k not in HIDDEN_USER_FIELDS}
+
 @api_router.post("/auth/login")
 async def login(data: UserLogin):
     user = await db.users.find_one({"email": data.email}, {"_id": 0})
@@ -188,11 +562,11 @@ async def login(data: UserLogin):
         raise HTTPException(status_code=401, detail="Bu giris yontemi sadece admin icin gecerlidir")
     if not user.get('password_hash'):
         raise HTTPException(status_code=401, detail="Bu hesap Google ile olusturulmus. Google ile giris yapin.")
-    if not verify_password(data.password, user['password_hash']):
+    if not await verify_password(data.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="E-posta veya sifre hatali")
+    await rehash_if_needed(user, data.password)
     token = create_token(user['user_id'], user['role'])
-    user_data = {k: v for k, v in user.items() if k != 'password_hash'}
-    return {"token": token, "user": user_data}
+    return {"token": token, "user": public_user(user)}
 
 @api_router.post("/auth/login-investor")
 async def login_investor(data: InvestorLogin):
@@ -201,11 +575,11 @@ async def login_investor(data: InvestorLogin):
         raise HTTPException(status_code=401, detail="TC Kimlik No veya sifre hatali")
     if not user.get('password_hash'):
         raise HTTPException(status_code=401, detail="Sifre tanimlanmamis. Lutfen admin ile iletisime gecin.")
-    if not verify_password(data.password, user['password_hash']):
+    if not await verify_password(data.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="TC Kimlik No veya sifre hatali")
+    await rehash_if_needed(user, data.password)
     token = create_token(user['user_id'], user['role'])
-    user_data = {k: v for k, v in user.items() if k != 'password_hash'}
-    return {"token": token, "user": user_data}
+    return {"token": token, "user": public_user(user)}
 
 @api_router.post("/auth/google-callback")
 async def google_callback(data: GoogleAuthCallback):
@@ -225,7 +599,7 @@ async def google_callback(data: GoogleAuthCallback):
     picture = auth_data.get('picture', '')
     existing = await db.users.find_one({"email": email}, {"_id": 0})
     if existing:
-        await db.users.update_one({"email": email}, {"$set": {"name": name, "picture": picture}})
+        await update_user(existing['user_id'], {"$set": {"name": name, "picture": picture}})
         user = await db.users.find_one({"email": email}, {"_id": 0})
         token = create_token(user['user_id'], user['role'])
     else:
@@ -238,34 +612,85 @@ async def google_callback(data: GoogleAuthCallback):
         }
         await db.users.insert_one(user)
         token = create_token(user_id, "investor")
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": user_id,
-            "title": "Hos Geldiniz!", "message": "Alarko Enerji platformuna hos geldiniz.",
-            "type": "welcome", "is_read": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-    user_data = {k: v for k, v in user.items() if k != 'password_hash'}
-    return {"token": token, "user": user_data}
+        await notify("welcome", user_id)
+    return {"token": token, "user": public_user(user)}
 
 @api_router.get("/auth/me")
 async def get_me(user=Depends(get_current_user)):
-    return {k: v for k, v in user.items() if k != 'password_hash'}
+    return {**public_user(user), "available_balance": available_balance(user)}
+
+# ===== PROJECT CATALOG =====
+# Every worker serves the catalog from memory. Each projects write bumps catalog_meta.version;
+# workers compare their copy with it at most every CATALOG_CHECK_SECONDS and reload on change.
+# Responses carry a strong ETag over the exact body so clients and CDNs revalidate with a 304.
+CATALOG_CHECK_SECONDS = float(os.environ.get('CATALOG_CHECK_SECONDS', '1'))
+CATALOG_RESPONSE_CACHE_SIZE = 512
+_catalog = {"version": None, "checked_at": 0.0, "projects": [], "by_id": {}, "by_type": {}, "responses": {}}
+_catalog_stats = {"hits": 0, "reloads": 0, "not_modified": 0}
+METRICS["catalog"] = _catalog_stats
+
+async def bump_catalog_version():
+    await db.catalog_meta.update_one({"_id": "projects"}, {"$inc": {"version": 1}}, upsert=True)
+    _catalog["checked_at"] = 0.0
+
+async def current_catalog() -> dict:
+    now = time.monotonic()
+    if _catalog["version"] is not None and now - _catalog["checked_at"] < CATALOG_CHECK_SECONDS:
+        _catalog_stats["hits"] += 1
+        return _catalog
+    meta = await db.catalog_meta.find_one({"_id": "projects"})
+    version = (meta or {}).get('version', 0)
+    if version != _catalog["version"]:
+        projects = await db.projects.find({}, {"_id": 0, "pending_ops": 0, "share_holds": 0}).to_list(None)
+        projects.sort(key=lambda p: (p.get('created_at') or '', p['project_id']))
+        by_type = {}
+        for p in projects:
+            by_type.setdefault(p.get('type', ''), []).append(p)
+        _catalog.update(version=version, projects=projects, by_id={p['project_id']: p for p in projects},
+                        by_type=by_type, responses={})
+        _catalog_stats["reloads"] += 1
+    else:
+        _catalog_stats["hits"] += 1
+    _catalog["checked_at"] = now
+    return _catalog
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get('If-None-Match', '')
+    return header.strip() == '*' or etag in (t.strip().removeprefix('W/') for t in header.split(','))
+
+def catalog_response(request: Request, key: tuple, build) -> Response:
+    cached = _catalog["responses"].get(key)
+    if not cached:
+        data, next_cursor = build()
+        body = json.dumps(data, ensure_ascii=False, default=str).encode()
+        cached = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"', next_cursor)
+        if len(_catalog["responses"]) >= CATALOG_RESPONSE_CACHE_SIZE:
+            _catalog["responses"].clear()
+        _catalog["responses"][key] = cached
+    body, etag, next_cursor = cached
+    headers = {"ETag": etag, "Cache-Control": "public, no-cache"}
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+    if etag_matches(request, etag):
+        _catalog_stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # ===== PROJECT ROUTES =====
 @api_router.get("/projects")
-async def get_projects(type: str = None):
-    query = {}
-    if type and type.lower() != 'all':
-        query['type'] = type.upper()
-    projects = await db.projects.find(query, {"_id": 0}).to_list(100)
-    return projects
+async def get_projects(request: Request, type: str = None, cursor: str = None, limit: int = 100):
+    catalog = await current_catalog()
+    view = catalog["by_type"].get(type.upper(), []) if type and type.lower() != 'all' else catalog["projects"]
+    return catalog_response(request, ("list", (type or 'all').upper(), cursor, limit),
+                            lambda: page_from_list(view, 'project_id', cursor, limit))
 
 @api_router.get("/projects/{project_id}")
-async def get_project(project_id: str):
-    project = await db.projects.find_one({"project_id": project_id}, {"_id": 0})
+async def get_project(project_id: str, request: Request):
+    catalog = await current_catalog()
+    project = catalog["by_id"].get(project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Proje bulunamadi")
-    return project
+    return catalog_response(request, ("item", project_id), lambda: (project, None))
 
 @api_router.post("/admin/projects")
 async def create_project(data: ProjectCreate, user=Depends(get_admin_user)):
@@ -273,51 +698,406 @@ async def create_project(data: ProjectCreate, user=Depends(get_admin_user)):
         "project_id": str(uuid.uuid4()), "name": data.name, "type": data.type.upper(),
         "description": data.description, "location": data.location, "capacity": data.capacity,
         "return_rate": data.return_rate, "total_target": data.total_target,
-        "funded_amount": 0.0, "investors_count": 0, "image_url": data.image_url,
+        "funded_amount": 0.0, "funded_shares": 0, "investors_count": 0, "image_url": data.image_url,
+        "funding_baseline": {"amount": 0.0, "investors": 0},
+        "total_shares": project_total_shares(data.total_target), "reserved_shares": 0, "share_holds": [],
         "details": data.details, "status": "active",
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.projects.insert_one(project)
+    await bump_catalog_version()
     return {k: v for k, v in project.items() if k != '_id'}
 
 @api_router.put("/admin/projects/{project_id}")
 async def update_project(project_id: str, data: ProjectCreate, user=Depends(get_admin_user)):
-    await db.projects.update_one({"project_id": project_id}, {"$set": data.model_dump()})
-    project = await db.projects.find_one({"project_id": project_id}, {"_id": 0})
+    await db.projects.update_one({"project_id": project_id}, {"$set": {**data.model_dump(), "total_shares": project_total_shares(data.total_target)}})
+    await bump_catalog_version()
+    project = await db.projects.find_one({"project_id": project_id}, {"_id": 0, "share_holds": 0})
     return project
 
+# ===== PROJECT STATS =====
+# projects.funded_amount / funded_shares / investors_count follow every portfolio mutation.
+# project_investors keeps one row per (project, investor) with the shares held, so an
+# investor is counted once and only while holding shares. rebuild_project_stats recomputes
+# everything from portfolios with one aggregation.
+async def record_holding_change(project_id: str, user_id: str, shares: int, amount: float, op_id: str = None):
+    if not project_id or not shares:
+        return
+    holder_id = f"{project_id}:{user_id}"
+    if not op_id:
+        before = await db.project_investors.find_one_and_update(
+            {"holder_id": holder_id},
+            {"$inc": {"shares": shares}, "$setOnInsert": {"project_id": project_id, "user_id": user_id}}, upsert=True)
+        held = (before or {}).get('shares', 0)
+        investors = int(held <= 0 < held + shares) - int(held > 0 >= held + shares)
+        await db.projects.update_one({"project_id": project_id},
+            {"$inc": {"funded_amount": round(amount, 2), "funded_shares": shares, "investors_count": investors}})
+        return
+    # The investors delta is stored on the holder row so a replay of the same op
+    # applies the identical investors_count change to the project.
+    op_guard = {"pending_ops": {"$ne": op_id}}
+    recorded = {"op_investors": {"$elemMatch": {"op_id": op_id}}}
+    held, after = {"$ifNull": ["$shares", 0]}, {"$add": [{"$ifNull": ["$shares", 0]}, shares]}
+    delta = {"$subtract": [
+        {"$cond": [{"$and": [{"$lte": [held, 0]}, {"$gt": [after, 0]}]}, 1, 0]},
+        {"$cond": [{"$and": [{"$gt": [held, 0]}, {"$lte": [after, 0]}]}, 1, 0]}]}
+    try:
+        holder = await with_retry(lambda: db.project_investors.find_one_and_update(
+            {"holder_id": holder_id, **op_guard},
+            [{"$set": {
+                "op_investors": {"$concatArrays": [{"$ifNull": ["$op_investors", []]},
+                                                   [{"op_id": {"$literal": op_id}, "investors": delta}]]},
+                "shares": after,
+                "project_id": {"$literal": project_id}, "user_id": {"$literal": user_id},
+                "pending_ops": {"$setUnion": [{"$ifNull": ["$pending_ops", []]}, [{"$literal": op_id}]]}}}],
+            upsert=True, projection=recorded, return_document=ReturnDocument.AFTER))
+    except DuplicateKeyError:
+        holder = await db.project_investors.find_one({"holder_id": holder_id}, recorded)
+    investors = ((holder or {}).get('op_investors') or [{}])[0].get('investors', 0)
+    await with_retry(lambda: db.projects.update_one({"project_id": project_id, **op_guard},
+        {"$inc": {"funded_amount": round(amount, 2), "funded_shares": shares, "investors_count": investors},
+         "$addToSet": {"pending_ops": op_id}}))
+
+async def rebuild_project_stats(project_ids: list = None) -> dict:
+    match = {"project_id": {"$in": project_ids}} if project_ids is not None else {}
+    holdings = await db.portfolios.aggregate([
+        {"$match": match},
+        {"$group": {"_id": {"project_id": "$project_id", "user_id": "$user_id"},
+                    "shares": {"$sum": "$shares"}, "amount": {"$sum": "$amount"}}},
+    ], allowDiskUse=True).to_list(None)
+    totals = {}
+    for h in holdings:
+        t = totals.setdefault(h['_id']['project_id'], {"amount": 0.0, "shares": 0, "investors": 0})
+        t["amount"] += h['amount']
+        t["shares"] += h['shares']
+        t["investors"] += h['shares'] > 0
+    projects = await db.projects.find(match, {"_id": 0, "project_id": 1, "funded_amount": 1, "investors_count": 1, "funding_baseline": 1}).to_list(None)
+    ops = []
+    for p in projects:
+        t = totals.get(p['project_id'], {"amount": 0.0, "shares": 0, "investors": 0})
+        # Figures that predate portfolio tracking (seed data, legacy counters) become a fixed baseline
+        baseline = p.get('funding_baseline') or {"amount": max(p.get('funded_amount', 0) - t['amount'], 0.0),
+                                                 "investors": max(p.get('investors_count', 0) - t['investors'], 0)}
+        ops.append(UpdateOne({"project_id": p['project_id']}, {"$set": {
+            "funding_baseline": baseline, "funded_amount": round(baseline['amount'] + t['amount'], 2),
+            "funded_shares": t['shares'], "investors_count": baseline['investors'] + t['investors']}}))
+    if ops:
+        await db.projects.bulk_write(ops, ordered=False)
+        await bump_catalog_version()
+    holder_ids = [f"{h['_id']['project_id']}:{h['_id']['user_id']}" for h in holdings]
+    if holdings:
+        await db.project_investors.bulk_write([UpdateOne({"holder_id": hid}, {"$set": {
+            "project_id": h['_id']['project_id'], "user_id": h['_id']['user_id'], "shares": h['shares']}}, upsert=True)
+            for hid, h in zip(holder_ids, holdings)], ordered=False)
+    await db.project_investors.delete_many({**match, "holder_id": {"$nin": holder_ids}})
+    return {"projects": len(ops), "holders": len(holdings)}
+
+@app.on_event("startup")
+async def backfill_project_stats():
+    missing = await db.projects.distinct("project_id", {"funding_baseline": {"$exists": False}})
+    if missing:
+        result = await rebuild_project_stats(missing)
+        logger.info(f"Proje fonlama istatistikleri olusturuldu: {result['projects']} proje")
+
 # ===== USD RATE =====
 SHARE_PRICE = 25000
-_usd_cache = {"rate": 38.0, "updated_at": None}
+USD_RATE_URL = os.environ.get('USD_RATE_URL', 'https://open.er-api.com/v6/latest/USD')
+USD_RATE_REFRESH_SECONDS = int(os.environ.get('USD_RATE_REFRESH_SECONDS', '3600'))
+USD_RATE_LEASE_SECONDS = 30
+_usd_cache = {"rate": 38.0, "updated_at": None, "refreshes": 0, "failures": 0}
+_usd_refresh = {"inflight": None, "worker": None}
+METRICS["usd_rate"] = _usd_cache
+
+async def fetch_usd_rate_er_api() -> float:
+    resp = await asyncio.to_thread(requests.get, USD_RATE_URL, timeout=5)
+    resp.raise_for_status()
+    return float(resp.json()["rates"]["TRY"])
+
+# Swappable in tests/benchmarks via set_usd_rate_provider(async_fn)
+usd_rate_provider = fetch_usd_rate_er_api
+
+def set_usd_rate_provider(provider):
+    global usd_rate_provider
+    usd_rate_provider = provider
+
+def usd_rate_is_stale(grace: float = 0) -> bool:
+    updated_at = _usd_cache["updated_at"]
+    return not updated_at or (datetime.now(timezone.utc) - updated_at).total_seconds() >= USD_RATE_REFRESH_SECONDS + grace
+
+# Sorted in-memory mirror of db.usd_rates for O(log n) point-in-time lookups
+_usd_history = {"ts": [], "rates": []}
+
+def _as_utc(dt: datetime) -> datetime:
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+def _remember_usd_rate(rate: float, fetched_at: datetime):
+    ts = _as_utc(fetched_at).timestamp()
+    i = bisect.bisect_left(_usd_history["ts"], ts)
+    if i < len(_usd_history["ts"]) and _usd_history["ts"][i] == ts:
+        return
+    _usd_history["ts"].insert(i, ts)
+    _usd_history["rates"].insert(i, rate)
+    if not _usd_cache["updated_at"] or _as_utc(fetched_at) > _usd_cache["updated_at"]:
+        _usd_cache["rate"] = rate
+        _usd_cache["updated_at"] = _as_utc(fetched_at)
+
+def usd_rate_at(at: datetime):
+    # Rate in effect at `at`: the latest recorded rate fetched at or before it
+    i = bisect.bisect_right(_usd_history["ts"], _as_utc(at).timestamp()) - 1
+    if i < 0:
+        return None
+    return {"rate": _usd_history["rates"][i], "fetched_at": datetime.fromtimestamp(_usd_history["ts"][i], timezone.utc)}
+
+async def sync_usd_rate_history():
+    # Every rate recorded since the newest one this worker knows, so all workers answer usd_rate_at() alike
+    query = {}
+    if _usd_history["ts"]:
+        query["fetched_at"] = {"$gt": datetime.fromtimestamp(_usd_history["ts"][-1], timezone.utc)}
+    async for doc in db.usd_rates.find(query, {"_id": 0, "rate": 1, "fetched_at": 1}).sort("fetched_at", 1):
+        _remember_usd_rate(doc['rate'], doc['fetched_at'])
+
+async def load_usd_rate_history():
+    await sync_usd_rate_history()
+    logger.info(f"USD/TRY kur gecmisi yuklendi: {len(_usd_history['ts'])} kayit")
 
-def get_usd_rate():
+async def acquire_usd_rate_lease() -> bool:
+    # One worker at a time calls the provider; the lease simply expires, so a crashed holder blocks nobody for long
     now = datetime.now(timezone.utc)
-    if _usd_cache["updated_at"] and (now - _usd_cache["updated_at"]).total_seconds() < 3600:
-        return _usd_cache["rate"]
     try:
-        resp = requests.get("https://open.er-api.com/v6/latest/USD", timeout=5)
-        if resp.status_code == 200:
-            data = resp.json()
-            rate = data.get("rates", {}).get("TRY", 38.0)
-            _usd_cache["rate"] = round(rate, 4)
-            _usd_cache["updated_at"] = now
-            logger.info(f"USD/TRY kuru guncellendi: {_usd_cache['rate']}")
+        await db.usd_rate_lease.update_one({"_id": "provider", "until": {"$lt": now}},
+                                           {"$set": {"until": now + timedelta(seconds=USD_RATE_LEASE_SECONDS)}}, upsert=True)
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def _refresh_usd_rate_once() -> float:
+    try:
+        # Another worker may already have fetched a fresh rate; share it instead of calling the API again
+        await sync_usd_rate_history()
+        if not usd_rate_is_stale() or not await acquire_usd_rate_lease():
+            return _usd_cache["rate"]
+        rate = round(await usd_rate_provider(), 4)
+        # Millisecond precision, as MongoDB stores it, so the synced copy matches this worker's own entry
+        now = datetime.now(timezone.utc)
+        fetched_at = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        await db.usd_rates.insert_one({"rate": rate, "fetched_at": fetched_at, "source": USD_RATE_URL})
+        _remember_usd_rate(rate, fetched_at)
+        _usd_cache["refreshes"] += 1
+        logger.info(f"USD/TRY kuru guncellendi: {_usd_cache['rate']}")
     except Exception as e:
+        _usd_cache["failures"] += 1
         logger.warning(f"USD kuru alinamadi, cache kullaniliyor: {e}")
     return _usd_cache["rate"]
 
+async def refresh_usd_rate() -> float:
+    # Single-flight: concurrent callers share one provider call
+    inflight = _usd_refresh["inflight"]
+    if inflight is None or inflight.done():
+        inflight = _usd_refresh["inflight"] = asyncio.create_task(_refresh_usd_rate_once())
+    return await asyncio.shield(inflight)
+
+def get_usd_rate() -> float:
+    # Never blocks: returns the last good rate and schedules a refresh if it has gone stale
+    if usd_rate_is_stale():
+        inflight = _usd_refresh["inflight"]
+        if inflight is None or inflight.done():
+            try:
+                _usd_refresh["inflight"] = asyncio.get_running_loop().create_task(_refresh_usd_rate_once())
+            except RuntimeError:
+                pass
+    return _usd_cache["rate"]
+
+async def usd_rate_worker():
+    while True:
+        await refresh_usd_rate()
+        await asyncio.sleep(USD_RATE_REFRESH_SECONDS)
+
+@app.on_event("startup")
+async def start_usd_rate_worker():
+    await load_usd_rate_history()
+    _usd_refresh["worker"] = asyncio.create_task(usd_rate_worker())
+
+@app.on_event("shutdown")
+async def stop_usd_rate_worker():
+    if _usd_refresh["worker"]:
+        _usd_refresh["worker"].cancel()
+
 @api_router.get("/usd-rate")
 async def get_usd_rate_endpoint():
     rate = get_usd_rate()
-    return {"rate": rate, "share_price": SHARE_PRICE}
+    return {"rate": rate, "share_price": SHARE_PRICE, "updated_at": _usd_cache["updated_at"], "stale": usd_rate_is_stale()}
+
+@api_router.get("/usd-rate/history")
+async def get_usd_rate_at(at: datetime):
+    point = usd_rate_at(at)
+    if not point:
+        raise HTTPException(status_code=404, detail="Bu tarih icin kur kaydi bulunamadi")
+    return point
+
+# ===== PROJECT INVENTORY =====
+# A project has total_shares = total_target / SHARE_PRICE shares. Shares behind the seed
+# funding_baseline and committed funded_shares are sold. A pending buy request reserves its
+# shares in projects.share_holds / reserved_shares with one conditional find_one_and_update, so
+# concurrent buys can never take a project past its target. Approval commits the shares to
+# funded_shares before the hold is released; rejection only releases the hold.
+INVENTORY_HOLD_GRACE_SECONDS = 60
+_inventory_stats = {"reserved": 0, "sold_out": 0, "released": 0, "reconciled": 0}
+METRICS["inventory"] = _inventory_stats
+AVAILABLE_SHARES = {"$subtract": [{"$ifNull": ["$total_shares", 0]}, {"$add": [
+    {"$ceil": {"$divide": [{"$ifNull": ["$funding_baseline.amount", 0]}, SHARE_PRICE]}},
+    {"$ifNull": ["$funded_shares", 0]}, {"$ifNull": ["$reserved_shares", 0]}]}]}
+
+def project_total_shares(total_target: float) -> int:
+    return int(total_target // SHARE_PRICE)
+
+def available_shares(project: dict) -> int:
+    baseline = math.ceil((project.get('funding_baseline') or {}).get('amount', 0) / SHARE_PRICE)
+    return project.get('total_shares', 0) - baseline - project.get('funded_shares', 0) - project.get('reserved_shares', 0)
+
+async def reserve_project_shares(project_id: str, hold_id: str, shares: int) -> dict:
+    fields = {"_id": 0, "project_id": 1, "name": 1, "type": 1}
+    project = await db.projects.find_one_and_update(
+        {"project_id": project_id, "share_holds.hold_id": {"$ne": hold_id}, "$expr": {"$gte": [AVAILABLE_SHARES, shares]}},
+        {"$inc": {"reserved_shares": shares},
+         "$push": {"share_holds": {"hold_id": hold_id, "shares": shares, "at": datetime.now(timezone.utc).isoformat()}}},
+        projection=fields, return_document=ReturnDocument.AFTER)
+    if project:
+        _inventory_stats["reserved"] += 1
+        return project
+    project = await db.projects.find_one({"project_id": project_id}, {
+        **fields, "total_shares": 1, "funding_baseline": 1, "funded_shares": 1, "reserved_shares": 1,
+        "share_holds": {"$elemMatch": {"hold_id": hold_id}}})
+    if not project:
+        raise HTTPException(status_code=404, detail="Proje bulunamadi")
+    # A re-run of the same keyed request finds its shares already reserved
+    if project.get('share_holds'):
+        return project
+    _inventory_stats["sold_out"] += 1
+    raise HTTPException(status_code=400, detail=f"Projede yeterli hisse kalmadi (kalan: {max(available_shares(project), 0)} hisse)")
+
+async def release_share_holds(holds: list):
+    # holds: (project_id, hold_id); releasing an already released hold is a no-op
+    by_project = {}
+    for pid, hold_id in holds:
+        by_project.setdefault(pid, []).append(hold_id)
+    if not by_project:
+        return
+    result = await with_retry(lambda: db.projects.bulk_write([
+        UpdateOne({"project_id": pid, "share_holds.hold_id": {"$in": ids}},
+                  [{"$set": hold_release(ids, 'share_holds', 'reserved_shares', 'shares')}]) for pid, ids in by_project.items()], ordered=False))
+    _inventory_stats["released"] += result.modified_count
+
+async def rebuild_share_inventory(project_ids: list = None) -> dict:
+    # Sets total_shares from total_target and rebuilds share holds from open buy requests;
+    # like reconcile_holds, an orphan hold survives INVENTORY_HOLD_GRACE_SECONDS
+    match = {"project_id": {"$in": project_ids}} if project_ids is not None else {}
+    now = datetime.now(timezone.utc)
+    cutoff = (now - timedelta(seconds=INVENTORY_HOLD_GRACE_SECONDS)).isoformat()
+    open_buys = {}
+    async for req in db.trade_requests.find({**match, "type": "buy", "status": {"$in": ["pending", "processing"]}},
+                                            {"_id": 0, "request_id": 1, "project_id": 1, "shares": 1}):
+        open_buys.setdefault(req['project_id'], {})[req['request_id']] = req['shares']
+    ops = []
+    async for p in db.projects.find(match, {"_id": 0, "project_id": 1, "total_target": 1, "total_shares": 1, "share_holds": 1, "reserved_shares": 1}):
+        current, wanted = p.get('share_holds') or [], open_buys.get(p['project_id'], {})
+        holds = [h for h in current if h['hold_id'] in wanted or h.get('at', '') > cutoff]
+        held = {h['hold_id'] for h in holds}
+        holds += [{"hold_id": rid, "shares": shares, "at": now.isoformat()} for rid, shares in wanted.items() if rid not in held]
+        fields = {"total_shares": project_total_shares(p.get('total_target', 0)), "share_holds": holds,
+                  "reserved_shares": sum(h['shares'] for h in holds)}
+        if any(p.get(k) != v for k, v in fields.items()):
+            ops.append(UpdateOne({"project_id": p['project_id'], "share_holds": p.get('share_holds'), "reserved_shares": p.get('reserved_shares')},
+                                 {"$set": fields}))
+    fixed = 0
+    if ops:
+        fixed = (await db.projects.bulk_write(ops, ordered=False)).modified_count
+        _inventory_stats["reconciled"] += fixed
+    return {"inventory_fixed": fixed}
+
+@app.on_event("startup")
+async def backfill_share_inventory():
+    result = await rebuild_share_inventory()
+    if result['inventory_fixed']:
+        logger.info(f"Proje hisse envanteri guncellendi: {result['inventory_fixed']} proje")
+
+# ===== PORTFOLIO ENTRIES =====
+def new_portfolio_entry(user_id: str, project_id: str, project_name: str, project_type: str, shares: int, amount: float,
+                        usd_rate: float, portfolio_id: str = None) -> dict:
+    if shares >= 10: actual_rate, usd_based = 8.0, True
+    elif shares >= 5: actual_rate, usd_based = 7.0, True
+    else: actual_rate, usd_based = 7.0, False
+    if usd_based:
+        monthly_return = (amount / usd_rate) * (actual_rate / 100) * usd_rate
+    else:
+        monthly_return = amount * (actual_rate / 100)
+    return {
+        "portfolio_id": portfolio_id or str(uuid.uuid4()), "user_id": user_id,
+        "project_id": project_id, "project_name": project_name,
+        "project_type": project_type, "amount": amount,
+        "shares": shares, "usd_based": usd_based,
+        "usd_rate_at_purchase": usd_rate if usd_based else None,
+        "monthly_return": round(monthly_return, 2), "return_rate": actual_rate,
+        "purchase_date": datetime.now(timezone.utc).isoformat(), "status": "active"
+    }
+
+# ===== PORTFOLIO SUMMARIES =====
+# portfolio_summaries holds one document per investor with the portfolio rows embedded and the
+# totals derived from them. Each change is a single pipeline update that replaces or removes
+# rows by portfolio_id and recomputes the totals from the array, so it is atomic per investor
+# and idempotent when a settlement step is re-driven.
+SUMMARY_TOTALS = {
+    "total_invested": {"$sum": "$investments.amount"},
+    "total_monthly_return": {"$sum": "$investments.monthly_return"},
+    "total_shares": {"$sum": "$investments.shares"},
+    "portfolio_count": {"$size": "$investments"},
+}
+
+def summary_row(row: dict) -> dict:
+    return {k: v for k, v in row.items() if k not in ('_id', 'pending_ops')}
+
+async def update_portfolio_summary(user_id: str, put_rows: list = (), remove_ids: list = ()):
+    rows = [summary_row(r) for r in put_rows]
+    drop = list(remove_ids) + [r['portfolio_id'] for r in rows]
+    await with_retry(lambda: db.portfolio_summaries.update_one({"user_id": user_id}, [
+        {"$set": {"investments": {"$concatArrays": [
+            {"$filter": {"input": {"$ifNull": ["$investments", []]}, "cond": {"$not": [{"$in": ["$$this.portfolio_id", drop]}]}}},
+            {"$literal": rows}]}}},
+        {"$set": {**SUMMARY_TOTALS, "updated_at": "$$NOW"}},
+    ], upsert=True))
+
+async def sync_portfolio_summary(user_id: str, portfolio_ids: list):
+    # Copies the current state of the given rows; rows that are gone or empty are removed
+    rows = await db.portfolios.find({"portfolio_id": {"$in": portfolio_ids}, "shares": {"$gt": 0}}, {"_id": 0}).to_list(None)
+    await update_portfolio_summary(user_id, rows, [pid for pid in portfolio_ids if pid not in {r['portfolio_id'] for r in rows}])
+
+async def rebuild_portfolio_summaries() -> dict:
+    # One aggregation over portfolios merged into portfolio_summaries; summaries without rows are emptied
+    await db.portfolios.aggregate([
+        {"$project": {"_id": 0, "pending_ops": 0}},
+        {"$group": {"_id": "$user_id", "investments": {"$push": "$$ROOT"}}},
+        {"$project": {"_id": 0, "user_id": "$_id", "investments": 1, **SUMMARY_TOTALS, "updated_at": "$$NOW"}},
+        {"$merge": {"into": "portfolio_summaries", "on": "user_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ], allowDiskUse=True).to_list(None)
+    holders = await db.portfolios.distinct("user_id")
+    emptied = await db.portfolio_summaries.update_many(
+        {"user_id": {"$nin": holders}, "portfolio_count": {"$ne": 0}},
+        {"$set": {"investments": [], "total_invested": 0, "total_monthly_return": 0, "total_shares": 0, "portfolio_count": 0}})
+    return {"users": len(holders), "emptied": emptied.modified_count}
+
+@app.on_event("startup")
+async def backfill_portfolio_summaries():
+    if await db.portfolio_summaries.estimated_document_count() == 0 and await db.portfolios.estimated_document_count() > 0:
+        result = await rebuild_portfolio_summaries()
+        logger.info(f"Portfolyo ozetleri olusturuldu: {result['users']} yatirimci")
 
 # ===== PORTFOLIO ROUTES =====
 @api_router.get("/portfolio")
 async def get_portfolio(user=Depends(get_current_user)):
-    investments = await db.portfolios.find({"user_id": user['user_id']}, {"_id": 0}).to_list(100)
+    summary = await db.portfolio_summaries.find_one({"user_id": user['user_id']}, {"_id": 0}) or {}
+    investments = summary.get('investments', [])
     usd_rate = get_usd_rate()
-    total_invested = sum(i.get('amount', 0) for i in investments)
-    total_monthly_return = sum(i.get('monthly_return', 0) for i in investments)
+    total_invested = summary.get('total_invested', 0)
+    total_monthly_return = summary.get('total_monthly_return', 0)
     for inv in investments:
         inv['monthly_return_usd'] = round(inv.get('monthly_return', 0) / usd_rate, 2)
         inv['amount_usd'] = round(inv.get('amount', 0) / usd_rate, 2)
@@ -325,36 +1105,39 @@ async def get_portfolio(user=Depends(get_current_user)):
     return {"investments": investments, "total_invested": total_invested, "total_monthly_return": total_monthly_return, "total_monthly_return_usd": total_monthly_return_usd, "usd_rate": usd_rate, "balance": user.get('balance', 0)}
 
 @api_router.post("/portfolio/invest")
-async def invest(data: InvestRequest, user=Depends(get_current_user)):
+async def invest(data: InvestRequest, request: Request, user=Depends(get_current_user)):
+    return await idempotent(request, user['user_id'], data.model_dump(), lambda request_id: create_buy_request(data, user, request_id))
+
+async def create_buy_request(data: InvestRequest, user: dict, request_id: str):
     if user.get('kyc_status') != 'approved':
         raise HTTPException(status_code=400, detail="Yatirim yapabilmek icin kimlik dogrulamanizi tamamlayin")
     if data.amount < SHARE_PRICE:
         raise HTTPException(status_code=400, detail=f"Minimum yatirim tutari {SHARE_PRICE:,.0f} TL (1 hisse)")
     if data.amount % SHARE_PRICE != 0:
         raise HTTPException(status_code=400, detail=f"Yatirim tutari {SHARE_PRICE:,.0f} TL'nin katlari olmalidir")
-    if user.get('balance', 0) < data.amount:
-        raise HTTPException(status_code=400, detail="Yetersiz bakiye")
-    project = await db.projects.find_one({"project_id": data.project_id}, {"_id": 0})
-    if not project:
-        raise HTTPException(status_code=404, detail="Proje bulunamadi")
     shares = int(data.amount / SHARE_PRICE)
+    project = await reserve_project_shares(data.project_id, request_id, shares)
+    try:
+        await place_hold(user['user_id'], request_id, data.amount)
+    except HTTPException:
+        await release_share_holds([(data.project_id, request_id)])
+        raise
     req = {
-        "request_id": str(uuid.uuid4()), "user_id": user['user_id'],
+        "request_id": request_id, "user_id": user['user_id'],
         "user_name": user.get('name', ''), "type": "buy",
         "project_id": data.project_id, "project_name": project['name'],
         "project_type": project['type'], "shares": shares, "amount": data.amount,
         "status": "pending", "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.trade_requests.insert_one(req)
-    await db.notifications.insert_one({
-        "notification_id": str(uuid.uuid4()), "user_id": user['user_id'],
-        "title": "Alim Talebi Olusturuldu", "message": f"{project['name']} projesine {shares} hisse ({data.amount:,.0f} TL) alim talebi olusturuldu.",
-        "type": "trade_request", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    await insert_many_once(db.trade_requests, [req])
+    await notify("buy_requested", user['user_id'], derived_id(request_id, 'requested'), project_name=project['name'], shares=shares, amount=data.amount)
     return {"message": "Alim talebi olusturuldu.", "request": {k: v for k, v in req.items() if k != '_id'}}
 
 @api_router.post("/portfolio/sell")
-async def sell_investment(data: SellRequest, user=Depends(get_current_user)):
+async def sell_investment(data: SellRequest, request: Request, user=Depends(get_current_user)):
+    return await idempotent(request, user['user_id'], data.model_dump(), lambda request_id: create_sell_request(data, user, request_id))
+
+async def create_sell_request(data: SellRequest, user: dict, request_id: str):
     inv = await db.portfolios.find_one({"portfolio_id": data.portfolio_id, "user_id": user['user_id']}, {"_id": 0})
     if not inv:
         raise HTTPException(status_code=404, detail="Yatirim bulunamadi")
@@ -365,24 +1148,22 @@ async def sell_investment(data: SellRequest, user=Depends(get_current_user)):
     per_share_amount = inv['amount'] / total_shares
     sell_amount = round(per_share_amount * sell_shares, 2)
     req = {
-        "request_id": str(uuid.uuid4()), "user_id": user['user_id'],
+        "request_id": request_id, "user_id": user['user_id'],
         "user_name": user.get('name', ''), "type": "sell",
         "project_id": inv.get('project_id', ''), "project_name": inv.get('project_name', ''),
         "project_type": inv.get('project_type', ''), "shares": sell_shares, "amount": sell_amount,
         "portfolio_id": data.portfolio_id,
         "status": "pending", "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.trade_requests.insert_one(req)
-    await db.notifications.insert_one({
-        "notification_id": str(uuid.uuid4()), "user_id": user['user_id'],
-        "title": "Satim Talebi Olusturuldu", "message": f"{inv.get('project_name','')} projesinden {sell_shares} hisse ({sell_amount:,.0f} TL) satim talebi olusturuldu.",
-        "type": "trade_request", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    await insert_many_once(db.trade_requests, [req])
+    await notify("sell_requested", user['user_id'], derived_id(request_id, 'requested'), project_name=inv.get('project_name', ''), shares=sell_shares, amount=sell_amount)
     return {"message": "Satim talebi olusturuldu. ", "request": {k: v for k, v in req.items() if k != '_id'}}
 
 @api_router.get("/trade-requests")
-async def get_trade_requests(user=Depends(get_current_user)):
-    return await db.trade_requests.find({"user_id": user['user_id']}, {"_id": 0}).sort("created_at", -1).to_list(100)
+async def get_trade_requests(response: Response, cursor: str = None, limit: int = 100, user=Depends(get_token_identity)):
+    items, next_cursor = await keyset_page(db.trade_requests, {"user_id": user['user_id']}, 'request_id', cursor, limit)
+    set_next_cursor(response, next_cursor)
+    return items
 
 # ===== BANK ROUTES =====
 @api_router.get("/banks")
@@ -409,61 +1190,188 @@ async def delete_bank(bank_id: str, user=Depends(get_admin_user)):
 
 # ===== TRANSACTION ROUTES =====
 @api_router.post("/transactions")
-async def create_transaction(data: TransactionRequest, user=Depends(get_current_user)):
-    if data.type == 'withdrawal' and user.get('balance', 0) < data.amount:
-        raise HTTPException(status_code=400, detail="Yetersiz bakiye")
+async def create_transaction(data: TransactionRequest, request: Request, user=Depends(get_current_user)):
+    return await idempotent(request, user['user_id'], data.model_dump(), lambda transaction_id: open_transaction(data, user, transaction_id))
+
+async def open_transaction(data: TransactionRequest, user: dict, transaction_id: str):
     if data.amount <= 0:
         raise HTTPException(status_code=400, detail="Gecerli bir tutar girin")
+    if data.type == 'withdrawal':
+        await place_hold(user['user_id'], transaction_id, data.amount)
     txn = {
-        "transaction_id": str(uuid.uuid4()), "user_id": user['user_id'],
+        "transaction_id": transaction_id, "user_id": user['user_id'],
         "user_name": user.get('name', ''), "type": data.type,
         "amount": data.amount, "status": "pending",
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.transactions.insert_one(txn)
+    await insert_many_once(db.transactions, [txn])
     # Send email
     action = "Para Yatirma Talebi" if data.type == 'deposit' else "Para Cekme Talebi"
     await send_email(user.get('email', ''), f"Alarko Enerji - {action}",
-        f"<h2>{action}</h2><p>Sayin {user.get('name','')},</p><p><strong>{data.amount:,.0f} TL</strong> tutarinda {action.lower()} olusturulmustur.</p><p>Alarko Enerji Yatirim A.S.</p>")
+        f"<h2>{action}</h2><p>Sayin {user.get('name','')},</p><p><strong>{data.amount:,.0f} TL</strong> tutarinda {action.lower()} olusturulmustur.</p><p>Alarko Enerji Yatirim A.S.</p>",
+        derived_id(transaction_id, 'requested'))
     return {k: v for k, v in txn.items() if k != '_id'}
 
 @api_router.post("/transactions/withdraw")
-async def create_withdrawal(data: WithdrawRequest, user=Depends(get_current_user)):
+async def create_withdrawal(data: WithdrawRequest, request: Request, user=Depends(get_current_user)):
+    return await idempotent(request, user['user_id'], data.model_dump(), lambda transaction_id: open_withdrawal(data, user, transaction_id))
+
+async def open_withdrawal(data: WithdrawRequest, user: dict, transaction_id: str):
     if data.amount <= 0:
         raise HTTPException(status_code=400, detail="Gecerli bir tutar girin")
-    if user.get('balance', 0) < data.amount:
-        raise HTTPException(status_code=400, detail="Yetersiz bakiye")
+    await place_hold(user['user_id'], transaction_id, data.amount)
     txn = {
-        "transaction_id": str(uuid.uuid4()), "user_id": user['user_id'],
+        "transaction_id": transaction_id, "user_id": user['user_id'],
         "user_name": user.get('name', ''), "type": "withdrawal",
         "amount": data.amount, "status": "pending",
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.transactions.insert_one(txn)
+    await insert_many_once(db.transactions, [txn])
     await send_email(user.get('email', ''), "Alarko Enerji - Para Cekme Talebi",
-        f"<h2>Para Cekme Talebi</h2><p>Sayin {user.get('name','')},</p><p><strong>{data.amount:,.0f} TL</strong> tutarinda para cekme talebiniz olusturulmustur. </p><p>Alarko Enerji Yatirim A.S.</p>")
+        f"<h2>Para Cekme Talebi</h2><p>Sayin {user.get('name','')},</p><p><strong>{data.amount:,.0f} TL</strong> tutarinda para cekme talebiniz olusturulmustur. </p><p>Alarko Enerji Yatirim A.S.</p>",
+        derived_id(transaction_id, 'requested'))
     return {k: v for k, v in txn.items() if k != '_id'}
 
 @api_router.get("/transactions")
-async def get_transactions(user=Depends(get_current_user)):
-    return await db.transactions.find({"user_id": user['user_id']}, {"_id": 0}).sort("created_at", -1).to_list(100)
+async def get_transactions(response: Response, cursor: str = None, limit: int = 100, user=Depends(get_token_identity)):
+    items, next_cursor = await keyset_page(db.transactions, {"user_id": user['user_id']}, 'transaction_id', cursor, limit)
+    set_next_cursor(response, next_cursor)
+    return items
 
 @api_router.get("/portfolio/withdrawal-check")
-async def withdrawal_check(user=Depends(get_current_user)):
+async def withdrawal_check(user=Depends(get_token_identity)):
     one_month_ago = (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
     recent_investments = await db.portfolios.find({"user_id": user['user_id'], "purchase_date": {"$gt": one_month_ago}}, {"_id": 0, "project_name": 1, "purchase_date": 1}).to_list(100)
     return {"has_recent_investments": len(recent_investments) > 0, "recent_investments": recent_investments}
 
+# ===== KYC UPLOADS =====
+# Identity images are copied in KYC_UPLOAD_CHUNK_BYTES chunks. Every blocking file call runs in a
+# worker thread, so a slow disk never stalls the event loop. The image type is sniffed from the
+# first bytes; the client's filename and content type are not trusted. Front and back are
+# written concurrently to temporary files and renamed into place only when both are complete.
+# UploadSizeLimitMiddleware refuses an oversized body while it streams in, before multipart
+# parsing spools it.
+KYC_MAX_UPLOAD_BYTES = int(os.environ.get('KYC_MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+KYC_UPLOAD_CHUNK_BYTES = 256 * 1024
+KYC_MULTIPART_OVERHEAD_BYTES = 64 * 1024
+KYC_IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 0, '.jpg'), (b'\x89PNG\r\n\x1a\n', 0, '.png'), (b'WEBP', 8, '.webp'),
+    (b'ftypheic', 4, '.heic'), (b'ftypheix', 4, '.heic'), (b'ftypmif1', 4, '.heic'),
+]
+_kyc_upload_stats = {"uploads": 0, "files": 0, "bytes": 0, "rejected_size": 0, "rejected_type": 0,
+                     "write_seconds": 0.0, "bytes_per_second": 0.0, "total_ms": 0.0, "max_ms": 0.0}
+METRICS["kyc_uploads"] = _kyc_upload_stats
+
+def sniff_image_suffix(head: bytes):
+    for signature, offset, suffix in KYC_IMAGE_SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return suffix
+    return None
+
+def _discard(*paths):
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+async def store_kyc_image(upload: UploadFile, name: str) -> tuple:
+    # Streams one upload into a hidden temp file; returns (temp path, final path) once fully written
+    head = await upload.read(KYC_UPLOAD_CHUNK_BYTES)
+    suffix = sniff_image_suffix(head)
+    if not suffix:
+        _kyc_upload_stats["rejected_type"] += 1
+        raise HTTPException(status_code=415, detail="Yalnizca JPEG, PNG, WEBP veya HEIC gorsel yukleyebilirsiniz")
+    tmp, final = UPLOAD_DIR / f".{name}.part", UPLOAD_DIR / f"{name}{suffix}"
+    f = await asyncio.to_thread(open, tmp, 'wb')
+    size, start = 0, time.perf_counter()
+    try:
+        chunk = head
+        while chunk:
+            size += len(chunk)
+            if size > KYC_MAX_UPLOAD_BYTES:
+                _kyc_upload_stats["rejected_size"] += 1
+                raise HTTPException(status_code=413, detail=f"Dosya en fazla {KYC_MAX_UPLOAD_BYTES // (1024 * 1024)} MB olabilir")
+            await asyncio.to_thread(f.write, chunk)
+            chunk = await upload.read(KYC_UPLOAD_CHUNK_BYTES)
+        await asyncio.to_thread(f.close)
+    except BaseException:
+        await asyncio.to_thread(f.close)
+        await asyncio.to_thread(_discard, tmp)
+        raise
+    _kyc_upload_stats["files"] += 1
+    _kyc_upload_stats["bytes"] += size
+    _kyc_upload_stats["write_seconds"] += time.perf_counter() - start
+    _kyc_upload_stats["bytes_per_second"] = round(_kyc_upload_stats["bytes"] / max(_kyc_upload_stats["write_seconds"], 1e-9), 1)
+    return tmp, final
+
+async def store_kyc_images(uploads: dict) -> dict:
+    # uploads: {side: (UploadFile, name)}; all sides are renamed into place or none is
+    results = await asyncio.gather(*[store_kyc_image(upload, name) for upload, name in uploads.values()], return_exceptions=True)
+    stored = [r for r in results if not isinstance(r, BaseException)]
+    failed = [r for r in results if isinstance(r, BaseException)]
+    if failed:
+        await asyncio.to_thread(_discard, *[tmp for tmp, _ in stored])
+        raise failed[0]
+    for tmp, final in stored:
+        await asyncio.to_thread(os.replace, tmp, final)
+    return {side: final.name for side, (_, final) in zip(uploads, stored)}
+
+class UploadSizeLimitMiddleware:
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get('path')) if scope['type'] == 'http' else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+        state = {"received": 0, "too_large": False, "responded": False}
+
+        async def reject():
+            if not state["responded"]:
+                state["responded"] = True
+                _kyc_upload_stats["rejected_size"] += 1
+                body = json.dumps({"detail": f"Yukleme en fazla {limit // (1024 * 1024)} MB olabilir"}).encode()
+                await send({"type": "http.response.start", "status": 413,
+                            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+                await send({"type": "http.response.body", "body": body})
+
+        declared = dict(scope['headers']).get(b'content-length')
+        if declared and declared.isdigit() and int(declared) > limit:
+            return await reject()
+
+        async def limited_receive():
+            message = await receive()
+            if message['type'] == 'http.request':
+                state["received"] += len(message.get('body', b''))
+                if state["received"] > limit:
+                    state["too_large"] = True
+                    # Ends the body early; whatever the app answers is replaced with a 413
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if state["too_large"]:
+                return await reject()
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not state["too_large"]:
+                raise
+            await reject()
+
 # ===== KYC ROUTES =====
 @api_router.post("/kyc/upload")
 async def upload_kyc(front: UploadFile = File(...), back: UploadFile = File(...), user=Depends(get_current_user)):
     uid = user['user_id']
-    front_fn = f"{uid}_front_{uuid.uuid4().hex[:8]}{Path(front.filename).suffix}"
-    back_fn = f"{uid}_back_{uuid.uuid4().hex[:8]}{Path(back.filename).suffix}"
-    with open(UPLOAD_DIR / front_fn, 'wb') as f:
-        shutil.copyfileobj(front.file, f)
-    with open(UPLOAD_DIR / back_fn, 'wb') as f:
-        shutil.copyfileobj(back.file, f)
+    start = time.perf_counter()
+    files = await store_kyc_images({"front": (front, f"{uid}_front_{uuid.uuid4().hex[:8]}"),
+                                    "back": (back, f"{uid}_back_{uuid.uuid4().hex[:8]}")})
+    front_fn, back_fn = files["front"], files["back"]
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    _kyc_upload_stats["uploads"] += 1
+    _kyc_upload_stats["total_ms"] += elapsed_ms
+    _kyc_upload_stats["max_ms"] = max(_kyc_upload_stats["max_ms"], round(elapsed_ms, 1))
     kyc_doc = {
         "kyc_id": str(uuid.uuid4()), "user_id": uid,
         "user_name": user.get('name', ''), "user_email": user.get('email', ''),
@@ -472,7 +1380,7 @@ async def upload_kyc(front: UploadFile = File(...), back: UploadFile = File(...)
     }
     await db.kyc_documents.delete_many({"user_id": uid})
     await db.kyc_documents.insert_one(kyc_doc)
-    await db.users.update_one({"user_id": uid}, {"$set": {"kyc_status": "submitted"}})
+    await update_user(uid, {"$set": {"kyc_status": "submitted"}})
     return {"message": "Kimlik belgeleri yuklendi", "status": "submitted"}
 
 @api_router.get("/kyc/status")
@@ -481,8 +1389,10 @@ async def get_kyc_status(user=Depends(get_current_user)):
     return {"kyc_status": user.get('kyc_status', 'pending'), "kyc_document": kyc}
 
 @api_router.get("/admin/kyc")
-async def get_all_kyc(user=Depends(get_admin_user)):
-    return await db.kyc_documents.find({}, {"_id": 0}).sort("submitted_at", -1).to_list(100)
+async def get_all_kyc(response: Response, cursor: str = None, limit: int = 100, user=Depends(get_admin_user)):
+    docs, next_cursor = await keyset_page(db.kyc_documents, {}, 'kyc_id', cursor, limit, sort_field='submitted_at')
+    set_next_cursor(response, next_cursor)
+    return await attach_user_fields(docs)
 
 @api_router.post("/admin/kyc/{kyc_id}/approve")
 async def approve_kyc(kyc_id: str, user=Depends(get_admin_user)):
@@ -490,13 +1400,8 @@ async def approve_kyc(kyc_id: str, user=Depends(get_admin_user)):
     if not kyc:
         raise HTTPException(status_code=404, detail="KYC bulunamadi")
     await db.kyc_documents.update_one({"kyc_id": kyc_id}, {"$set": {"status": "approved", "reviewed_at": datetime.now(timezone.utc).isoformat()}})
-    await db.users.update_one({"user_id": kyc['user_id']}, {"$set": {"kyc_status": "approved"}})
-    await db.notifications.insert_one({
-        "notification_id": str(uuid.uuid4()), "user_id": kyc['user_id'],
-        "title": "Kimlik Doğrulaması Onaylandı",
-        "message": "Kimliğiniz başarıyla doğrulandı. Artık yatırım yapabilirsiniz!",
-        "type": "kyc_approved", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    await update_user(kyc['user_id'], {"$set": {"kyc_status": "approved"}})
+    await notify("kyc_approved", kyc['user_id'])
     return {"message": "KYC onaylandi"}
 
 @api_router.post("/admin/kyc/{kyc_id}/reject")
@@ -505,32 +1410,360 @@ async def reject_kyc(kyc_id: str, user=Depends(get_admin_user)):
     if not kyc:
         raise HTTPException(status_code=404, detail="KYC bulunamadi")
     await db.kyc_documents.update_one({"kyc_id": kyc_id}, {"$set": {"status": "rejected", "reviewed_at": datetime.now(timezone.utc).isoformat()}})
-    await db.users.update_one({"user_id": kyc['user_id']}, {"$set": {"kyc_status": "rejected"}})
-    await db.notifications.insert_one({
-        "notification_id": str(uuid.uuid4()), "user_id": kyc['user_id'],
-        "title": "Kimlik Doğrulaması Reddedildi",
-        "message": "Kimlik doğrulamanız reddedildi. Lütfen geçerli bir kimlik belgesi yükleyin.",
-        "type": "kyc_rejected", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    await update_user(kyc['user_id'], {"$set": {"kyc_status": "rejected"}})
+    await notify("kyc_rejected", kyc['user_id'])
     return {"message": "KYC reddedildi"}
 
+# ===== NOTIFICATION FACTORY =====
+# Handlers call notify(template, user_id, **params). Inside a request the documents are
+# buffered and written with one insert_many when the response starts; elsewhere they are
+# written immediately. Every inserted batch then runs the delivery hooks.
+NOTIFICATION_TEMPLATES = {
+    # template: (type, title, message)
+    "welcome": ("welcome", "Hos Geldiniz!", "Alarko Enerji platformuna hos geldiniz."),
+    "buy_requested": ("trade_request", "Alim Talebi Olusturuldu", "{project_name} projesine {shares} hisse ({amount:,.0f} TL) alim talebi olusturuldu."),
+    "sell_requested": ("trade_request", "Satim Talebi Olusturuldu", "{project_name} projesinden {shares} hisse ({amount:,.0f} TL) satim talebi olusturuldu."),
+    "buy_approved": ("trade_approved", "Alim Talebi Onaylandi", "{project_name} projesine {shares} hisse yatiriminiz onaylandi."),
+    "sell_approved": ("trade_approved", "Satim Talebi Onaylandi", "{shares} hisse ({amount:,.0f} TL) satim talebiniz onaylandi."),
+    "buy_rejected": ("trade_rejected", "Alim Talebi Reddedildi", "{project_name} projesine ait talebiniz reddedildi."),
+    "sell_rejected": ("trade_rejected", "Satim Talebi Reddedildi", "{project_name} projesine ait talebiniz reddedildi."),
+    "deposit_approved": ("deposit_approved", "Para Yatirma Onaylandi", "{amount:,.0f} TL tutarindaki yatirma talebiniz onaylandi."),
+    "deposit_rejected": ("deposit_rejected", "Para Yatirma Reddedildi", "{amount:,.0f} TL tutarindaki yatirma talebiniz reddedildi."),
+    "withdrawal_approved": ("withdrawal_approved", "Para Cekme Onaylandi", "{amount:,.0f} TL tutarindaki cekme talebiniz onaylandi ve hesabinizdan dusuldu."),
+    "withdrawal_rejected": ("withdrawal_rejected", "Para Cekme Reddedildi", "{amount:,.0f} TL tutarindaki cekme talebiniz reddedildi."),
+    "balance_added": ("deposit_approved", "Para Yatirma Onaylandi", "Hesabiniza {amount:,.0f} TL yatirildi."),
+    "balance_subtracted": ("withdrawal", "Para Cekme Gerceklesti", "Hesabinizdan {amount:,.0f} TL cekildi."),
+    "kyc_approved": ("kyc_approved", "Kimlik Doğrulaması Onaylandı", "Kimliğiniz başarıyla doğrulandı. Artık yatırım yapabilirsiniz!"),
+    "kyc_approved_by_admin": ("kyc_approved", "Kimlik Dogrulamasi Onaylandi", "Kimlik dogrulamaniz admin tarafindan onaylandi. Artik yatirim yapabilirsiniz."),
+    "return_payout": ("return_payout", "Aylik Getiri Odendi", "{period} donemi getiriniz olan {amount:,.0f} TL hesabiniza yatirildi."),
+    "kyc_rejected": ("kyc_rejected", "Kimlik Doğrulaması Reddedildi", "Kimlik doğrulamanız reddedildi. Lütfen geçerli bir kimlik belgesi yükleyin."),
+}
+_notification_buffer = ContextVar('notification_buffer', default=None)
+_notification_stats = {"created": 0, "inserted": 0, "flushes": 0, "hook_errors": 0, "by_type": {}}
+METRICS["notifications"] = _notification_stats
+
+def build_notification(template: str, user_id: str, notification_id: str = None, **params) -> dict:
+    ntype, title, message = NOTIFICATION_TEMPLATES[template]
+    _notification_stats["created"] += 1
+    _notification_stats["by_type"][template] = _notification_stats["by_type"].get(template, 0) + 1
+    return {"notification_id": notification_id or str(uuid.uuid4()), "user_id": user_id, "title": title,
+            "message": message.format(**params), "type": ntype, "is_read": False,
+            "created_at": datetime.now(timezone.utc).isoformat()}
+
+async def notify(template: str, user_id: str, notification_id: str = None, **params):
+    doc = build_notification(template, user_id, notification_id, **params)
+    buffer = _notification_buffer.get()
+    if buffer is not None and buffer["open"]:
+        buffer["docs"].append(doc)
+    else:
+        await flush_notifications([doc])
+
+async def flush_notifications(docs: list):
+    if not docs:
+        return
+    inserted = await insert_many_once(db.notifications, docs)
+    _notification_stats["flushes"] += 1
+    _notification_stats["inserted"] += len(inserted)
+    await bump_unread_counts(inserted)
+    for hook in _notification_hooks:
+        try:
+            await hook(inserted)
+        except Exception as e:
+            _notification_stats["hook_errors"] += 1
+            logger.error(f"Bildirim hook hatasi ({getattr(hook, '__name__', hook)}): {e}")
+
+def add_notification_hook(hook):
+    _notification_hooks.append(hook)
+
+class NotificationBufferMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        buffer = {"docs": [], "open": True}
+        token = _notification_buffer.set(buffer)
+
+        async def flush():
+            buffer["open"] = False
+            docs, buffer["docs"] = buffer["docs"], []
+            await flush_notifications(docs)
+
+        async def send_after_flush(message):
+            # Flushed before the response goes out so the client reads its own notifications
+            if message['type'] == 'http.response.start':
+                await flush()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_after_flush)
+        finally:
+            _notification_buffer.reset(token)
+            await flush()
+
+# ===== UNREAD COUNTER =====
+# users.unread_count is kept in step with every notification insert and read flip so the
+# badge is a single primary-key read; reconcile_unread_counts repairs any drift.
+async def get_unread_count(user_id: str) -> int:
+    user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "unread_count": 1})
+    if user and 'unread_count' in user:
+        return max(user['unread_count'], 0)
+    counts = await reconcile_unread_counts([user_id])
+    return counts.get(user_id, 0)
+
+async def bump_unread_counts(docs: list):
+    counts = Counter(d['user_id'] for d in docs if not d.get('is_read'))
+    if not counts:
+        return
+    await with_retry(lambda: db.users.bulk_write(
+        [UpdateOne({"user_id": uid, "unread_count": {"$exists": True}}, {"$inc": {"unread_count": n}}) for uid, n in counts.items()],
+        ordered=False))
+    for uid in counts:
+        invalidate_user(uid)
+
+async def reconcile_unread_counts(user_ids: list = None) -> dict:
+    match = {"is_read": False, **({"user_id": {"$in": user_ids}} if user_ids is not None else {})}
+    counts = {row['_id']: row['n'] async for row in db.notifications.aggregate(
+        [{"$match": match}, {"$group": {"_id": "$user_id", "n": {"$sum": 1}}}])}
+    ops = [UpdateOne({"user_id": uid, "unread_count": {"$ne": n}}, {"$set": {"unread_count": n}}) for uid, n in counts.items()]
+    corrected = (await db.users.bulk_write(ops, ordered=False)).modified_count if ops else 0
+    zero_filter = {"$and": [{"user_id": {"$nin": list(counts)}}, {"unread_count": {"$ne": 0}}]}
+    if user_ids is not None:
+        zero_filter["$and"].append({"user_id": {"$in": user_ids}})
+    corrected += (await db.users.update_many(zero_filter, {"$set": {"unread_count": 0}})).modified_count
+    if user_ids is None:
+        _user_cache.clear()
+    for uid in user_ids or []:
+        invalidate_user(uid)
+    return counts if user_ids is not None else {"corrected": corrected, "users_with_unread": len(counts)}
+
+@app.on_event("startup")
+async def backfill_unread_counts():
+    missing = await db.users.distinct("user_id", {"unread_count": {"$exists": False}})
+    if missing:
+        await reconcile_unread_counts(missing)
+        logger.info(f"Okunmamis bildirim sayaci olusturuldu: {len(missing)} kullanici")
+
+# ===== NOTIFICATION PUSH =====
+# Server-Sent Events replace polling /notifications. Each worker keeps its own subscriber
+# queues; when MongoDB change streams are available (replica set) every worker tails
+# db.notifications so a write on one worker reaches streams held by the others. On a
+# standalone mongod the writer publishes in-process instead.
+NOTIFICATION_HEARTBEAT_SECONDS = float(os.environ.get('NOTIFICATION_HEARTBEAT_SECONDS', '15'))
+NOTIFICATION_QUEUE_SIZE = 100
+# EventSource cannot send headers, so the stream takes a short-lived token scoped to it in the URL
+NOTIFICATION_STREAM_TOKEN_SECONDS = 60
+_notification_subscribers = {}
+_notification_bus = {"change_stream": False, "watcher": None}
+_push_stats = {"connected": 0, "delivered": 0, "dropped": 0, "replayed": 0}
+METRICS["notification_push"] = _push_stats
+
+def push_event(user_id: str, event: str, data: dict, event_id: str = None):
+    for queue in _notification_subscribers.get(user_id, ()):
+        try:
+            queue.put_nowait((event, data, event_id))
+            _push_stats["delivered"] += 1
+        except asyncio.QueueFull:
+            _push_stats["dropped"] += 1
+
+def notification_event_id(doc: dict) -> str:
+    return encode_cursor(doc['created_at'], doc['notification_id'])
+
+async def push_unread_count(user_id: str):
+    if _notification_subscribers.get(user_id):
+        push_event(user_id, "unread_count", {"unread_count": await get_unread_count(user_id)})
+
+async def publish_notifications(docs: list):
+    if _notification_bus["change_stream"]:
+        return
+    for doc in docs:
+        doc = {k: v for k, v in doc.items() if k != '_id'}
+        push_event(doc['user_id'], "notification", doc, notification_event_id(doc))
+    for user_id in {d['user_id'] for d in docs}:
+        await push_unread_count(user_id)
+
+async def publish_unread_count(user_id: str):
+    if not _notification_bus["change_stream"]:
+        await push_unread_count(user_id)
+
+_notification_hooks = [publish_notifications]
+
+async def watch_notifications():
+    resume_token = None
+    pipeline = [{"$match": {"$or": [
+        {"ns.coll": "notifications", "operationType": "insert"},
+        {"ns.coll": "users", "operationType": "update", "updateDescription.updatedFields.unread_count": {"$exists": True}},
+    ]}}]
+    while True:
+        try:
+            async with db.watch(pipeline, full_document='updateLookup', resume_after=resume_token) as stream:
+                _notification_bus["change_stream"] = True
+                logger.info("Bildirim change stream dinleniyor")
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    doc = change.get('fullDocument')
+                    if not doc or not _notification_subscribers.get(doc.get('user_id')):
+                        continue
+                    if change['ns']['coll'] == 'users':
+                        push_event(doc['user_id'], "unread_count", {"unread_count": max(doc.get('unread_count', 0), 0)})
+                    else:
+                        doc.pop('_id', None)
+                        push_event(doc['user_id'], "notification", doc, notification_event_id(doc))
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            _notification_bus["change_stream"] = False
+            if resume_token is None:
+                logger.info(f"Change stream kullanilamiyor, bildirimler worker icinde dagitilacak: {e}")
+                return
+            logger.warning(f"Change stream devam ettirilemedi, bastan aciliyor: {e}")
+            resume_token = None
+        except ConnectionFailure as e:
+            _notification_bus["change_stream"] = False
+            logger.warning(f"Change stream baglantisi koptu: {e}")
+            await asyncio.sleep(1)
+
+@app.on_event("startup")
+async def start_notification_watcher():
+    _notification_bus["watcher"] = asyncio.create_task(watch_notifications())
+
+@app.on_event("shutdown")
+async def stop_notification_watcher():
+    if _notification_bus["watcher"]:
+        _notification_bus["watcher"].cancel()
+
+def sse_message(event: str, data: dict, event_id: str = None) -> str:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@api_router.post("/notifications/stream-token")
+async def create_stream_token(user=Depends(get_current_user)):
+    payload = {'user_id': user['user_id'], 'scope': 'notification_stream',
+               'exp': datetime.now(timezone.utc) + timedelta(seconds=NOTIFICATION_STREAM_TOKEN_SECONDS)}
+    return {"token": jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM), "expires_in": NOTIFICATION_STREAM_TOKEN_SECONDS}
+
+@api_router.get("/notifications/stream")
+async def notification_stream(request: Request, token: str = None):
+    # ?token= only accepts a stream token, so the login JWT never lands in proxy or access logs
+    payload = decode_jwt(token) if token else decode_token(request)
+    if token and payload.get('scope') != 'notification_stream':
+        raise HTTPException(status_code=401, detail="Gecersiz token")
+    user = await load_user(payload['user_id'])
+    if not user:
+        raise HTTPException(status_code=401, detail="Kullanici bulunamadi")
+    user_id = user['user_id']
+    last_event_id = request.headers.get('Last-Event-ID')
+    if last_event_id:
+        decode_cursor(last_event_id)
+    queue = asyncio.Queue(maxsize=NOTIFICATION_QUEUE_SIZE)
+    _notification_subscribers.setdefault(user_id, set()).add(queue)
+    _push_stats["connected"] += 1
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            if last_event_id:
+                missed, _ = await keyset_page(db.notifications, {"user_id": user_id}, 'notification_id', last_event_id,
+                                              NOTIFICATION_QUEUE_SIZE, direction=1)
+                _push_stats["replayed"] += len(missed)
+                for doc in missed:
+                    yield sse_message("notification", doc, notification_event_id(doc))
+            yield sse_message("unread_count", {"unread_count": await get_unread_count(user_id)})
+            while not await request.is_disconnected():
+                try:
+                    event, data, event_id = await asyncio.wait_for(queue.get(), NOTIFICATION_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield sse_message(event, data, event_id)
+        finally:
+            subscribers = _notification_subscribers.get(user_id, set())
+            subscribers.discard(queue)
+            if not subscribers:
+                _notification_subscribers.pop(user_id, None)
+            _push_stats["connected"] -= 1
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # ===== NOTIFICATION ROUTES =====
 @api_router.get("/notifications")
-async def get_notifications(user=Depends(get_current_user)):
-    notifs = await db.notifications.find({"user_id": user['user_id']}, {"_id": 0}).sort("created_at", -1).to_list(50)
-    unread = await db.notifications.count_documents({"user_id": user['user_id'], "is_read": False})
-    return {"notifications": notifs, "unread_count": unread}
+async def get_notifications(response: Response, cursor: str = None, limit: int = 50, user=Depends(get_token_identity)):
+    notifs, next_cursor = await keyset_page(db.notifications, {"user_id": user['user_id']}, 'notification_id', cursor, limit)
+    set_next_cursor(response, next_cursor)
+    return {"notifications": notifs, "unread_count": await get_unread_count(user['user_id']), "next_cursor": next_cursor}
 
 @api_router.post("/notifications/{notification_id}/read")
-async def mark_read(notification_id: str, user=Depends(get_current_user)):
-    await db.notifications.update_one({"notification_id": notification_id, "user_id": user['user_id']}, {"$set": {"is_read": True}})
+async def mark_read(notification_id: str, user=Depends(get_token_identity)):
+    result = await db.notifications.update_one({"notification_id": notification_id, "user_id": user['user_id'], "is_read": False}, {"$set": {"is_read": True, "read_at": datetime.now(timezone.utc)}})
+    if result.modified_count:
+        await update_user(user['user_id'], {"$inc": {"unread_count": -1}}, {"unread_count": {"$exists": True}})
+        await publish_unread_count(user['user_id'])
     return {"message": "Bildirim okundu"}
 
 @api_router.post("/notifications/read-all")
-async def mark_all_read(user=Depends(get_current_user)):
-    await db.notifications.update_many({"user_id": user['user_id']}, {"$set": {"is_read": True}})
+async def mark_all_read(user=Depends(get_token_identity)):
+    result = await db.notifications.update_many({"user_id": user['user_id'], "is_read": False}, {"$set": {"is_read": True, "read_at": datetime.now(timezone.utc)}})
+    if result.modified_count:
+        await update_user(user['user_id'], {"$inc": {"unread_count": -result.modified_count}}, {"unread_count": {"$exists": True}})
+        await publish_unread_count(user['user_id'])
     return {"message": "Tum bildirimler okundu"}
 
+# ===== NOTIFICATION RETENTION =====
+# Read notifications older than NOTIFICATION_ARCHIVE_DAYS move to notifications_archive in
+# batches; TTL indexes drop read notifications (hot and archived) after NOTIFICATION_RETENTION_DAYS.
+NOTIFICATION_ARCHIVE_DAYS = int(os.environ.get('NOTIFICATION_ARCHIVE_DAYS', '30'))
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', '365'))
+NOTIFICATION_ARCHIVE_BATCH = int(os.environ.get('NOTIFICATION_ARCHIVE_BATCH', '1000'))
+NOTIFICATION_ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('NOTIFICATION_ARCHIVE_INTERVAL_SECONDS', '3600'))
+_retention_stats = {"runs": 0, "archived": 0, "last_run_at": None, "last_error": None}
+_retention_worker = {"task": None}
+METRICS["notification_retention"] = _retention_stats
+
+async def archive_read_notifications(older_than_days: int = None) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=NOTIFICATION_ARCHIVE_DAYS if older_than_days is None else older_than_days)
+    # Notifications read before read_at existed only carry created_at
+    query = {"is_read": True, "$or": [{"read_at": {"$lt": cutoff}},
+                                      {"read_at": {"$exists": False}, "created_at": {"$lt": cutoff.isoformat()}}]}
+    archived = 0
+    while True:
+        batch = await db.notifications.find(query, {"_id": 0}).limit(NOTIFICATION_ARCHIVE_BATCH).to_list(NOTIFICATION_ARCHIVE_BATCH)
+        if not batch:
+            break
+        now = datetime.now(timezone.utc)
+        await insert_many_once(db.notifications_archive, [{**doc, "archived_at": now} for doc in batch])
+        result = await db.notifications.delete_many({"notification_id": {"$in": [d['notification_id'] for d in batch]}, "is_read": True})
+        archived += result.deleted_count
+        if len(batch) < NOTIFICATION_ARCHIVE_BATCH:
+            break
+    _retention_stats["runs"] += 1
+    _retention_stats["archived"] += archived
+    _retention_stats["last_run_at"] = datetime.now(timezone.utc).isoformat()
+    if archived:
+        logger.info(f"Bildirim arsivlendi: {archived}")
+    return archived
+
+async def notification_retention_worker():
+    while True:
+        try:
+            await archive_read_notifications()
+            _retention_stats["last_error"] = None
+        except Exception as e:
+            _retention_stats["last_error"] = str(e)
+            logger.error(f"Bildirim arsivleme hatasi: {e}")
+        await asyncio.sleep(NOTIFICATION_ARCHIVE_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_notification_retention():
+    if NOTIFICATION_ARCHIVE_DAYS > 0:
+        _retention_worker["task"] = asyncio.create_task(notification_retention_worker())
+
+@app.on_event("shutdown")
+async def stop_notification_retention():
+    if _retention_worker["task"]:
+        _retention_worker["task"].cancel()
+
 # ===== ADMIN ROUTES =====
 @api_router.get("/admin/stats")
 async def get_admin_stats(user=Depends(get_admin_user)):
@@ -566,130 +1799,161 @@ async def get_admin_stats(user=Depends(get_admin_user)):
         "pending_trades": pending_trades
     }
 
+@api_router.get("/admin/metrics")
+async def get_admin_metrics(user=Depends(get_admin_user)):
+    return METRICS
+
+@api_router.get("/admin/email-outbox")
+async def get_email_outbox(response: Response, status: str = 'dead', cursor: str = None, limit: int = 100, user=Depends(get_admin_user)):
+    items, next_cursor = await keyset_page(db.email_outbox, {"status": status}, 'email_id', cursor, limit,
+                                           projection={"_id": 0, "html": 0})
+    set_next_cursor(response, next_cursor)
+    return items
+
+@api_router.post("/admin/email-outbox/{email_id}/retry")
+async def retry_email(email_id: str, admin=Depends(get_admin_user)):
+    result = await db.email_outbox.update_one({"email_id": email_id, "status": "dead"}, {"$set": {
+        "status": "pending", "attempts": 0, "next_attempt_at": datetime.now(timezone.utc)}})
+    if not result.modified_count:
+        raise HTTPException(status_code=404, detail="Bekleyen e-posta bulunamadi")
+    if _email_workers["wakeup"]:
+        _email_workers["wakeup"].set()
+    return {"message": "E-posta tekrar kuyruga alindi"}
+
+@api_router.post("/admin/notifications/reconcile-unread")
+async def reconcile_unread(admin=Depends(get_admin_user)):
+    result = await reconcile_unread_counts()
+    logger.info(f"Okunmamis bildirim sayaclari duzeltildi: {result['corrected']} kullanici")
+    return result
+
+@api_router.post("/admin/users/reconcile-holds")
+async def reconcile_holds_endpoint(admin=Depends(get_admin_user)):
+    result = await reconcile_holds()
+    logger.info(f"Bakiye blokesi mutabakati: {result['users_fixed']} kullanici duzeltildi")
+    return result
+
+@api_router.post("/admin/notifications/archive")
+async def archive_notifications(older_than_days: int = None, admin=Depends(get_admin_user)):
+    if older_than_days is not None and older_than_days < 0:
+        raise HTTPException(status_code=400, detail="Gecersiz gun sayisi")
+    return {"archived": await archive_read_notifications(older_than_days)}
+
+@api_router.post("/admin/portfolios/rebuild-summaries")
+async def rebuild_summaries(admin=Depends(get_admin_user)):
+    result = await rebuild_portfolio_summaries()
+    logger.info(f"Portfolyo ozetleri yeniden hesaplandi: {result['users']} yatirimci")
+    return result
+
+@api_router.post("/admin/projects/rebuild-stats")
+async def rebuild_stats(admin=Depends(get_admin_user)):
+    result = {**await rebuild_project_stats(), **await rebuild_share_inventory()}
+    logger.info(f"Proje istatistikleri yeniden hesaplandi: {result['projects']} proje, {result['holders']} yatirimci, {result['inventory_fixed']} envanter duzeltmesi")
+    return result
+
 @api_router.get("/admin/users")
-async def get_admin_users(user=Depends(get_admin_user)):
-    return await db.users.find({}, {"_id": 0, "password_hash": 0}).sort("created_at", -1).to_list(1000)
+async def get_admin_users(response: Response, cursor: str = None, limit: int = 1000, user=Depends(get_admin_user)):
+    items, next_cursor = await keyset_page(db.users, {}, 'user_id', cursor, limit, projection=USER_PROJECTION)
+    set_next_cursor(response, next_cursor)
+    return items
 
 @api_router.put("/admin/users/{user_id}/balance")
 async def update_user_balance(user_id: str, data: BalanceUpdate, admin=Depends(get_admin_user)):
     target = await db.users.find_one({"user_id": user_id}, {"_id": 0})
     if not target:
         raise HTTPException(status_code=404, detail="Kullanici bulunamadi")
+    if data.type in ('add', 'subtract'):
+        transaction_id = str(uuid.uuid4())
+        # A subtraction may not dip into funds reserved by pending withdrawals and buys
+        applied = await apply_balance_changes(
+            [(user_id, transaction_id, data.amount if data.type == 'add' else -data.amount, "admin_adjustment")],
+            extra_filter={"$expr": {"$gte": [AVAILABLE_BALANCE, data.amount]}} if data.type == 'subtract' else None)
+        await release_markers(db.users, 'user_id', [user_id], [transaction_id])
+        if not applied:
+            raise HTTPException(status_code=400, detail="Yetersiz bakiye")
     if data.type == 'add':
-        await db.users.update_one({"user_id": user_id}, {"$inc": {"balance": data.amount}})
         await db.transactions.insert_one({
-            "transaction_id": str(uuid.uuid4()), "user_id": user_id,
+            "transaction_id": transaction_id, "user_id": user_id,
             "user_name": target.get('name', ''), "type": "deposit",
             "amount": data.amount, "status": "approved",
             "created_at": datetime.now(timezone.utc).isoformat(), "approved_by": admin['user_id']
         })
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": user_id,
-            "title": "Para Yatirma Onaylandi", "message": f"Hesabiniza {data.amount:,.0f} TL yatirildi.",
-            "type": "deposit_approved", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        await notify("balance_added", user_id, amount=data.amount)
         await send_email(target.get('email', ''), "Alarko Enerji - Para Yatirma Onaylandi",
             f"<h2>Para Yatirma Onaylandi</h2><p>Sayin {target.get('name','')},</p><p>Hesabiniza <strong>{data.amount:,.0f} TL</strong> basariyla yatirilmistir.</p><p>Alarko Enerji Yatirim A.S.</p>")
     elif data.type == 'subtract':
-        if target.get('balance', 0) < data.amount:
-            raise HTTPException(status_code=400, detail="Yetersiz bakiye")
-        await db.users.update_one({"user_id": user_id}, {"$inc": {"balance": -data.amount}})
         await db.transactions.insert_one({
-            "transaction_id": str(uuid.uuid4()), "user_id": user_id,
+            "transaction_id": transaction_id, "user_id": user_id,
             "user_name": target.get('name', ''), "type": "withdrawal",
             "amount": data.amount, "status": "approved",
             "created_at": datetime.now(timezone.utc).isoformat(), "approved_by": admin['user_id']
         })
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": user_id,
-            "title": "Para Cekme Gerceklesti", "message": f"Hesabinizdan {data.amount:,.0f} TL cekildi.",
-            "type": "withdrawal", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        await notify("balance_subtracted", user_id, amount=data.amount)
         await send_email(target.get('email', ''), "Alarko Enerji - Para Cekme Islemi",
             f"<h2>Para Cekme Islemi</h2><p>Sayin {target.get('name','')},</p><p>Hesabinizdan <strong>{data.amount:,.0f} TL</strong> cekilmistir.</p><p>Alarko Enerji Yatirim A.S.</p>")
-    updated = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
+    updated = await db.users.find_one({"user_id": user_id}, USER_PROJECTION)
     return updated
 
 @api_router.put("/admin/users/{user_id}/role")
 async def update_user_role(user_id: str, data: RoleUpdate, admin=Depends(get_admin_user)):
-    await db.users.update_one({"user_id": user_id}, {"$set": {"role": data.role}})
+    await update_user(user_id, {"$set": {"role": data.role}})
     return {"message": "Rol guncellendi"}
 
 @api_router.get("/admin/transactions")
-async def get_admin_transactions(user=Depends(get_admin_user)):
-    return await db.transactions.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+async def get_admin_transactions(response: Response, cursor: str = None, limit: int = 1000, user=Depends(get_admin_user)):
+    items, next_cursor = await keyset_page(db.transactions, {}, 'transaction_id', cursor, limit)
+    set_next_cursor(response, next_cursor)
+    return items
 
 @api_router.put("/admin/transactions/{transaction_id}")
 async def update_transaction_status(transaction_id: str, data: TransactionStatusUpdate, admin=Depends(get_admin_user)):
-    txn = await db.transactions.find_one({"transaction_id": transaction_id}, {"_id": 0})
-    if not txn:
-        raise HTTPException(status_code=404, detail="Islem bulunamadi")
-    if txn.get('status') != 'pending':
-        raise HTTPException(status_code=400, detail="Bu islem zaten islendi")
-    await db.transactions.update_one({"transaction_id": transaction_id}, {"$set": {"status": data.status}})
-    if data.status == 'approved' and txn['type'] == 'deposit':
-        await db.users.update_one({"user_id": txn['user_id']}, {"$inc": {"balance": txn['amount']}})
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": txn['user_id'],
-            "title": "Para Yatirma Onaylandi", "message": f"{txn['amount']:,.0f} TL tutarindaki yatirma talebiniz onaylandi.",
-            "type": "deposit_approved", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
-    elif data.status == 'approved' and txn['type'] == 'withdrawal':
-        target_user = await db.users.find_one({"user_id": txn['user_id']}, {"_id": 0})
-        if not target_user or target_user.get('balance', 0) < txn['amount']:
-            await db.transactions.update_one({"transaction_id": transaction_id}, {"$set": {"status": "rejected"}})
-            raise HTTPException(status_code=400, detail="Kullanicinin bakiyesi yetersiz")
-        await db.users.update_one({"user_id": txn['user_id']}, {"$inc": {"balance": -txn['amount']}})
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": txn['user_id'],
-            "title": "Para Cekme Onaylandi", "message": f"{txn['amount']:,.0f} TL tutarindaki cekme talebiniz onaylandi ve hesabinizdan dusuldu.",
-            "type": "withdrawal_approved", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
-    elif data.status == 'rejected' and txn['type'] == 'withdrawal':
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": txn['user_id'],
-            "title": "Para Cekme Reddedildi", "message": f"{txn['amount']:,.0f} TL tutarindaki cekme talebiniz reddedildi.",
-            "type": "withdrawal_rejected", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
-    elif data.status == 'rejected' and txn['type'] == 'deposit':
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": txn['user_id'],
-            "title": "Para Yatirma Reddedildi", "message": f"{txn['amount']:,.0f} TL tutarindaki yatirma talebiniz reddedildi.",
-            "type": "deposit_rejected", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
+    report = await settle("transactions", [transaction_id], data.status, admin['user_id'])
+    raise_for_item(report[transaction_id])
     return {"message": "Islem guncellendi"}
 
+@api_router.post("/admin/transactions/bulk")
+async def bulk_update_transactions(data: BulkStatusUpdate, admin=Depends(get_admin_user)):
+    if not data.ids or len(data.ids) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"1 ile {BULK_MAX_ITEMS} arasi kayit secin")
+    report = await settle("transactions", data.ids, data.status, admin['user_id'])
+    return bulk_summary(data.ids, report)
+
 @api_router.get("/admin/portfolios")
-async def get_admin_portfolios(user_id: str = None, user=Depends(get_admin_user)):
-    query = {"user_id": user_id} if user_id else {}
-    portfolios = await db.portfolios.find(query, {"_id": 0}).to_list(1000)
-    for p in portfolios:
-        u = await db.users.find_one({"user_id": p['user_id']}, {"_id": 0, "name": 1, "email": 1})
-        if u:
-            p['user_name'] = u.get('name', '')
-            p['user_email'] = u.get('email', '')
-    return portfolios
+async def get_admin_portfolios(user_id: str = None, project_id: str = None, skip: int = 0, limit: int = 1000, user=Depends(get_admin_user)):
+    query = {}
+    if user_id:
+        query['user_id'] = user_id
+    if project_id:
+        query['project_id'] = project_id
+    skip, limit = max(skip, 0), min(max(limit, 1), 1000)
+    portfolios = await db.portfolios.find(query, {"_id": 0}).sort([("purchase_date", -1), ("portfolio_id", 1)]).skip(skip).to_list(limit)
+    return await attach_user_fields(portfolios)
+
+def investor_overview_pipeline(skip: int = 0, limit: int = 1000) -> list:
+    # One round trip: join each investor's precomputed summary (balance stays live on users), then sort and page
+    def summary(field, default):
+        return {"$ifNull": [{"$arrayElemAt": [f"$summary.{field}", 0]}, default]}
+    return [
+        {"$match": {"role": "investor"}},
+        {"$lookup": {"from": "portfolio_summaries", "localField": "user_id", "foreignField": "user_id", "as": "summary"}},
+        {"$project": {
+            "_id": 0, "user_id": 1, "name": {"$ifNull": ["$name", ""]}, "email": {"$ifNull": ["$email", ""]},
+            "tc_kimlik": {"$ifNull": ["$tc_kimlik", ""]}, "phone": {"$ifNull": ["$phone", ""]},
+            "balance": {"$ifNull": ["$balance", 0]}, "kyc_status": {"$ifNull": ["$kyc_status", ""]},
+            "total_shares": summary("total_shares", 0), "total_invested": summary("total_invested", 0),
+            "total_monthly_return": summary("total_monthly_return", 0),
+            "portfolio_count": summary("portfolio_count", 0), "portfolios": summary("investments", [])
+        }},
+        {"$addFields": {"_sort_total": {"$add": ["$total_invested", "$balance"]}}},
+        {"$sort": {"_sort_total": -1, "user_id": 1}},
+        {"$skip": skip},
+        {"$limit": limit},
+        {"$project": {"_sort_total": 0}}
+    ]
 
 @api_router.get("/admin/investor-overview")
-async def get_investor_overview(admin=Depends(get_admin_user)):
-    investors = await db.users.find({"role": "investor"}, {"_id": 0, "password_hash": 0}).to_list(1000)
-    result = []
-    for inv in investors:
-        uid = inv['user_id']
-        portfolios = await db.portfolios.find({"user_id": uid}, {"_id": 0}).to_list(100)
-        total_shares = sum(p.get('shares', 0) for p in portfolios)
-        total_invested = sum(p.get('amount', 0) for p in portfolios)
-        total_return = sum(p.get('monthly_return', 0) for p in portfolios)
-        result.append({
-            "user_id": uid, "name": inv.get('name', ''), "email": inv.get('email', ''),
-            "tc_kimlik": inv.get('tc_kimlik', ''), "phone": inv.get('phone', ''),
-            "balance": inv.get('balance', 0), "kyc_status": inv.get('kyc_status', ''),
-            "total_shares": total_shares, "total_invested": total_invested,
-            "total_monthly_return": total_return, "portfolio_count": len(portfolios),
-            "portfolios": portfolios
-        })
-    result.sort(key=lambda x: x['total_invested'] + x['balance'], reverse=True)
-    return result
+async def get_investor_overview(skip: int = 0, limit: int = 1000, admin=Depends(get_admin_user)):
+    skip, limit = max(skip, 0), min(max(limit, 1), 1000)
+    return await db.users.aggregate(investor_overview_pipeline(skip, limit), allowDiskUse=True).to_list(limit)
 
 @api_router.post("/admin/portfolios/add")
 async def admin_add_portfolio(data: dict, admin=Depends(get_admin_user)):
@@ -699,28 +1963,21 @@ async def admin_add_portfolio(data: dict, admin=Depends(get_admin_user)):
     target = await db.users.find_one({"user_id": user_id}, {"_id": 0})
     if not target:
         raise HTTPException(status_code=404, detail="Kullanici bulunamadi")
-    project = await db.projects.find_one({"project_id": project_id}, {"_id": 0})
-    if not project:
-        raise HTTPException(status_code=404, detail="Proje bulunamadi")
-    amount = shares * SHARE_PRICE
-    usd_rate = get_usd_rate()
-    if shares >= 10: actual_rate, usd_based = 8.0, True
-    elif shares >= 5: actual_rate, usd_based = 7.0, True
-    else: actual_rate, usd_based = 7.0, False
-    if usd_based:
-        monthly_return = (amount / usd_rate) * (actual_rate / 100) * usd_rate
-    else:
-        monthly_return = amount * (actual_rate / 100)
-    entry = {
-        "portfolio_id": str(uuid.uuid4()), "user_id": user_id,
-        "project_id": project_id, "project_name": project['name'],
-        "project_type": project['type'], "amount": amount,
-        "shares": shares, "usd_based": usd_based,
-        "usd_rate_at_purchase": usd_rate if usd_based else None,
-        "monthly_return": round(monthly_return, 2), "return_rate": actual_rate,
-        "purchase_date": datetime.now(timezone.utc).isoformat(), "status": "active"
-    }
-    await db.portfolios.insert_one(entry)
+    if not isinstance(shares, int) or shares < 1:
+        raise HTTPException(status_code=400, detail="Gecersiz hisse adedi")
+    # Admin adds draw from the same inventory as buys: no override past total_shares
+    portfolio_id = str(uuid.uuid4())
+    project = await reserve_project_shares(project_id, portfolio_id, shares)
+    try:
+        entry = new_portfolio_entry(user_id, project_id, project['name'], project['type'], shares, shares * SHARE_PRICE,
+                                    get_usd_rate(), portfolio_id=portfolio_id)
+        await db.portfolios.insert_one(entry)
+        await update_portfolio_summary(user_id, [entry])
+        await record_holding_change(project_id, user_id, shares, entry['amount'])
+    finally:
+        # Once funded_shares carries the add, dropping the reservation never frees sold shares
+        await release_share_holds([(project_id, portfolio_id)])
+    await bump_catalog_version()
     return {k: v for k, v in entry.items() if k != '_id'}
 
 @api_router.delete("/admin/portfolios/{portfolio_id}")
@@ -733,16 +1990,26 @@ async def admin_delete_portfolio(portfolio_id: str, shares: int = 0, admin=Depen
     if remove_shares > total_shares:
         raise HTTPException(status_code=400, detail=f"En fazla {total_shares} hisse silebilirsiniz")
     if remove_shares >= total_shares:
-        await db.portfolios.delete_one({"portfolio_id": portfolio_id})
+        result = await db.portfolios.delete_one({"portfolio_id": portfolio_id})
+        if result.deleted_count:
+            await update_portfolio_summary(inv['user_id'], remove_ids=[portfolio_id])
+            await record_holding_change(inv.get('project_id', ''), inv['user_id'], -total_shares, -inv['amount'])
+            await bump_catalog_version()
         return {"message": f"{total_shares} hisse tamamen silindi"}
     per_share_amount = inv['amount'] / total_shares
     per_share_return = inv.get('monthly_return', 0) / total_shares
     remaining = total_shares - remove_shares
-    await db.portfolios.update_one({"portfolio_id": portfolio_id}, {"$set": {
+    remaining_amount = round(per_share_amount * remaining, 2)
+    result = await db.portfolios.update_one({"portfolio_id": portfolio_id, "shares": total_shares}, {"$set": {
         "shares": remaining,
-        "amount": round(per_share_amount * remaining, 2),
+        "amount": remaining_amount,
         "monthly_return": round(per_share_return * remaining, 2)
     }})
+    if not result.modified_count:
+        raise HTTPException(status_code=409, detail="Portfolyo ayni anda degistirildi, tekrar deneyin")
+    await sync_portfolio_summary(inv['user_id'], [portfolio_id])
+    await record_holding_change(inv.get('project_id', ''), inv['user_id'], -remove_shares, remaining_amount - inv['amount'])
+    await bump_catalog_version()
     return {"message": f"{remove_shares} hisse silindi, {remaining} hisse kaldi"}
 
 @api_router.post("/admin/kyc/approve-user/{user_id}")
@@ -750,24 +2017,85 @@ async def admin_approve_kyc_direct(user_id: str, admin=Depends(get_admin_user)):
     target = await db.users.find_one({"user_id": user_id}, {"_id": 0})
     if not target:
         raise HTTPException(status_code=404, detail="Kullanici bulunamadi")
-    await db.users.update_one({"user_id": user_id}, {"$set": {"kyc_status": "approved"}})
-    await db.notifications.insert_one({
-        "notification_id": str(uuid.uuid4()), "user_id": user_id,
-        "title": "Kimlik Dogrulamasi Onaylandi", "message": "Kimlik dogrulamaniz admin tarafindan onaylandi. Artik yatirim yapabilirsiniz.",
-        "type": "kyc_approved", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    await update_user(user_id, {"$set": {"kyc_status": "approved"}})
+    await notify("kyc_approved_by_admin", user_id)
     return {"message": "KYC onaylandi"}
 
+# ===== ADMIN EXPORTS =====
+EXPORT_BATCH_SIZE = 500
+EXPORTS = {
+    "transactions": {"collection": "transactions", "date_field": "created_at", "id_field": "transaction_id",
+                     "columns": ["transaction_id", "user_id", "user_name", "type", "amount", "status", "created_at", "approved_by"]},
+    "trade-requests": {"collection": "trade_requests", "date_field": "created_at", "id_field": "request_id",
+                       "columns": ["request_id", "user_id", "user_name", "type", "project_id", "project_name", "project_type",
+                                   "shares", "amount", "portfolio_id", "status", "created_at", "processed_at"]},
+    "portfolios": {"collection": "portfolios", "date_field": "purchase_date", "id_field": "portfolio_id",
+                   "columns": ["portfolio_id", "user_id", "project_id", "project_name", "project_type", "shares", "amount",
+                               "usd_based", "usd_rate_at_purchase", "monthly_return", "return_rate", "status", "purchase_date"]},
+}
+
+def export_query(spec: dict, date_from: datetime = None, date_to: datetime = None, status: str = None, type: str = None) -> dict:
+    query = {}
+    if date_from or date_to:
+        query[spec['date_field']] = {}
+        if date_from:
+            query[spec['date_field']]['$gte'] = _as_utc(date_from).astimezone(timezone.utc).isoformat()
+        if date_to:
+            query[spec['date_field']]['$lt'] = _as_utc(date_to).astimezone(timezone.utc).isoformat()
+    if status:
+        query['status'] = status
+    if type:
+        query['type'] = type
+    return query
+
+async def export_rows(spec: dict, query: dict, fmt: str):
+    # Rows go from the cursor to the socket one batch at a time; Starlette awaits each send,
+    # so a slow client pauses the cursor instead of letting rows pile up in memory
+    columns = spec['columns']
+    cursor = db[spec['collection']].find(query, {"_id": 0}).sort(spec['date_field'], 1).batch_size(EXPORT_BATCH_SIZE)
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=columns, extrasaction='ignore') if fmt == 'csv' else None
+    if writer:
+        writer.writeheader()
+    count = 0
+    async for doc in cursor:
+        if writer:
+            writer.writerow(doc)
+        else:
+            buf.write(json.dumps(doc, default=str, ensure_ascii=False))
+            buf.write('\n')
+        count += 1
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+@api_router.get("/admin/export/{kind}")
+async def admin_export(kind: str, format: str = 'csv', date_from: datetime = None, date_to: datetime = None,
+                       status: str = None, type: str = None, admin=Depends(get_admin_user)):
+    spec = EXPORTS.get(kind)
+    if not spec:
+        raise HTTPException(status_code=404, detail="Gecersiz disa aktarma turu")
+    if format not in ('csv', 'ndjson'):
+        raise HTTPException(status_code=400, detail="Format csv veya ndjson olmalidir")
+    query = export_query(spec, date_from, date_to, status, type)
+    media_type = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    filename = f"{kind}_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.{format}"
+    return StreamingResponse(export_rows(spec, query, format), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
 # ===== PASSWORD CHANGE =====
 @api_router.post("/auth/change-password")
 async def change_password(data: PasswordChange, user=Depends(get_current_user)):
     if not user.get('password_hash'):
         raise HTTPException(status_code=400, detail="Bu hesap Google ile olusturulmus. Sifre degistirilemez.")
-    if not verify_password(data.current_password, user['password_hash']):
+    if not await verify_password(data.current_password, user['password_hash']):
         raise HTTPException(status_code=400, detail="Mevcut sifre hatali")
     if len(data.new_password) < 6:
         raise HTTPException(status_code=400, detail="Yeni sifre en az 6 karakter olmali")
-    await db.users.update_one({"user_id": user['user_id']}, {"$set": {"password_hash": hash_password(data.new_password)}})
+    await update_user(user['user_id'], {"$set": {"password_hash": await hash_password(data.new_password)}})
     return {"message": "Sifre basariyla degistirildi"}
 
 # ===== ADMIN USER INFO UPDATE =====
@@ -789,11 +2117,11 @@ async def update_user_info(user_id: str, data: UserInfoUpdate, admin=Depends(get
     if data.new_password:
         if len(data.new_password) < 6:
             raise HTTPException(status_code=400, detail="Sifre en az 6 karakter olmali")
-        update_data['password_hash'] = hash_password(data.new_password)
+        update_data['password_hash'] = await hash_password(data.new_password)
     if not update_data:
         raise HTTPException(status_code=400, detail="Guncellenecek bilgi bulunamadi")
-    await db.users.update_one({"user_id": user_id}, {"$set": update_data})
-    updated = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
+    await update_user(user_id, {"$set": update_data})
+    updated = await db.users.find_one({"user_id": user_id}, USER_PROJECTION)
     return updated
 
 # ===== ADMIN CREATE USER =====
@@ -812,98 +2140,851 @@ async def admin_create_user(data: AdminUserCreate, admin=Depends(get_admin_user)
     user_id = f"user_{uuid.uuid4().hex[:12]}"
     user = {
         "user_id": user_id, "email": data.email,
-        "password_hash": hash_password(data.password),
+        "password_hash": await hash_password(data.password),
         "name": data.name, "phone": data.phone, "tc_kimlik": data.tc_kimlik,
         "role": "investor", "kyc_status": "pending",
         "balance": 0.0, "picture": "",
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.users.insert_one(user)
-    await db.notifications.insert_one({
-        "notification_id": str(uuid.uuid4()), "user_id": user_id,
-        "title": "Hos Geldiniz!", "message": "Alarko Enerji platformuna hos geldiniz.",
-        "type": "welcome", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    await notify("welcome", user_id)
     await send_email(data.email, "Alarko Enerji - Hesabiniz Olusturuldu",
         f"<h2>Hosgeldiniz!</h2><p>Sayin {data.name},</p><p>Alarko Enerji platformunda hesabiniz olusturulmustur.</p><p><strong>TC Kimlik No:</strong> {data.tc_kimlik}</p><p><strong>Sifreniz:</strong> {data.password}</p><p>Platformumuza giris yaparak yatirimlarinizi takip edebilirsiniz.</p><p>Alarko Enerji Yatirim A.S.</p>")
-    return {k: v for k, v in user.items() if k not in ('_id', 'password_hash')}
+    return public_user(user)
 
 # ===== ADMIN TRADE REQUESTS =====
 @api_router.get("/admin/trade-requests")
-async def get_admin_trade_requests(user=Depends(get_admin_user)):
-    return await db.trade_requests.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+async def get_admin_trade_requests(response: Response, cursor: str = None, limit: int = 1000, user=Depends(get_admin_user)):
+    items, next_cursor = await keyset_page(db.trade_requests, {}, 'request_id', cursor, limit)
+    set_next_cursor(response, next_cursor)
+    return items
+
+# ===== BALANCE HOLDS =====
+# Pending buy requests and withdrawals hold their amount: users.reserved_balance is the total and
+# users.holds has one {hold_id, amount, at} entry per request. Placing a hold is one conditional
+# update on balance - reserved_balance, so concurrent requests cannot oversubscribe the funds.
+# Settling moves the money and drops the hold in the same write (see ledger_update); a rejection
+# releases it before the request is finished.
+HOLD_GRACE_SECONDS = 60
+_hold_stats = {"placed": 0, "refused": 0, "released": 0, "reconciled": 0}
+METRICS["holds"] = _hold_stats
+
+AVAILABLE_BALANCE = {"$subtract": [{"$ifNull": ["$balance", 0]}, {"$ifNull": ["$reserved_balance", 0]}]}
+
+def available_balance(user: dict) -> float:
+    return round((user.get('balance', 0) or 0) - (user.get('reserved_balance', 0) or 0), 2)
+
+def hold_release(hold_ids: list, holds: str = 'holds', total: str = 'reserved_balance', amount: str = 'amount') -> dict:
+    # $set fields that drop the given holds and subtract their amounts from the reserved total
+    released = {"$filter": {"input": {"$ifNull": [f"${holds}", []]}, "cond": {"$in": ["$$this.hold_id", {"$literal": hold_ids}]}}}
+    return {total: {"$round": [{"$subtract": [{"$ifNull": [f"${total}", 0]},
+                                              {"$sum": {"$map": {"input": released, "in": f"$$this.{amount}"}}}]}, 2]},
+            holds: {"$filter": {"input": {"$ifNull": [f"${holds}", []]}, "cond": {"$not": [{"$in": ["$$this.hold_id", {"$literal": hold_ids}]}]}}}}
+
+async def place_hold(user_id: str, hold_id: str, amount: float):
+    hold = {"hold_id": hold_id, "amount": amount, "at": datetime.now(timezone.utc).isoformat()}
+    result = await update_user(user_id, {"$inc": {"reserved_balance": amount}, "$push": {"holds": hold}}, {
+        "holds.hold_id": {"$ne": hold_id},
+        "$expr": {"$gte": [AVAILABLE_BALANCE, amount]}})
+    if result.modified_count:
+        _hold_stats["placed"] += 1
+        return
+    # A re-run of the same keyed request finds its hold already in place
+    if await db.users.count_documents({"user_id": user_id, "holds.hold_id": hold_id}, limit=1):
+        return
+    _hold_stats["refused"] += 1
+    raise HTTPException(status_code=400, detail="Yetersiz bakiye")
+
+async def release_holds(holds: list):
+    # holds: (user_id, hold_id); releasing an already released hold is a no-op
+    by_user = {}
+    for uid, hold_id in holds:
+        by_user.setdefault(uid, []).append(hold_id)
+    if not by_user:
+        return
+    result = await with_retry(lambda: db.users.bulk_write([
+        UpdateOne({"user_id": uid, "holds.hold_id": {"$in": ids}}, [{"$set": hold_release(ids)}]) for uid, ids in by_user.items()], ordered=False))
+    for uid in by_user:
+        invalidate_user(uid)
+    _hold_stats["released"] += result.modified_count
+
+async def reconcile_holds() -> dict:
+    # Rebuilds holds from open requests. A hold without an open request is kept for HOLD_GRACE_SECONDS,
+    # since its request may still be being inserted; each fix only applies if the holds did not change meanwhile.
+    now = datetime.now(timezone.utc)
+    cutoff = (now - timedelta(seconds=HOLD_GRACE_SECONDS)).isoformat()
+    open_requests = {}
+    for collection, id_field, query in ((db.trade_requests, 'request_id', {"type": "buy"}), (db.transactions, 'transaction_id', {"type": "withdrawal"})):
+        async for doc in collection.find({**query, "status": {"$in": ["pending", "processing"]}}, {"_id": 0, id_field: 1, "user_id": 1, "amount": 1}):
+            open_requests.setdefault(doc['user_id'], {})[doc[id_field]] = doc['amount']
+    ops, fixed_ids, checked = [], [], 0
+    async for u in db.users.find({"$or": [{"holds.0": {"$exists": True}}, {"reserved_balance": {"$nin": [0, None]}},
+                                          {"user_id": {"$in": list(open_requests)}}]},
+                                 {"_id": 0, "user_id": 1, "holds": 1, "reserved_balance": 1}):
+        checked += 1
+        current, wanted = u.get('holds') or [], open_requests.get(u['user_id'], {})
+        holds = [h for h in current if h['hold_id'] in wanted or h.get('at', '') > cutoff]
+        held = {h['hold_id'] for h in holds}
+        holds += [{"hold_id": rid, "amount": amount, "at": now.isoformat()} for rid, amount in wanted.items() if rid not in held]
+        reserved = round(sum(h['amount'] for h in holds), 2)
+        if holds != current or round(u.get('reserved_balance') or 0, 2) != reserved:
+            ops.append(UpdateOne({"user_id": u['user_id'], "holds": u.get('holds'), "reserved_balance": u.get('reserved_balance')},
+                                 {"$set": {"holds": holds, "reserved_balance": reserved}}))
+            fixed_ids.append(u['user_id'])
+    fixed = 0
+    if ops:
+        fixed = (await db.users.bulk_write(ops, ordered=False)).modified_count
+        for uid in fixed_ids:
+            invalidate_user(uid)
+        _hold_stats["reconciled"] += fixed
+    return {"users_checked": checked, "users_fixed": fixed}
 
-@api_router.put("/admin/trade-requests/{request_id}")
-async def update_trade_request(request_id: str, data: TransactionStatusUpdate, admin=Depends(get_admin_user)):
-    req = await db.trade_requests.find_one({"request_id": request_id}, {"_id": 0})
-    if not req:
-        raise HTTPException(status_code=404, detail="Talep bulunamadi")
-    if req.get('status') != 'pending':
-        raise HTTPException(status_code=400, detail="Bu talep zaten islendi")
-    await db.trade_requests.update_one({"request_id": request_id}, {"$set": {"status": data.status, "processed_at": datetime.now(timezone.utc).isoformat()}})
-    user = await db.users.find_one({"user_id": req['user_id']}, {"_id": 0})
-    if data.status == 'approved' and req['type'] == 'buy':
-        if not user or user.get('balance', 0) < req['amount']:
-            await db.trade_requests.update_one({"request_id": request_id}, {"$set": {"status": "rejected"}})
-            raise HTTPException(status_code=400, detail="Kullanicinin bakiyesi yetersiz")
-        shares = req['shares']
-        usd_rate = get_usd_rate()
-        if shares >= 10: actual_rate, usd_based = 8.0, True
-        elif shares >= 5: actual_rate, usd_based = 7.0, True
-        else: actual_rate, usd_based = 7.0, False
-        if usd_based:
-            monthly_return = (req['amount'] / usd_rate) * (actual_rate / 100) * usd_rate
-        else:
-            monthly_return = req['amount'] * (actual_rate / 100)
-        entry = {
-            "portfolio_id": str(uuid.uuid4()), "user_id": req['user_id'],
-            "project_id": req['project_id'], "project_name": req['project_name'],
-            "project_type": req.get('project_type', ''), "amount": req['amount'],
-            "shares": shares, "usd_based": usd_based,
-            "usd_rate_at_purchase": usd_rate if usd_based else None,
-            "monthly_return": round(monthly_return, 2), "return_rate": actual_rate,
-            "purchase_date": datetime.now(timezone.utc).isoformat(), "status": "active"
-        }
-        await db.portfolios.insert_one(entry)
-        await db.users.update_one({"user_id": req['user_id']}, {"$inc": {"balance": -req['amount']}})
-        await db.projects.update_one({"project_id": req['project_id']}, {"$inc": {"funded_amount": req['amount'], "investors_count": 1}})
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": req['user_id'],
-            "title": "Alim Talebi Onaylandi", "message": f"{req['project_name']} projesine {shares} hisse yatiriminiz onaylandi.",
-            "type": "trade_approved", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
-    elif data.status == 'approved' and req['type'] == 'sell':
-        inv = await db.portfolios.find_one({"portfolio_id": req.get('portfolio_id', ''), "user_id": req['user_id']}, {"_id": 0})
+@app.on_event("startup")
+async def backfill_holds():
+    result = await reconcile_holds()
+    if result['users_fixed']:
+        logger.info(f"Bakiye blokeleri yeniden olusturuldu: {result['users_fixed']} kullanici")
+
+# ===== LEDGER =====
+# Every balance movement is a journal of two append-only ledger_entries legs, the investor's
+# account and a platform contra account, which sum to zero. users.balance is the O(1) cached
+# balance: it only changes in the same conditional pipeline update that appends a
+# ledger_pending record (with the running balance and sequence), and pending records are then
+# posted to ledger_entries and cleared. The op id is the idempotency key; it stays in
+# users.pending_ops until the caller releases it.
+LEDGER_CONTRA_ACCOUNTS = {
+    "deposit": "platform:bank", "withdrawal": "platform:bank",
+    "trade_buy": "platform:investments", "trade_sell": "platform:investments",
+    "return_payout": "platform:returns", "admin_adjustment": "platform:adjustments",
+    "opening_balance": "platform:opening",
+}
+_ledger_stats = {"journals": 0, "rejected": 0, "repaired": 0}
+METRICS["ledger"] = _ledger_stats
+
+def ledger_update(items: list, extra_set: dict = None) -> list:
+    # items: (op_id, delta, kind) in apply order; one $set stage computes every running balance
+    pending, running = [], 0.0
+    for i, (op_id, delta, kind) in enumerate(items, 1):
+        running = round(running + delta, 2)
+        pending.append({"key": {"$literal": op_id}, "amount": delta, "kind": {"$literal": kind},
+                        "seq": {"$add": [{"$ifNull": ["$ledger_seq", 0]}, i]},
+                        "balance_after": {"$add": [{"$ifNull": ["$balance", 0]}, running]}})
+    return [{"$set": {
+        "ledger_pending": {"$concatArrays": [{"$ifNull": ["$ledger_pending", []]}, pending]},
+        "pending_ops": {"$setUnion": [{"$ifNull": ["$pending_ops", []]}, {"$literal": [i[0] for i in items]}]},
+        "balance": {"$add": [{"$ifNull": ["$balance", 0]}, running]},
+        "ledger_seq": {"$add": [{"$ifNull": ["$ledger_seq", 0]}, len(items)]},
+        **hold_release([i[0] for i in items]), **(extra_set or {})}}]
+
+async def post_ledger(user_ids: list):
+    users = await db.users.find({"user_id": {"$in": user_ids}, "ledger_pending.0": {"$exists": True}},
+                                {"_id": 0, "user_id": 1, "ledger_pending": 1}).to_list(None)
+    if not users:
+        return
+    now = datetime.now(timezone.utc).isoformat()
+    entries, cleared = [], []
+    for u in users:
+        account = f"user:{u['user_id']}"
+        for p in u['ledger_pending']:
+            contra = LEDGER_CONTRA_ACCOUNTS[p['kind']]
+            journal = {"journal_id": p['key'], "kind": p['kind'], "created_at": now}
+            entries.append({**journal, "entry_id": f"{p['key']}:{account}", "account": account, "user_id": u['user_id'],
+                            "amount": p['amount'], "seq": p['seq'], "balance_after": round(p['balance_after'], 2)})
+            entries.append({**journal, "entry_id": f"{p['key']}:{contra}", "account": contra, "amount": -p['amount']})
+        cleared.append(UpdateOne({"user_id": u['user_id']},
+                                 {"$pull": {"ledger_pending": {"key": {"$in": [p['key'] for p in u['ledger_pending']]}}}}))
+    await insert_many_once(db.ledger_entries, entries)
+    await with_retry(lambda: db.users.bulk_write(cleared, ordered=False))
+
+async def apply_balance_changes(changes: list, extra_filter: dict = None, extra_set: dict = None) -> set:
+    # changes: (user_id, op_id, delta, kind). One conditional update per user in a single bulk_write;
+    # a user whose grouped change does not fit the balance falls back to per-operation updates.
+    by_user = {}
+    for uid, op_id, delta, kind in changes:
+        by_user.setdefault(uid, []).append((op_id, delta, kind))
+    if not by_user:
+        return set()
+    ops = []
+    for uid, items in by_user.items():
+        # Credits first so a deposit in the same batch can fund a withdrawal
+        items.sort(key=lambda x: -x[1])
+        op_ids, net = [i[0] for i in items], sum(i[1] for i in items)
+        flt = {"user_id": uid, "pending_ops": {"$nin": op_ids}, **(extra_filter or {})}
+        if net < 0:
+            flt["balance"] = {"$gte": -net}
+        ops.append(UpdateOne(flt, ledger_update(items, extra_set)))
+    await with_retry(lambda: db.users.bulk_write(ops, ordered=False))
+    held = {u['user_id']: set(u.get('pending_ops', []))
+            async for u in db.users.find({"user_id": {"$in": list(by_user)}}, {"_id": 0, "user_id": 1, "pending_ops": 1})}
+    applied = set()
+    for uid, items in by_user.items():
+        invalidate_user(uid)
+        if uid not in held:
+            continue
+        for op_id, delta, kind in items:
+            if op_id in held[uid]:
+                applied.add(op_id)
+                continue
+            flt = {"pending_ops": {"$ne": op_id}, **(extra_filter or {})}
+            if delta < 0:
+                flt["balance"] = {"$gte": -delta}
+            result = await with_retry(lambda: update_user(uid, ledger_update([(op_id, delta, kind)], extra_set), flt))
+            if result.modified_count:
+                applied.add(op_id)
+    await post_ledger(list(held))
+    _ledger_stats["journals"] += len(applied)
+    _ledger_stats["rejected"] += len(changes) - len(applied)
+    return applied
+
+async def reconcile_ledger(repair: bool = False) -> dict:
+    # One aggregation sums every investor's ledger legs; users are streamed once and compared
+    expected = {row['_id']: round(row['balance'], 2) async for row in db.ledger_entries.aggregate([
+        {"$match": {"user_id": {"$exists": True}}},
+        {"$group": {"_id": "$user_id", "balance": {"$sum": "$amount"}}}], allowDiskUse=True)}
+    checked, mismatched = 0, []
+    async for u in db.users.find({}, {"_id": 0, "user_id": 1, "balance": 1, "ledger_pending": 1}):
+        checked += 1
+        if u.get('ledger_pending'):
+            continue  # mid-posting; its ledger legs are not written yet
+        balance = round(u.get('balance', 0) or 0, 2)
+        if abs(expected.get(u['user_id'], 0.0) - balance) > 0.005:
+            mismatched.append({"user_id": u['user_id'], "balance": balance, "ledger_balance": expected.get(u['user_id'], 0.0)})
+    unbalanced = await db.ledger_entries.aggregate([
+        {"$group": {"_id": "$journal_id", "sum": {"$sum": "$amount"}}},
+        {"$match": {"$expr": {"$gt": [{"$abs": "$sum"}, 0.005]}}}, {"$count": "n"}], allowDiskUse=True).to_list(1)
+    repaired = 0
+    if repair and mismatched:
+        # The ledger is the source of truth; the balance only moves if nothing changed it since the read
+        result = await db.users.bulk_write([UpdateOne({"user_id": m['user_id'], "balance": m['balance']},
+                                                      {"$set": {"balance": m['ledger_balance']}}) for m in mismatched], ordered=False)
+        repaired = result.modified_count
+        _ledger_stats["repaired"] += repaired
+        for m in mismatched:
+            invalidate_user(m['user_id'])
+    return {"users_checked": checked, "mismatched": len(mismatched), "repaired": repaired,
+            "unbalanced_journals": unbalanced[0]['n'] if unbalanced else 0, "sample": mismatched[:50]}
+
+@app.on_event("startup")
+async def open_ledger_accounts():
+    # Balances that predate the ledger get one opening journal; then any half-posted changes are posted
+    opening = await db.users.distinct("user_id", {"ledger_seq": {"$exists": False}, "balance": {"$nin": [0, None]}})
+    if opening:
+        await db.users.bulk_write([UpdateOne({"user_id": uid, "ledger_seq": {"$exists": False}}, [{"$set": {
+            "ledger_seq": 1, "ledger_pending": [{"key": {"$literal": f"opening:{uid}"}, "amount": "$balance",
+                                                 "kind": "opening_balance", "seq": 1, "balance_after": "$balance"}]}}])
+            for uid in opening], ordered=False)
+        logger.info(f"Defter acilis kayitlari: {len(opening)} kullanici")
+    await post_ledger(await db.users.distinct("user_id", {"ledger_pending.0": {"$exists": True}}))
+
+@api_router.get("/ledger")
+async def get_ledger(response: Response, cursor: str = None, limit: int = 100, user=Depends(get_token_identity)):
+    items, next_cursor = await keyset_page(db.ledger_entries, {"account": f"user:{user['user_id']}"}, 'entry_id', cursor, limit,
+                                           sort_field='seq', projection={"_id": 0})
+    set_next_cursor(response, next_cursor)
+    return items
+
+@api_router.post("/admin/ledger/reconcile")
+async def reconcile_ledger_endpoint(repair: bool = False, admin=Depends(get_admin_user)):
+    result = await reconcile_ledger(repair)
+    logger.info(f"Defter mutabakati: {result['mismatched']} fark, {result['repaired']} duzeltme, {result['unbalanced_journals']} dengesiz kayit")
+    return result
+
+# ===== SETTLEMENT ENGINE =====
+# Trade requests and deposit/withdrawal transactions settle through one state machine
+# (pending -> processing -> approved/rejected). Claiming is a conditional update, so only
+# one admin can act on a request. Every later step is idempotent. Balance, project and
+# portfolio writes record the request id in a transient pending_ops marker, and derived
+# documents use ids derived from the request id. A crashed, retried or bulk settlement can
+# therefore be re-driven to completion without applying anything twice.
+SETTLE_RETRY_ATTEMPTS = 4
+SETTLE_RECOVERY_AFTER_SECONDS = 60
+SETTLE_RECOVERY_INTERVAL_SECONDS = float(os.environ.get('SETTLE_RECOVERY_INTERVAL_SECONDS', '30'))
+_settlement_recovery = {"task": None}
+BULK_MAX_ITEMS = 500
+
+async def with_retry(op, attempts: int = SETTLE_RETRY_ATTEMPTS):
+    for attempt in range(attempts):
+        try:
+            return await op()
+        except (ConnectionFailure, OperationFailure) as e:
+            transient = isinstance(e, ConnectionFailure) or e.has_error_label("TransientTransactionError") \
+                or e.has_error_label("RetryableWriteError")
+            if not transient or attempt == attempts - 1:
+                raise
+            logger.warning(f"Gecici veritabani hatasi, tekrar deneniyor ({attempt + 1}): {e}")
+            await asyncio.sleep(0.05 * 2 ** attempt)
+
+def derived_id(source_id: str, kind: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"settlement:{source_id}:{kind}"))
+
+async def insert_many_once(collection, docs: list) -> list:
+    # Re-inserting a derived id hits the unique index; those duplicates mean "already done".
+    # Returns the docs this call actually inserted.
+    if not docs:
+        return []
+    try:
+        await with_retry(lambda: collection.insert_many([dict(d) for d in docs], ordered=False))
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(err.get('code') != 11000 for err in errors):
+            raise
+        duplicates = {err['index'] for err in errors}
+        return [d for i, d in enumerate(docs) if i not in duplicates]
+    return docs
+
+async def claim_many(collection, id_field: str, ids: list, status: str, admin_id: str) -> list:
+    claim_id = uuid.uuid4().hex
+    # A retried claim must recognise its own earlier success
+    await with_retry(lambda: collection.update_many(
+        {id_field: {"$in": ids}, "$or": [{"status": "pending"}, {"status": "processing", "claim_id": claim_id}]},
+        {"$set": {"status": "processing", "target_status": status, "claim_id": claim_id, "processed_by": admin_id,
+                  "processing_at": datetime.now(timezone.utc).isoformat()}}))
+    return await collection.find({id_field: {"$in": ids}, "claim_id": claim_id}, {"_id": 0}).to_list(len(ids))
+
+async def unclaimed_report(collection, id_field: str, ids: list, not_found: str, already: str) -> dict:
+    found = {d[id_field] async for d in collection.find({id_field: {"$in": ids}}, {"_id": 0, id_field: 1})}
+    return {i: {"status": "skipped", "code": 400 if i in found else 404, "detail": already if i in found else not_found} for i in ids}
+
+async def finish_many(collection, id_field: str, ids: list, status: str, claims: list) -> list:
+    # Only rows still held by one of our claims are finished; a re-driver that took a row over owns it now.
+    # settled_claim lets a retried update, and the caller, see which rows this claim finished.
+    if not ids:
+        return []
+    await with_retry(lambda: collection.update_many(
+        {id_field: {"$in": ids}, "status": "processing", "claim_id": {"$in": claims}},
+        [{"$set": {"status": {"$literal": status}, "processed_at": datetime.now(timezone.utc).isoformat(),
+                   "settled_claim": "$claim_id"}},
+         {"$unset": ["target_status", "claim_id"]}]))
+    return [d[id_field] async for d in collection.find({id_field: {"$in": ids}, "settled_claim": {"$in": claims}},
+                                                       {"_id": 0, id_field: 1})]
+
+async def release_markers(collection, id_field: str, doc_ids: list, op_ids: list, keyed: str = None):
+    if doc_ids and op_ids:
+        pull = {"pending_ops": {"$in": op_ids}, **({keyed: {"op_id": {"$in": op_ids}}} if keyed else {})}
+        await with_retry(lambda: collection.update_many({id_field: {"$in": list(set(doc_ids))}}, {"$pull": pull}))
+
+# --- trade requests ---
+async def reduce_holding(req: dict) -> float:
+    rid, uid, pfid, sell_shares = req['request_id'], req['user_id'], req.get('portfolio_id', ''), req['shares']
+    for _ in range(SETTLE_RETRY_ATTEMPTS):
+        inv = await db.portfolios.find_one({"portfolio_id": pfid, "user_id": uid}, {"_id": 0})
+        if inv and rid in inv.get('pending_ops', []):
+            return req['settle_amount']
         if not inv:
-            await db.trade_requests.update_one({"request_id": request_id}, {"$set": {"status": "rejected"}})
             raise HTTPException(status_code=400, detail="Yatirim bulunamadi")
         total_shares = inv.get('shares', 1)
-        sell_shares = req['shares']
+        if total_shares < sell_shares:
+            raise HTTPException(status_code=400, detail=f"En fazla {total_shares} hisse satilabilir")
         per_share_amount = inv['amount'] / total_shares
         per_share_return = inv.get('monthly_return', 0) / total_shares
+        remaining = total_shares - sell_shares
         sell_amount = round(per_share_amount * sell_shares, 2)
-        if sell_shares >= total_shares:
-            await db.portfolios.delete_one({"portfolio_id": req['portfolio_id']})
+        # Record the price before touching the portfolio so a re-drive credits the same amount
+        await with_retry(lambda: db.trade_requests.update_one({"request_id": rid}, {"$set": {"settle_amount": sell_amount}}))
+        req['settle_amount'] = sell_amount
+        # Optimistic check on shares: a concurrent sale of the same holding forces a re-read
+        reduced = await with_retry(lambda: db.portfolios.update_one(
+            {"portfolio_id": pfid, "shares": total_shares, "pending_ops": {"$ne": rid}},
+            {"$set": {"shares": remaining, "amount": round(per_share_amount * remaining, 2),
+                      "monthly_return": round(per_share_return * remaining, 2)},
+             "$addToSet": {"pending_ops": rid}}))
+        if reduced.modified_count:
+            return sell_amount
+    raise HTTPException(status_code=409, detail="Portfolyo ayni anda degistirildi, tekrar deneyin")
+
+async def settle_trade_requests(reqs: list) -> dict:
+    report, notifications = {}, []
+    rejects = [r for r in reqs if r['target_status'] == 'rejected']
+    buys = [r for r in reqs if r['target_status'] == 'approved' and r['type'] == 'buy']
+    sells = []
+    for req in reqs:
+        if req['target_status'] == 'approved' and req['type'] != 'buy':
+            try:
+                await reduce_holding(req)
+                sells.append(req)
+            except HTTPException as e:
+                report[req['request_id']] = {"status": "rejected", "code": e.status_code, "detail": e.detail}
+    applied = await apply_balance_changes([(r['user_id'], r['request_id'], -r['amount'], "trade_buy") for r in buys] +
+                                          [(r['user_id'], r['request_id'], r['settle_amount'], "trade_sell") for r in sells])
+    for r in buys:
+        if r['request_id'] not in applied:
+            report[r['request_id']] = {"status": "rejected", "code": 400, "detail": "Kullanicinin bakiyesi yetersiz"}
+    buys = [r for r in buys if r['request_id'] in applied]
+
+    usd_rate = get_usd_rate()
+    entries = [{**new_portfolio_entry(r['user_id'], r['project_id'], r['project_name'], r.get('project_type', ''), r['shares'],
+                                      r['amount'], usd_rate, portfolio_id=derived_id(r['request_id'], 'portfolio')),
+                "source_request_id": r['request_id']} for r in buys]
+    await insert_many_once(db.portfolios, entries)
+    # A re-driven buy may have inserted its row earlier with another rate: copy what is stored
+    await asyncio.gather(*[sync_portfolio_summary(uid, [e['portfolio_id'] for e in entries if e['user_id'] == uid])
+                           for uid in {e['user_id'] for e in entries}])
+    await asyncio.gather(*[record_holding_change(r['project_id'], r['user_id'], r['shares'], r['amount'], r['request_id']) for r in buys],
+                         *[record_holding_change(r['project_id'], r['user_id'], -r['shares'], -r['settle_amount'], r['request_id']) for r in sells])
+    # Committed to funded_shares above, so releasing the reservation now never frees sold shares
+    await release_share_holds([(r['project_id'], r['request_id']) for r in buys])
+    if buys or sells:
+        await bump_catalog_version()
+
+    approved_ids = [r['request_id'] for r in buys + sells]
+    rejected_ids = [r['request_id'] for r in rejects] + [rid for rid, item in report.items() if item['status'] == 'rejected']
+    rejected_buys = [r for r in reqs if r['type'] == 'buy' and r['request_id'] in rejected_ids]
+    await release_holds([(r['user_id'], r['request_id']) for r in rejected_buys])
+    await release_share_holds([(r['project_id'], r['request_id']) for r in rejected_buys])
+    claims = list({r['claim_id'] for r in reqs})
+    approved_ids = await finish_many(db.trade_requests, 'request_id', approved_ids, 'approved', claims)
+    await finish_many(db.trade_requests, 'request_id', rejected_ids, 'rejected', claims)
+    # Only ops this claim finished lose their markers; rows another re-driver took over keep them for it
+
+    if sells:
+        await with_retry(lambda: db.portfolios.delete_many({"portfolio_id": {"$in": [r['portfolio_id'] for r in sells]}, "shares": {"$lte": 0}}))
+        await release_markers(db.portfolios, 'portfolio_id', [r['portfolio_id'] for r in sells], approved_ids)
+        await asyncio.gather(*[sync_portfolio_summary(uid, [r['portfolio_id'] for r in sells if r['user_id'] == uid])
+                               for uid in {r['user_id'] for r in sells}])
+    await release_markers(db.projects, 'project_id', [r['project_id'] for r in buys + sells], approved_ids)
+    await release_markers(db.project_investors, 'holder_id', [f"{r['project_id']}:{r['user_id']}" for r in buys + sells], approved_ids, keyed='op_investors')
+    await release_markers(db.users, 'user_id', [r['user_id'] for r in buys + sells], approved_ids)
+    for r in buys + sells:
+        invalidate_user(r['user_id'])
+
+    for r in buys:
+        report[r['request_id']] = {"status": "approved"}
+        notifications.append(("buy_approved", r, {"project_name": r['project_name'], "shares": r['shares']}))
+    for r in sells:
+        report[r['request_id']] = {"status": "approved"}
+        notifications.append(("sell_approved", r, {"shares": r['shares'], "amount": r['settle_amount']}))
+    for r in rejects:
+        report[r['request_id']] = {"status": "rejected"}
+        notifications.append((f"{r['type']}_rejected", r, {"project_name": r.get('project_name', '')}))
+    await flush_notifications([build_notification(template, r['user_id'], derived_id(r['request_id'], 'notification'), **params)
+                               for template, r, params in notifications])
+    return report
+
+# --- deposit / withdrawal transactions ---
+async def settle_transactions(txns: list) -> dict:
+    report, notifications = {}, []
+    approve = [t for t in txns if t['target_status'] == 'approved']
+    applied = await apply_balance_changes(
+        [(t['user_id'], t['transaction_id'], t['amount'], "deposit") for t in approve if t['type'] == 'deposit'] +
+        [(t['user_id'], t['transaction_id'], -t['amount'], "withdrawal") for t in approve if t['type'] == 'withdrawal'])
+    approved_ids, rejected_ids = [], []
+    for t in txns:
+        tid, amount = t['transaction_id'], t['amount']
+        if t['target_status'] == 'rejected':
+            rejected_ids.append(tid)
+            report[tid] = {"status": "rejected"}
+            if t['type'] == 'withdrawal':
+                notifications.append(("withdrawal_rejected", t, {"amount": amount}))
+            elif t['type'] == 'deposit':
+                notifications.append(("deposit_rejected", t, {"amount": amount}))
+        elif t['type'] in ('deposit', 'withdrawal') and tid not in applied:
+            rejected_ids.append(tid)
+            report[tid] = {"status": "rejected", "code": 400, "detail": "Kullanicinin bakiyesi yetersiz"}
         else:
-            remaining = total_shares - sell_shares
-            await db.portfolios.update_one({"portfolio_id": req['portfolio_id']}, {"$set": {
-                "shares": remaining, "amount": round(per_share_amount * remaining, 2), "monthly_return": round(per_share_return * remaining, 2)
-            }})
-        await db.users.update_one({"user_id": req['user_id']}, {"$inc": {"balance": sell_amount}})
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": req['user_id'],
-            "title": "Satim Talebi Onaylandi", "message": f"{sell_shares} hisse ({sell_amount:,.0f} TL) satim talebiniz onaylandi.",
-            "type": "trade_approved", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
-    elif data.status == 'rejected':
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": req['user_id'],
-            "title": f"{'Alim' if req['type']=='buy' else 'Satim'} Talebi Reddedildi",
-            "message": f"{req.get('project_name','')} projesine ait talebiniz reddedildi.",
-            "type": "trade_rejected", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
+            approved_ids.append(tid)
+            report[tid] = {"status": "approved"}
+            if t['type'] == 'deposit':
+                notifications.append(("deposit_approved", t, {"amount": amount}))
+            elif t['type'] == 'withdrawal':
+                notifications.append(("withdrawal_approved", t, {"amount": amount}))
+    await release_holds([(t['user_id'], t['transaction_id']) for t in txns if t['type'] == 'withdrawal' and t['transaction_id'] in rejected_ids])
+    claims = list({t['claim_id'] for t in txns})
+    approved_ids = await finish_many(db.transactions, 'transaction_id', approved_ids, 'approved', claims)
+    await finish_many(db.transactions, 'transaction_id', rejected_ids, 'rejected', claims)
+    await release_markers(db.users, 'user_id', [t['user_id'] for t in approve], approved_ids)
+    await flush_notifications([build_notification(template, t['user_id'], derived_id(t['transaction_id'], 'notification'), **params)
+                               for template, t, params in notifications])
+    return report
+
+SETTLEMENTS = {
+    "trade_requests": ("request_id", settle_trade_requests, "Talep bulunamadi", "Bu talep zaten islendi"),
+    "transactions": ("transaction_id", settle_transactions, "Islem bulunamadi", "Bu islem zaten islendi"),
+}
+
+async def settle(collection_name: str, ids: list, status: str, admin_id: str) -> dict:
+    if status not in ('approved', 'rejected'):
+        raise HTTPException(status_code=400, detail="Gecersiz durum")
+    id_field, settle_fn, not_found, already = SETTLEMENTS[collection_name]
+    ids = list(dict.fromkeys(ids))
+    claimed = await claim_many(db[collection_name], id_field, ids, status, admin_id)
+    report = await settle_fn(claimed) if claimed else {}
+    missing = [i for i in ids if i not in report]
+    if missing:
+        report.update(await unclaimed_report(db[collection_name], id_field, missing, not_found, already))
+    return report
+
+def raise_for_item(item: dict):
+    if item.get('code'):
+        raise HTTPException(status_code=item['code'], detail=item['detail'])
+
+def bulk_summary(ids: list, report: dict) -> dict:
+    results = [{"id": i, **report[i]} for i in dict.fromkeys(ids)]
+    counts = {s: sum(1 for r in results if r['status'] == s) for s in ("approved", "rejected", "skipped")}
+    return {"results": results, **counts}
+
+async def recover_settlements():
+    # Re-drive settlements that a crash or lost connection left in "processing"
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=SETTLE_RECOVERY_AFTER_SECONDS)).isoformat()
+    for collection_name, (id_field, settle_fn, _, _) in SETTLEMENTS.items():
+        # One cursor over every stale row, claimed and re-driven BULK_MAX_ITEMS at a time; a failed batch does not
+        # stop the rest. Only the claim keys are read here, the claimed rows are re-read whole.
+        cursor = db[collection_name].find({"status": "processing", "processing_at": {"$lt": cutoff}},
+                                          {"_id": 0, id_field: 1, "processing_at": 1, "claim_id": 1}) \
+            .sort([("processing_at", 1), (id_field, 1)]).batch_size(BULK_MAX_ITEMS)
+        batch, recovered = [], 0
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) == BULK_MAX_ITEMS:
+                recovered += await redrive_batch(collection_name, settle_fn, batch)
+                batch = []
+        if batch:
+            recovered += await redrive_batch(collection_name, settle_fn, batch)
+        if recovered:
+            logger.info(f"Yarim kalan {recovered} kayit tamamlandi ({collection_name})")
+
+async def reclaim_stale(collection, id_field: str, rows: list) -> list:
+    # Takes over stale rows only if no other re-driver has touched them since they were read
+    claim_id = uuid.uuid4().hex
+    now = datetime.now(timezone.utc).isoformat()
+    await with_retry(lambda: collection.bulk_write([UpdateOne(
+        {id_field: r[id_field], "status": "processing", "processing_at": r['processing_at'], "claim_id": r.get('claim_id')},
+        {"$set": {"claim_id": claim_id, "processing_at": now}}) for r in rows], ordered=False))
+    return await collection.find({id_field: {"$in": [r[id_field] for r in rows]}, "claim_id": claim_id}, {"_id": 0}).to_list(len(rows))
+
+async def redrive_batch(collection_name: str, settle_fn, batch: list) -> int:
+    try:
+        claimed = await reclaim_stale(db[collection_name], SETTLEMENTS[collection_name][0], batch)
+        if len(claimed) < len(batch):
+            logger.info(f"{len(batch) - len(claimed)} kayit baska bir islemci tarafindan aliniyor ({collection_name})")
+        return len(await settle_fn(claimed)) if claimed else 0
+    except Exception as e:
+        logger.error(f"Yarim kalan kayitlar tamamlanamadi ({collection_name}): {e}")
+        return 0
+
+async def settlement_recovery_worker():
+    # Periodic, so rows claimed just before a restart or left behind by a failed request are re-driven too
+    while True:
+        try:
+            await recover_settlements()
+        except Exception as e:
+            logger.error(f"Yarim kalan kayit taramasi basarisiz: {e}")
+        await asyncio.sleep(SETTLE_RECOVERY_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_settlement_recovery():
+    _settlement_recovery["task"] = asyncio.create_task(settlement_recovery_worker())
+
+@app.on_event("shutdown")
+async def stop_settlement_recovery():
+    if _settlement_recovery["task"]:
+        _settlement_recovery["task"].cancel()
+
+@api_router.put("/admin/trade-requests/{request_id}")
+async def update_trade_request(request_id: str, data: TransactionStatusUpdate, admin=Depends(get_admin_user)):
+    report = await settle("trade_requests", [request_id], data.status, admin['user_id'])
+    raise_for_item(report[request_id])
     return {"message": "Talep guncellendi"}
 
+@api_router.post("/admin/trade-requests/bulk")
+async def bulk_update_trade_requests(data: BulkStatusUpdate, admin=Depends(get_admin_user)):
+    if not data.ids or len(data.ids) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"1 ile {BULK_MAX_ITEMS} arasi kayit secin")
+    report = await settle("trade_requests", data.ids, data.status, admin['user_id'])
+    return bulk_summary(data.ids, report)
+
+# ===== MONTHLY PAYOUTS =====
+# A payout run credits the monthly return of every active holding for one period (YYYY-MM).
+# Holdings are streamed in (user_id, portfolio_id) order and paid per investor in chunks: one
+# bulk_write of guarded balance credits, then insert_many of transaction and notification rows
+# whose ids derive from (period, user). The run document checkpoints the last paid investor,
+# so a crashed run resumes where it stopped and a repeated chunk pays nobody twice.
+PAYOUT_CHUNK_USERS = int(os.environ.get('PAYOUT_CHUNK_USERS', '1000'))
+PAYOUT_STALE_SECONDS = 300
+# The rate worker refreshes exactly every USD_RATE_REFRESH_SECONDS; this covers the refresh itself
+PAYOUT_USD_RATE_GRACE_SECONDS = 300
+PAYOUT_PERIOD_RE = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+_payout_stats = {"runs": 0, "portfolios": 0, "users": 0, "amount": 0.0, "last_run_seconds": None, "last_portfolios_per_second": None}
+_payout_tasks = {}
+METRICS["payouts"] = _payout_stats
+
+def portfolio_payout(p: dict, usd_rate: float) -> float:
+    # USD-based holdings keep their dollar value and are paid at the run's rate
+    if p.get('usd_based') and p.get('usd_rate_at_purchase'):
+        return round(p['amount'] / p['usd_rate_at_purchase'] * p.get('return_rate', 0) / 100 * usd_rate, 2)
+    return round(p.get('monthly_return', 0), 2)
+
+async def iter_payout_chunks(after_user_id: str = None):
+    query = {"status": "active", "shares": {"$gt": 0}}
+    if after_user_id:
+        query["user_id"] = {"$gt": after_user_id}
+    cursor = db.portfolios.find(query, {"_id": 0, "portfolio_id": 1, "user_id": 1, "amount": 1, "monthly_return": 1,
+                                        "usd_based": 1, "usd_rate_at_purchase": 1, "return_rate": 1}) \
+        .sort([("user_id", ASCENDING), ("portfolio_id", ASCENDING)]).batch_size(5000)
+    chunk, current = {}, None
+    async for p in cursor:
+        # Chunks end on an investor boundary so one investor is always paid in one chunk
+        if p['user_id'] != current and len(chunk) >= PAYOUT_CHUNK_USERS:
+            yield chunk
+            chunk = {}
+        current = p['user_id']
+        chunk.setdefault(current, []).append(p)
+    if chunk:
+        yield chunk
+
+async def pay_chunk(run: dict, chunk: dict) -> dict:
+    period = run['period']
+    payouts = {}
+    for uid, holdings in chunk.items():
+        amount = round(sum(portfolio_payout(p, run['usd_rate']) for p in holdings), 2)
+        if amount > 0:
+            payouts[uid] = (amount, len(holdings))
+    if run.get('dry_run') or not payouts:
+        return payouts
+    op_ids = {uid: derived_id(f"{period}:{uid}", 'payout') for uid in payouts}
+    applied = await apply_balance_changes([(uid, op_ids[uid], amount, "return_payout") for uid, (amount, _) in payouts.items()],
+                                          extra_filter={"$or": [{"last_payout_period": {"$exists": False}}, {"last_payout_period": {"$lt": period}}]},
+                                          extra_set={"last_payout_period": {"$literal": period}})
+    await release_markers(db.users, 'user_id', list(payouts), list(op_ids.values()))
+    # On a resumed run, users credited before the crash already carry this period
+    paid = {uid for uid in payouts if op_ids[uid] in applied}
+    paid |= {u['user_id'] async for u in db.users.find(
+        {"user_id": {"$in": [uid for uid in payouts if uid not in paid]}, "last_payout_period": period}, {"_id": 0, "user_id": 1})}
+    payouts = {uid: v for uid, v in payouts.items() if uid in paid}
+    if not payouts:
+        return payouts
+    now = datetime.now(timezone.utc).isoformat()
+    await insert_many_once(db.transactions, [{
+        "transaction_id": op_ids[uid], "user_id": uid, "type": "return_payout",
+        "amount": amount, "status": "approved", "period": period, "portfolio_count": count,
+        "usd_rate": run['usd_rate'], "created_at": now, "approved_by": run['started_by']
+    } for uid, (amount, count) in payouts.items()])
+    await flush_notifications([build_notification("return_payout", uid, derived_id(f"{period}:{uid}", 'payout_notification'),
+                                                  period=period, amount=amount) for uid, (amount, _) in payouts.items()])
+    return payouts
+
+async def execute_payout_run(run: dict) -> dict:
+    start = time.perf_counter()
+    totals = dict(run.get('totals') or {"users": 0, "portfolios": 0, "amount": 0.0})
+    async for chunk in iter_payout_chunks(run.get('last_user_id')):
+        payouts = await pay_chunk(run, chunk)
+        totals["users"] += len(payouts)
+        totals["portfolios"] += sum(len(h) for h in chunk.values())
+        totals["amount"] = round(totals["amount"] + sum(a for a, _ in payouts.values()), 2)
+        if not run.get('dry_run'):
+            await with_retry(lambda: db.payout_runs.update_one({"period": run['period'], "claim_id": run['claim_id']}, {"$set": {
+                "last_user_id": max(chunk), "totals": totals, "heartbeat_at": datetime.now(timezone.utc)}}))
+    elapsed = time.perf_counter() - start
+    result = {**totals, "seconds": round(elapsed, 3),
+              "portfolios_per_second": round(totals["portfolios"] / elapsed, 1) if elapsed else None}
+    if not run.get('dry_run'):
+        _payout_stats["runs"] += 1
+        _payout_stats["users"] += totals["users"]
+        _payout_stats["portfolios"] += totals["portfolios"]
+        _payout_stats["amount"] = round(_payout_stats["amount"] + totals["amount"], 2)
+        _payout_stats["last_run_seconds"] = result["seconds"]
+        _payout_stats["last_portfolios_per_second"] = result["portfolios_per_second"]
+        await db.payout_runs.update_one({"period": run['period'], "claim_id": run['claim_id']}, {"$set": {
+            "status": "completed", "totals": totals, "finished_at": datetime.now(timezone.utc),
+            "seconds": result["seconds"], "portfolios_per_second": result["portfolios_per_second"]}})
+        logger.info(f"Getiri odemesi tamamlandi ({run['period']}): {totals['users']} yatirimci, {totals['amount']:,.2f} TL")
+    return result
+
+def payout_usd_rate() -> float:
+    # Payouts are paid at the run's rate, so a new run never starts on a stale or missing one
+    if usd_rate_is_stale(grace=PAYOUT_USD_RATE_GRACE_SECONDS):
+        get_usd_rate()
+        raise HTTPException(status_code=503, detail="Guncel USD kuru alinamadi, lutfen tekrar deneyin")
+    return get_usd_rate()
+
+async def claim_payout_run(period: str, admin_id: str) -> dict:
+    latest = await db.payout_runs.find_one({"status": "completed"}, sort=[("period", DESCENDING)])
+    if latest and latest['period'] > period:
+        raise HTTPException(status_code=400, detail="Daha yeni bir donem odenmis")
+    now = datetime.now(timezone.utc)
+    claim_id = uuid.uuid4().hex
+    # A failed run, or one whose worker stopped sending heartbeats, is resumed from its checkpoint
+    run = await db.payout_runs.find_one_and_update(
+        {"period": period, "$or": [{"status": "failed"},
+                                   {"status": "running", "heartbeat_at": {"$lt": now - timedelta(seconds=PAYOUT_STALE_SECONDS)}}]},
+        {"$set": {"status": "running", "claim_id": claim_id, "heartbeat_at": now}, "$unset": {"error": ""}},
+        projection={"_id": 0}, return_document=ReturnDocument.AFTER)
+    if run:
+        return run
+    run = {"period": period, "status": "running", "usd_rate": payout_usd_rate(), "started_by": admin_id, "started_at": now,
+           "claim_id": claim_id, "heartbeat_at": now, "last_user_id": None, "totals": {"users": 0, "portfolios": 0, "amount": 0.0}}
+    try:
+        await db.payout_runs.insert_one(run)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Bu donem icin odeme zaten calisiyor veya tamamlandi")
+    run.pop('_id', None)
+    return run
+
+async def run_payout_in_background(run: dict):
+    try:
+        await execute_payout_run(run)
+    except Exception as e:
+        logger.error(f"Getiri odemesi yarida kaldi ({run['period']}): {e}")
+        await db.payout_runs.update_one({"period": run['period'], "claim_id": run['claim_id']},
+                                        {"$set": {"status": "failed", "error": str(e)}})
+    finally:
+        _payout_tasks.pop(run['period'], None)
+
+def start_payout_task(run: dict):
+    _payout_tasks[run['period']] = asyncio.create_task(run_payout_in_background(run))
+
+@app.on_event("startup")
+async def resume_payout_runs():
+    stale = datetime.now(timezone.utc) - timedelta(seconds=PAYOUT_STALE_SECONDS)
+    for run in await db.payout_runs.find({"status": "running", "heartbeat_at": {"$lt": stale}}, {"_id": 0}).to_list(None):
+        try:
+            start_payout_task(await claim_payout_run(run['period'], run['started_by']))
+            logger.info(f"Yarim kalan getiri odemesi devam ediyor: {run['period']}")
+        except HTTPException:
+            pass
+
+@api_router.post("/admin/payouts/run")
+async def start_payout_run(data: PayoutRunRequest, admin=Depends(get_admin_user)):
+    if not PAYOUT_PERIOD_RE.match(data.period):
+        raise HTTPException(status_code=400, detail="Gecersiz donem (YYYY-AA)")
+    if data.dry_run:
+        usd_rate = payout_usd_rate()
+        result = await execute_payout_run({"period": data.period, "usd_rate": usd_rate, "dry_run": True})
+        return {"period": data.period, "dry_run": True, "usd_rate": usd_rate, **result}
+    run = await claim_payout_run(data.period, admin['user_id'])
+    start_payout_task(run)
+    return {"message": "Getiri odemesi baslatildi", "run": {k: v for k, v in run.items() if k != 'claim_id'}}
+
+@api_router.get("/admin/payouts/runs")
+async def get_payout_runs(admin=Depends(get_admin_user)):
+    return await db.payout_runs.find({}, {"_id": 0, "claim_id": 0}).sort("period", DESCENDING).to_list(120)
+
+@api_router.get("/admin/payouts/runs/{period}")
+async def get_payout_run(period: str, admin=Depends(get_admin_user)):
+    run = await db.payout_runs.find_one({"period": period}, {"_id": 0, "claim_id": 0})
+    if not run:
+        raise HTTPException(status_code=404, detail="Odeme calismasi bulunamadi")
+    return run
+
+# ===== INDEXES =====
+# One entry per query shape used above; names are explicit so reruns are no-ops
+INDEXES = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # Admin and Google accounts have no TC Kimlik, so only non-empty values must be unique
+        IndexModel([("tc_kimlik", ASCENDING)], name="tc_kimlik_unique", unique=True,
+                   partialFilterExpression={"tc_kimlik": {"$gt": ""}}),
+        IndexModel([("role", ASCENDING), ("created_at", DESCENDING)], name="role_created_at"),
+        IndexModel([("created_at", DESCENDING), ("user_id", DESCENDING)], name="created_at_user_id"),
+    ],
+    "portfolios": [
+        IndexModel([("portfolio_id", ASCENDING)], name="portfolio_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("purchase_date", DESCENDING)], name="user_id_purchase_date"),
+        IndexModel([("project_id", ASCENDING), ("purchase_date", DESCENDING)], name="project_id_purchase_date"),
+        IndexModel([("purchase_date", DESCENDING), ("portfolio_id", ASCENDING)], name="purchase_date_portfolio_id"),
+        IndexModel([("user_id", ASCENDING), ("portfolio_id", ASCENDING)], name="user_id_portfolio_id"),
+    ],
+    "ledger_entries": [
+        IndexModel([("entry_id", ASCENDING)], name="entry_id_unique", unique=True),
+        IndexModel([("account", ASCENDING), ("seq", DESCENDING), ("entry_id", DESCENDING)], name="account_seq_entry_id"),
+        IndexModel([("user_id", ASCENDING)], name="user_id", partialFilterExpression={"user_id": {"$exists": True}}),
+        IndexModel([("journal_id", ASCENDING)], name="journal_id"),
+    ],
+    "idempotency_keys": [
+        IndexModel([("key_id", ASCENDING)], name="key_id_unique", unique=True),
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=IDEMPOTENCY_TTL_HOURS * 3600),
+    ],
+    "payout_runs": [
+        IndexModel([("period", ASCENDING)], name="period_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("period", DESCENDING)], name="status_period"),
+    ],
+    "portfolio_summaries": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "notifications": [
+        IndexModel([("notification_id", ASCENDING)], name="notification_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("notification_id", DESCENDING)], name="user_id_created_at_notification_id"),
+        IndexModel([("user_id", ASCENDING), ("is_read", ASCENDING), ("created_at", DESCENDING)], name="user_id_is_read_created_at"),
+        IndexModel([("read_at", ASCENDING)], name="read_at_ttl", expireAfterSeconds=NOTIFICATION_RETENTION_DAYS * 86400,
+                   partialFilterExpression={"is_read": True}),
+    ],
+    "notifications_archive": [
+        IndexModel([("notification_id", ASCENDING)], name="notification_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("notification_id", DESCENDING)], name="user_id_created_at_notification_id"),
+        IndexModel([("archived_at", ASCENDING)], name="archived_at_ttl", expireAfterSeconds=NOTIFICATION_RETENTION_DAYS * 86400),
+    ],
+    "project_investors": [
+        IndexModel([("holder_id", ASCENDING)], name="holder_id_unique", unique=True),
+        IndexModel([("project_id", ASCENDING), ("shares", ASCENDING)], name="project_id_shares"),
+    ],
+    "trade_requests": [
+        IndexModel([("request_id", ASCENDING)], name="request_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("request_id", DESCENDING)], name="user_id_created_at_request_id"),
+        IndexModel([("created_at", DESCENDING), ("request_id", DESCENDING)], name="created_at_request_id"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+        IndexModel([("status", ASCENDING), ("processing_at", ASCENDING)], name="status_processing_at"),
+    ],
+    "transactions": [
+        IndexModel([("transaction_id", ASCENDING)], name="transaction_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("transaction_id", DESCENDING)], name="user_id_created_at_transaction_id"),
+        IndexModel([("created_at", DESCENDING), ("transaction_id", DESCENDING)], name="created_at_transaction_id"),
+        IndexModel([("status", ASCENDING), ("type", ASCENDING), ("created_at", ASCENDING)], name="status_type_created_at"),
+        IndexModel([("status", ASCENDING), ("processing_at", ASCENDING)], name="status_processing_at"),
+    ],
+    "kyc_documents": [
+        IndexModel([("kyc_id", ASCENDING)], name="kyc_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("submitted_at", DESCENDING), ("kyc_id", DESCENDING)], name="submitted_at_kyc_id"),
+        IndexModel([("status", ASCENDING)], name="status"),
+    ],
+    "projects": [
+        IndexModel([("project_id", ASCENDING)], name="project_id_unique", unique=True),
+        IndexModel([("type", ASCENDING), ("created_at", ASCENDING), ("project_id", ASCENDING)], name="type_created_at_project_id"),
+        IndexModel([("created_at", ASCENDING), ("project_id", ASCENDING)], name="created_at_project_id"),
+    ],
+    "banks": [
+        IndexModel([("bank_id", ASCENDING)], name="bank_id_unique", unique=True),
+        IndexModel([("is_active", ASCENDING)], name="is_active"),
+    ],
+    "email_outbox": [
+        IndexModel([("email_id", ASCENDING)], name="email_id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt_at"),
+        IndexModel([("status", ASCENDING), ("claimed_at", ASCENDING)], name="status_claimed_at"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("email_id", DESCENDING)], name="status_created_at_email_id"),
+    ],
+    "usd_rates": [
+        IndexModel([("fetched_at", ASCENDING)], name="fetched_at"),
+    ],
+}
+
+async def sync_ttl_indexes(collection: str, models: list):
+    # A changed retention setting is applied with collMod instead of failing as an index conflict
+    existing = await db[collection].index_information()
+    for model in models:
+        spec = model.document
+        current = existing.get(spec['name'])
+        if 'expireAfterSeconds' in spec and current and current.get('expireAfterSeconds') != spec['expireAfterSeconds']:
+            await db.command({"collMod": collection, "index": {"name": spec['name'], "expireAfterSeconds": spec['expireAfterSeconds']}})
+            logger.info(f"TTL guncellendi: {collection}.{spec['name']} -> {spec['expireAfterSeconds']} sn")
+
+async def ensure_indexes():
+    # createIndexes is idempotent for identical specs; any conflict or duplicate key aborts startup
+    total_start = time.perf_counter()
+    for collection, models in INDEXES.items():
+        start = time.perf_counter()
+        try:
+            await sync_ttl_indexes(collection, models)
+            await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            logger.error(f"Index olusturulamadi ({collection}): {e}")
+            raise RuntimeError(f"Index conflict on {collection}: {e}") from e
+        logger.info(f"Indexler hazir: {collection} ({len(models)} index, {(time.perf_counter() - start) * 1000:.1f} ms)")
+    logger.info(f"Tum indexler hazir ({(time.perf_counter() - total_start) * 1000:.1f} ms)")
+
+# Backfills, recovery and payout resumption rely on the unique indexes for idempotency,
+# so the indexes are built before any other startup hook runs
+app.router.on_startup.insert(0, ensure_indexes)
+
 # ===== SEED DATA =====
 @app.on_event("startup")
 async def seed_data():
@@ -911,7 +2992,7 @@ async def seed_data():
     if not admin:
         await db.users.insert_one({
             "user_id": f"admin_{uuid.uuid4().hex[:12]}", "email": "admin@alarkoenerji.com",
-            "password_hash": hash_password("admin123"), "name": "Admin",
+            "password_hash": await hash_password("admin123"), "name": "Admin",
             "phone": "+90 555 000 0000", "tc_kimlik": "", "role": "admin", "kyc_status": "approved",
             "balance": 0.0, "picture": "", "created_at": datetime.now(timezone.utc).isoformat()
         })
@@ -982,6 +3063,11 @@ async def seed_data():
              
              
         ])
+        # Seeding runs after the startup backfills, so the seeded projects get their stats and inventory here
+        seeded = await db.projects.distinct("project_id")
+        await rebuild_project_stats(seeded)
+        await rebuild_share_inventory(seeded)
+        await bump_catalog_version()
         logger.info("Ornek projeler olusturuldu")
 
     if await db.banks.count_documents({}) == 0:
@@ -1001,14 +3087,18 @@ async def seed_data():
 app.mount("/api/uploads", StaticFiles(directory=str(ROOT_DIR / 'uploads')), name="uploads")
 app.include_router(api_router)
 
+app.add_middleware(NotificationBufferMiddleware)
+app.add_middleware(UploadSizeLimitMiddleware, limits={"/api/kyc/upload": 2 * KYC_MAX_UPLOAD_BYTES + KYC_MULTIPART_OVERHEAD_BYTES})
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Idempotent-Replayed"],
 )
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+    _bcrypt_pool.shutdown(wait=False)
@@ -0,0 +1,51 @@
+"""
+Alarko Enerji - Shared Test Fixtures
+- admin_headers: bearer headers of the seeded admin
+- make_investor: creates an investor through /api/admin/users/create (optionally KYC-approved
+  and funded) and logs them in with /api/auth/login-investor
+"""
+import pytest
+import requests
+import os
+import random
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+ADMIN_EMAIL = "admin@alarkoenerji.com"
+ADMIN_PASSWORD = "admin123"
+INVESTOR_PASSWORD = "testpass123"
+
+
+@pytest.fixture
+def admin_headers():
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": ADMIN_EMAIL,
+        "password": ADMIN_PASSWORD
+    })
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+
+def create_investor(admin_headers, name="Test Investor", balance=0, kyc=False) -> dict:
+    tc_kimlik = "".join(random.choice("0123456789") for _ in range(11))
+    response = requests.post(f"{BASE_URL}/api/admin/users/create", json={
+        "name": name, "email": f"investor_{uuid.uuid4().hex[:8]}@test.com",
+        "tc_kimlik": tc_kimlik, "password": INVESTOR_PASSWORD
+    }, headers=admin_headers)
+    assert response.status_code == 200, response.text
+    user_id = response.json()["user_id"]
+    if kyc:
+        requests.post(f"{BASE_URL}/api/admin/kyc/approve-user/{user_id}", headers=admin_headers)
+    if balance:
+        requests.put(f"{BASE_URL}/api/admin/users/{user_id}/balance", json={"amount": balance, "type": "add"}, headers=admin_headers)
+    login = requests.post(f"{BASE_URL}/api/auth/login-investor", json={"tc_kimlik": tc_kimlik, "password": INVESTOR_PASSWORD})
+    assert login.status_code == 200
+    token = login.json()["token"]
+    return {"user_id": user_id, "token": token, "headers": {"Authorization": f"Bearer {token}"}}
+
+
+@pytest.fixture
+def make_investor(admin_headers):
+    """Factory: make_investor(name=..., balance=..., kyc=...) -> {"user_id", "token", "headers"}"""
+    return lambda **kwargs: create_investor(admin_headers, **kwargs)
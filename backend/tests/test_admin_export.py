@@ -0,0 +1,81 @@
+"""
+Alarko Enerji - Admin Export Tests
+Tests GET /api/admin/export/{kind}:
+- only admins can export
+- unknown kinds and formats are refused
+- status/type/date filters narrow the streamed rows
+- dates with a non-UTC offset are compared in UTC
+- CSV has the declared header and NDJSON has one document per line
+"""
+import pytest
+import requests
+import os
+import csv
+import io
+import json
+from datetime import datetime, timezone, timedelta
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+TRANSACTION_COLUMNS = ["transaction_id", "user_id", "user_name", "type", "amount", "status", "created_at", "approved_by"]
+
+
+@pytest.fixture
+def investor(make_investor):
+    return make_investor(name="Export Test")
+
+
+@pytest.fixture
+def transactions(admin_headers, investor):
+    since = (datetime.now(timezone.utc) - timedelta(seconds=5)).isoformat()
+    ids = [requests.post(f"{BASE_URL}/api/transactions", json={"amount": amount, "type": "deposit"},
+                         headers=investor["headers"]).json()["transaction_id"] for amount in (111, 222)]
+    requests.put(f"{BASE_URL}/api/admin/transactions/{ids[1]}", json={"status": "approved"}, headers=admin_headers)
+    return {"pending": ids[0], "approved": ids[1], "since": since}
+
+
+def export(headers, kind="transactions", **params):
+    return requests.get(f"{BASE_URL}/api/admin/export/{kind}", params=params, headers=headers, stream=True)
+
+
+class TestAdminExport:
+
+    def test_requires_admin(self, investor):
+        assert export({}).status_code == 401
+        assert export(investor["headers"]).status_code == 403
+
+    def test_rejects_unknown_kind_and_format(self, admin_headers):
+        assert export(admin_headers, kind="users").status_code == 404
+        assert export(admin_headers, format="xlsx").status_code == 400
+
+    def test_csv_stream_with_filters(self, admin_headers, transactions):
+        response = export(admin_headers, status="pending", type="deposit", date_from=transactions["since"])
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert "attachment" in response.headers["content-disposition"]
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert list(rows[0].keys()) == TRANSACTION_COLUMNS
+        ids = {r["transaction_id"] for r in rows}
+        assert transactions["pending"] in ids
+        assert transactions["approved"] not in ids
+        assert all(r["status"] == "pending" and r["type"] == "deposit" for r in rows)
+        assert all(r["created_at"] >= transactions["since"] for r in rows)
+
+    def test_date_to_excludes_newer_rows(self, admin_headers, transactions):
+        response = export(admin_headers, date_to=transactions["since"])
+        ids = {r["transaction_id"] for r in csv.DictReader(io.StringIO(response.text))}
+        assert transactions["pending"] not in ids and transactions["approved"] not in ids
+
+    def test_offset_dates_compare_in_utc(self, admin_headers, transactions):
+        istanbul = datetime.fromisoformat(transactions["since"]).astimezone(timezone(timedelta(hours=3))).isoformat()
+        response = export(admin_headers, status="pending", date_from=istanbul)
+        ids = {r["transaction_id"] for r in csv.DictReader(io.StringIO(response.text))}
+        assert transactions["pending"] in ids
+
+    def test_ndjson_stream(self, admin_headers, transactions):
+        response = export(admin_headers, format="ndjson", status="approved", date_from=transactions["since"])
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        docs = [json.loads(line) for line in response.iter_lines() if line]
+        assert transactions["approved"] in {d["transaction_id"] for d in docs}
+        assert all(d["status"] == "approved" for d in docs)
@@ -0,0 +1,35 @@
+"""
+Alarko Enerji - Bcrypt Pool Tests
+Drives the bcrypt thread pool directly (the module is imported with MONGO_URL/DB_NAME):
+- requests cancelled while waiting for a worker give their queue slot back
+Skipped when MONGO_URL is not set.
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+MONGO_URL = os.environ.get('MONGO_URL')
+
+pytestmark = pytest.mark.skipif(not MONGO_URL, reason="MONGO_URL not set")
+
+
+@pytest.fixture(scope="module")
+def server():
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    import server
+    return server
+
+
+def test_cancelled_waiters_release_queue(server):
+    async def run():
+        tasks = [asyncio.create_task(server.hash_password("testpass123")) for _ in range(server.BCRYPT_WORKERS * 4)]
+        await asyncio.sleep(0.01)
+        for t in tasks[server.BCRYPT_WORKERS:]:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return server._bcrypt_stats["queued"]
+
+    assert asyncio.run(run()) == 0
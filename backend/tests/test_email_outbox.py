@@ -0,0 +1,73 @@
+"""
+Alarko Enerji - Email Outbox Tests
+Drives the outbox directly against MONGO_URL/DB_NAME with in-memory senders:
+- send_email only enqueues
+- delivered emails are marked sent and their bodies dropped
+- failing deliveries back off and end in the dead-letter state
+Skipped when MONGO_URL is not set.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+MONGO_URL = os.environ.get('MONGO_URL')
+
+pytestmark = pytest.mark.skipif(not MONGO_URL, reason="MONGO_URL not set")
+
+
+@pytest.fixture(scope="module")
+def server():
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    import server
+    return server
+
+
+async def _drain(server):
+    while True:
+        batch = await server._claim_email_batch()
+        if not batch:
+            return
+        await asyncio.gather(*(server._deliver_email(m) for m in batch))
+
+
+def test_enqueue_then_deliver(server):
+    to = f"outbox_{uuid.uuid4().hex[:8]}@test.com"
+
+    async def run():
+        server.memory_email_sink.clear()
+        server.set_email_sender(server.memory_email_sender)
+        await server.send_email(to, "Konu", "<p>Icerik</p>")
+        queued = await server.db.email_outbox.find_one({"to": to}, {"_id": 0})
+        assert queued["status"] == "pending"
+        assert server.memory_email_sink == []
+        await _drain(server)
+        return await server.db.email_outbox.find_one({"to": to}, {"_id": 0})
+
+    sent = asyncio.run(run())
+    assert sent["status"] == "sent"
+    assert "html" not in sent
+    assert any(m["to"] == to for m in server.memory_email_sink)
+
+
+def test_failures_back_off_then_dead_letter(server):
+    to = f"outbox_{uuid.uuid4().hex[:8]}@test.com"
+
+    async def failing(msg):
+        raise RuntimeError("provider down")
+
+    async def run():
+        server.set_email_sender(failing)
+        server.EMAIL_BACKOFF_SECONDS = 0
+        await server.send_email(to, "Konu", "<p>Icerik</p>")
+        for _ in range(server.EMAIL_MAX_ATTEMPTS):
+            await _drain(server)
+        return await server.db.email_outbox.find_one({"to": to}, {"_id": 0})
+
+    dead = asyncio.run(run())
+    assert dead["status"] == "dead"
+    assert dead["attempts"] == server.EMAIL_MAX_ATTEMPTS
+    assert "provider down" in dead["last_error"]
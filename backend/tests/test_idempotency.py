@@ -0,0 +1,63 @@
+"""
+Alarko Enerji - Idempotency Key Tests
+Tests the Idempotency-Key header on create endpoints:
+- a retry with the same key replays the original response instead of creating a duplicate
+- reusing a key for a different payload is refused
+- concurrent duplicates create exactly one document
+- a rejected request frees its key
+"""
+import pytest
+import requests
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+@pytest.fixture
+def investor_headers(make_investor):
+    return make_investor(name="Idempotency Test", balance=10000)["headers"]
+
+
+def transaction_ids(headers):
+    return [t["transaction_id"] for t in requests.get(f"{BASE_URL}/api/transactions", headers=headers).json()]
+
+
+class TestIdempotencyKeys:
+
+    def test_retry_replays_original_response(self, investor_headers):
+        headers = {**investor_headers, "Idempotency-Key": uuid.uuid4().hex}
+        first = requests.post(f"{BASE_URL}/api/transactions", json={"amount": 500, "type": "deposit"}, headers=headers)
+        second = requests.post(f"{BASE_URL}/api/transactions", json={"amount": 500, "type": "deposit"}, headers=headers)
+        assert first.status_code == second.status_code == 200
+        assert second.headers.get("Idempotent-Replayed") == "true"
+        assert second.json() == first.json()
+        assert transaction_ids(investor_headers).count(first.json()["transaction_id"]) == 1
+
+    def test_requests_without_key_are_independent(self, investor_headers):
+        first = requests.post(f"{BASE_URL}/api/transactions", json={"amount": 500, "type": "deposit"}, headers=investor_headers)
+        second = requests.post(f"{BASE_URL}/api/transactions", json={"amount": 500, "type": "deposit"}, headers=investor_headers)
+        assert first.json()["transaction_id"] != second.json()["transaction_id"]
+
+    def test_key_reused_for_different_payload(self, investor_headers):
+        headers = {**investor_headers, "Idempotency-Key": uuid.uuid4().hex}
+        assert requests.post(f"{BASE_URL}/api/transactions/withdraw", json={"amount": 100}, headers=headers).status_code == 200
+        response = requests.post(f"{BASE_URL}/api/transactions/withdraw", json={"amount": 200}, headers=headers)
+        assert response.status_code == 422
+
+    def test_concurrent_duplicates_create_one_document(self, investor_headers):
+        headers = {**investor_headers, "Idempotency-Key": uuid.uuid4().hex}
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda _: requests.post(
+                f"{BASE_URL}/api/transactions/withdraw", json={"amount": 250}, headers=headers), range(8)))
+        assert {r.status_code for r in responses} <= {200, 409}
+        created = {r.json()["transaction_id"] for r in responses if r.status_code == 200}
+        assert len(created) == 1
+        assert transaction_ids(investor_headers).count(created.pop()) == 1
+
+    def test_rejected_request_frees_key(self, investor_headers):
+        headers = {**investor_headers, "Idempotency-Key": uuid.uuid4().hex}
+        assert requests.post(f"{BASE_URL}/api/transactions/withdraw", json={"amount": 10 ** 9}, headers=headers).status_code == 400
+        response = requests.post(f"{BASE_URL}/api/transactions/withdraw", json={"amount": 100}, headers=headers)
+        assert response.status_code == 200
+        assert "Idempotent-Replayed" not in response.headers
@@ -0,0 +1,107 @@
+"""
+Alarko Enerji - Index Bootstrap Tests
+Runs the startup index bootstrap against MONGO_URL/DB_NAME and checks with
+explain() that every hot query in server.py is served by an index.
+Skipped when MONGO_URL is not set.
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from pymongo import MongoClient
+
+MONGO_URL = os.environ.get('MONGO_URL')
+DB_NAME = os.environ.get('DB_NAME', 'alarko_enerji')
+
+pytestmark = pytest.mark.skipif(not MONGO_URL, reason="MONGO_URL not set")
+
+# (collection, filter, sort)
+HOT_QUERIES = [
+    ("users", {"email": "admin@alarkoenerji.com"}, None),
+    ("users", {"tc_kimlik": "12345678901"}, None),
+    ("users", {"user_id": "user_x"}, None),
+    ("users", {"role": "investor"}, None),
+    ("users", {}, [("created_at", -1)]),
+    ("portfolios", {"user_id": "user_x"}, None),
+    ("portfolios", {"portfolio_id": "p"}, None),
+    ("portfolios", {"user_id": "user_x", "purchase_date": {"$gt": "2024-01-01"}}, None),
+    ("notifications", {"user_id": "user_x"}, [("created_at", -1)]),
+    ("notifications", {"user_id": "user_x", "is_read": False}, None),
+    ("notifications", {"is_read": True, "read_at": {"$lt": datetime(2024, 1, 1, tzinfo=timezone.utc)}}, None),
+    ("notifications_archive", {"user_id": "user_x"}, [("created_at", -1)]),
+    ("trade_requests", {"user_id": "user_x"}, [("created_at", -1)]),
+    ("trade_requests", {}, [("created_at", -1)]),
+    ("trade_requests", {"request_id": "r"}, None),
+    ("transactions", {"user_id": "user_x"}, [("created_at", -1)]),
+    ("transactions", {}, [("created_at", -1)]),
+    ("transactions", {"transaction_id": "t"}, None),
+    ("transactions", {"status": "pending"}, None),
+    ("kyc_documents", {"user_id": "user_x"}, None),
+    ("kyc_documents", {"kyc_id": "k"}, None),
+    ("kyc_documents", {}, [("submitted_at", -1)]),
+    ("projects", {"project_id": "p"}, None),
+]
+
+
+def _stages(plan):
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _stages(child)
+    return stages
+
+
+async def _bootstrap_twice(server):
+    snapshots = []
+    for _ in range(2):
+        await server.ensure_indexes()
+        snapshots.append({name: sorted(await server.db[name].index_information()) for name in server.INDEXES})
+    return snapshots
+
+
+@pytest.fixture(scope="module")
+def bootstrap():
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    import server
+    snapshots = asyncio.run(_bootstrap_twice(server))
+    server.client.close()
+    return snapshots
+
+
+@pytest.fixture(scope="module")
+def db(bootstrap):
+    client = MongoClient(MONGO_URL)
+    yield client[DB_NAME]
+    client.close()
+
+
+def test_ensure_indexes_is_idempotent(bootstrap):
+    first, second = bootstrap
+    assert first == second
+
+
+def test_indexes_built_before_other_startup_hooks(bootstrap):
+    import server
+    assert server.app.router.on_startup[0] is server.ensure_indexes
+
+
+@pytest.mark.parametrize("collection,query,sort", HOT_QUERIES)
+def test_hot_query_uses_index(db, collection, query, sort):
+    cursor = db[collection].find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    plan = cursor.explain()["queryPlanner"]["winningPlan"]
+    stages = _stages(plan)
+    assert "COLLSCAN" not in stages, f"{collection} {query} {sort} scans the collection: {stages}"
+    assert "IXSCAN" in stages or "IDHACK" in stages or "EXPRESS_IXSCAN" in stages
+
+
+@pytest.mark.parametrize("collection,name", [("notifications", "read_at_ttl"), ("notifications_archive", "archived_at_ttl")])
+def test_retention_ttl_indexes(db, collection, name):
+    info = db[collection].index_information()[name]
+    assert info["expireAfterSeconds"] > 0
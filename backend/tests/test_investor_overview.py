@@ -0,0 +1,118 @@
+"""
+Alarko Enerji - Admin Investor Overview Tests
+Tests the aggregation-backed /api/admin/investor-overview endpoint:
+- per-investor totals match the investor's portfolio rows
+- server-side sorting by total_invested + balance
+- skip/limit pagination
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+
+class TestInvestorOverview:
+    """Tests for GET /api/admin/investor-overview"""
+
+    def test_overview_structure(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/investor-overview", headers=admin_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data, list)
+        for inv in data:
+            for field in ("user_id", "name", "email", "tc_kimlik", "phone", "balance", "kyc_status",
+                          "total_shares", "total_invested", "total_monthly_return", "portfolio_count", "portfolios"):
+                assert field in inv, f"Missing field {field}"
+            assert "password_hash" not in inv
+            assert inv["portfolio_count"] == len(inv["portfolios"])
+            assert inv["total_shares"] == sum(p.get("shares", 0) for p in inv["portfolios"])
+            assert inv["total_invested"] == pytest.approx(sum(p.get("amount", 0) for p in inv["portfolios"]))
+            for p in inv["portfolios"]:
+                assert "_id" not in p
+
+    def test_overview_sorted_by_total_value(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/investor-overview", headers=admin_headers)
+        data = response.json()
+        totals = [inv["total_invested"] + inv["balance"] for inv in data]
+        assert totals == sorted(totals, reverse=True)
+
+    def test_overview_pagination(self, admin_headers):
+        full = requests.get(f"{BASE_URL}/api/admin/investor-overview", headers=admin_headers).json()
+        if len(full) < 2:
+            pytest.skip("Need at least 2 investors to test pagination")
+        page = requests.get(f"{BASE_URL}/api/admin/investor-overview?skip=1&limit=1", headers=admin_headers).json()
+        assert len(page) == 1
+        assert page[0]["user_id"] == full[1]["user_id"]
+
+    def test_overview_requires_admin(self):
+        response = requests.get(f"{BASE_URL}/api/admin/investor-overview")
+        assert response.status_code == 401
+
+
+class TestAdminPortfolios:
+    """Tests for GET /api/admin/portfolios with batched user enrichment"""
+
+    def test_portfolios_enriched_with_user_fields(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/portfolios", headers=admin_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data, list)
+        for p in data:
+            assert "user_name" in p
+            assert "user_email" in p
+
+    def test_portfolios_project_filter(self, admin_headers):
+        data = requests.get(f"{BASE_URL}/api/admin/portfolios", headers=admin_headers).json()
+        if not data:
+            pytest.skip("No portfolios to filter")
+        project_id = data[0]["project_id"]
+        response = requests.get(f"{BASE_URL}/api/admin/portfolios?project_id={project_id}", headers=admin_headers)
+        assert response.status_code == 200
+        assert all(p["project_id"] == project_id for p in response.json())
+
+    def test_portfolios_pagination(self, admin_headers):
+        full = requests.get(f"{BASE_URL}/api/admin/portfolios", headers=admin_headers).json()
+        if len(full) < 2:
+            pytest.skip("Need at least 2 portfolios to test pagination")
+        page = requests.get(f"{BASE_URL}/api/admin/portfolios?skip=1&limit=1", headers=admin_headers).json()
+        assert len(page) == 1
+        assert page[0]["portfolio_id"] == full[1]["portfolio_id"]
+
+
+class TestPortfolioSummaries:
+    """GET /api/portfolio and the overview read portfolio_summaries"""
+
+    def test_rebuild_keeps_overview_totals(self, admin_headers):
+        before = {i["user_id"]: (i["total_invested"], i["portfolio_count"])
+                  for i in requests.get(f"{BASE_URL}/api/admin/investor-overview", headers=admin_headers).json()}
+        response = requests.post(f"{BASE_URL}/api/admin/portfolios/rebuild-summaries", headers=admin_headers)
+        assert response.status_code == 200
+        assert "users" in response.json()
+        after = {i["user_id"]: (i["total_invested"], i["portfolio_count"])
+                 for i in requests.get(f"{BASE_URL}/api/admin/investor-overview", headers=admin_headers).json()}
+        assert after == before
+
+    def test_admin_portfolio_changes_reach_summary(self, admin_headers):
+        investor = next((i for i in requests.get(f"{BASE_URL}/api/admin/investor-overview", headers=admin_headers).json()), None)
+        if not investor:
+            pytest.skip("No investors")
+        project_id = requests.get(f"{BASE_URL}/api/projects").json()[0]["project_id"]
+        added = requests.post(f"{BASE_URL}/api/admin/portfolios/add",
+                              json={"user_id": investor["user_id"], "project_id": project_id, "shares": 3}, headers=admin_headers).json()
+
+        def current():
+            rows = requests.get(f"{BASE_URL}/api/admin/investor-overview", headers=admin_headers).json()
+            return next(i for i in rows if i["user_id"] == investor["user_id"])
+
+        row = current()
+        assert row["total_shares"] == investor["total_shares"] + 3
+        assert row["portfolio_count"] == investor["portfolio_count"] + 1
+
+        requests.delete(f"{BASE_URL}/api/admin/portfolios/{added['portfolio_id']}", params={"shares": 1}, headers=admin_headers)
+        assert current()["total_shares"] == investor["total_shares"] + 2
+
+        requests.delete(f"{BASE_URL}/api/admin/portfolios/{added['portfolio_id']}", headers=admin_headers)
+        row = current()
+        assert row["total_shares"] == investor["total_shares"]
+        assert row["total_invested"] == pytest.approx(investor["total_invested"])
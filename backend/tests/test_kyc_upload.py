@@ -0,0 +1,57 @@
+"""
+Alarko Enerji - KYC Upload Tests
+Tests the streamed /api/kyc/upload pipeline:
+- images are stored under a suffix sniffed from their content
+- non-image content is refused with 415
+- an oversized upload is refused with 413 and leaves the KYC status untouched
+- upload metrics are exposed on /api/admin/metrics
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 2048
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 2048
+
+
+@pytest.fixture
+def investor_headers(make_investor):
+    return make_investor(name="KYC Upload Test")["headers"]
+
+
+def upload(headers, front, back):
+    return requests.post(f"{BASE_URL}/api/kyc/upload", files={
+        "front": ("front.bin", front, "application/octet-stream"), "back": ("back.bin", back, "application/octet-stream")
+    }, headers=headers)
+
+
+class TestKycUpload:
+
+    def test_images_stored_with_sniffed_suffix(self, investor_headers):
+        response = upload(investor_headers, PNG, JPEG)
+        assert response.status_code == 200, response.text
+        doc = requests.get(f"{BASE_URL}/api/kyc/status", headers=investor_headers).json()["kyc_document"]
+        assert doc["front_image"].endswith(".png")
+        assert doc["back_image"].endswith(".jpg")
+        stored = requests.get(f"{BASE_URL}{doc['front_image']}")
+        assert stored.status_code == 200
+        assert stored.content == PNG
+
+    def test_non_image_refused(self, investor_headers):
+        response = upload(investor_headers, PNG, b"%PDF-1.4 not an image")
+        assert response.status_code == 415
+        assert requests.get(f"{BASE_URL}/api/kyc/status", headers=investor_headers).json()["kyc_status"] != "submitted"
+
+    def test_oversized_upload_refused(self, investor_headers):
+        response = upload(investor_headers, PNG + b"\x00" * (25 * 1024 * 1024), JPEG)
+        assert response.status_code == 413
+        assert requests.get(f"{BASE_URL}/api/kyc/status", headers=investor_headers).json()["kyc_status"] != "submitted"
+
+    def test_upload_metrics_exposed(self, admin_headers, investor_headers):
+        upload(investor_headers, PNG, JPEG)
+        metrics = requests.get(f"{BASE_URL}/api/admin/metrics", headers=admin_headers).json()["kyc_uploads"]
+        assert metrics["uploads"] >= 1
+        assert metrics["bytes_per_second"] > 0
+        assert metrics["max_ms"] > 0
@@ -0,0 +1,49 @@
+"""
+Alarko Enerji - Balance Ledger Tests
+Tests the double-entry ledger behind users.balance:
+- admin balance changes append ledger entries with running balances
+- an overdraft is refused without touching the balance or the ledger
+- reconciliation finds no drift for the investor
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+@pytest.fixture
+def investor(make_investor):
+    return make_investor(name="Ledger Test")
+
+
+def adjust(admin_headers, user_id, amount, kind):
+    return requests.put(f"{BASE_URL}/api/admin/users/{user_id}/balance", json={"amount": amount, "type": kind}, headers=admin_headers)
+
+
+class TestLedger:
+
+    def test_adjustments_are_journaled(self, admin_headers, investor):
+        assert adjust(admin_headers, investor["user_id"], 1000, "add").status_code == 200
+        assert adjust(admin_headers, investor["user_id"], 300, "subtract").status_code == 200
+
+        entries = requests.get(f"{BASE_URL}/api/ledger", headers=investor["headers"]).json()
+        assert [e["amount"] for e in entries] == [-300, 1000]
+        assert [e["balance_after"] for e in entries] == [700, 1000]
+        assert entries[0]["seq"] == entries[1]["seq"] + 1
+        balance = requests.get(f"{BASE_URL}/api/auth/me", headers=investor["headers"]).json()["balance"]
+        assert balance == pytest.approx(700)
+
+    def test_overdraft_refused(self, admin_headers, investor):
+        adjust(admin_headers, investor["user_id"], 100, "add")
+        response = adjust(admin_headers, investor["user_id"], 1000, "subtract")
+        assert response.status_code == 400
+        assert requests.get(f"{BASE_URL}/api/auth/me", headers=investor["headers"]).json()["balance"] == pytest.approx(100)
+        assert len(requests.get(f"{BASE_URL}/api/ledger", headers=investor["headers"]).json()) == 1
+
+    def test_reconcile_finds_no_drift(self, admin_headers, investor):
+        adjust(admin_headers, investor["user_id"], 500, "add")
+        response = requests.post(f"{BASE_URL}/api/admin/ledger/reconcile", headers=admin_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["unbalanced_journals"] == 0
+        assert investor["user_id"] not in [m["user_id"] for m in data["sample"]]
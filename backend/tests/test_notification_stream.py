@@ -0,0 +1,99 @@
+"""
+Alarko Enerji - Notification Stream Tests
+Tests the Server-Sent Events endpoint /api/notifications/stream:
+- the stream requires a token (login JWT as header, or a short-lived stream token as ?token=)
+- the login JWT is refused in the URL and stream tokens are refused elsewhere
+- an unread_count event is sent on connect
+- notifications created while connected are pushed to the open stream
+- Last-Event-ID replays notifications missed while disconnected
+"""
+import pytest
+import requests
+import os
+import json
+import threading
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+@pytest.fixture
+def investor(make_investor):
+    return make_investor(name="Stream Test")
+
+
+def stream_token(investor):
+    response = requests.post(f"{BASE_URL}/api/notifications/stream-token",
+                             headers={"Authorization": f"Bearer {investor['token']}"})
+    assert response.status_code == 200
+    return response.json()["token"]
+
+
+def read_events(response, count):
+    """Parses SSE frames from a streaming response until `count` events arrive"""
+    events, current = [], {}
+    for line in response.iter_lines(decode_unicode=True):
+        if line == "":
+            if "event" in current:
+                events.append(current)
+                if len(events) >= count:
+                    break
+            current = {}
+        elif line.startswith(":"):
+            continue
+        else:
+            field, _, value = line.partition(": ")
+            current[field] = json.loads(value) if field == "data" else value
+    return events
+
+
+class TestNotificationStream:
+
+    def test_stream_requires_token(self):
+        response = requests.get(f"{BASE_URL}/api/notifications/stream", timeout=10)
+        assert response.status_code == 401
+
+    def test_login_token_refused_in_url(self, investor):
+        response = requests.get(f"{BASE_URL}/api/notifications/stream", params={"token": investor["token"]}, timeout=10)
+        assert response.status_code == 401
+
+    def test_stream_token_only_opens_the_stream(self, investor):
+        response = requests.get(f"{BASE_URL}/api/auth/me", headers={"Authorization": f"Bearer {stream_token(investor)}"})
+        assert response.status_code == 401
+
+    def test_initial_unread_count(self, investor):
+        with requests.get(f"{BASE_URL}/api/notifications/stream", params={"token": stream_token(investor)},
+                          stream=True, timeout=10) as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/event-stream")
+            event = read_events(response, 1)[0]
+        assert event["event"] == "unread_count"
+        assert event["data"]["unread_count"] >= 1  # welcome notification
+
+    def test_notification_pushed_while_connected(self, admin_headers, investor):
+        with requests.get(f"{BASE_URL}/api/notifications/stream", params={"token": stream_token(investor)},
+                          stream=True, timeout=20) as response:
+            assert read_events(response, 1)[0]["event"] == "unread_count"
+            threading.Timer(0.5, lambda: requests.put(
+                f"{BASE_URL}/api/admin/users/{investor['user_id']}/balance",
+                json={"amount": 1000, "type": "add"}, headers=admin_headers)).start()
+            events = read_events(response, 2)
+        pushed = [e for e in events if e["event"] == "notification"]
+        assert pushed and pushed[0]["data"]["user_id"] == investor["user_id"]
+        assert pushed[0]["id"]
+
+    def test_last_event_id_replays_missed(self, admin_headers, investor):
+        headers = {"Authorization": f"Bearer {investor['token']}"}
+        with requests.get(f"{BASE_URL}/api/notifications/stream", headers=headers, stream=True, timeout=20) as response:
+            read_events(response, 1)
+            threading.Timer(0.5, lambda: requests.put(
+                f"{BASE_URL}/api/admin/users/{investor['user_id']}/balance",
+                json={"amount": 1000, "type": "add"}, headers=admin_headers)).start()
+            last_id = [e for e in read_events(response, 2) if e["event"] == "notification"][0]["id"]
+
+        requests.put(f"{BASE_URL}/api/admin/users/{investor['user_id']}/balance",
+                     json={"amount": 500, "type": "add"}, headers=admin_headers)
+        with requests.get(f"{BASE_URL}/api/notifications/stream", headers={**headers, "Last-Event-ID": last_id},
+                          stream=True, timeout=20) as response:
+            replayed = read_events(response, 2)
+        assert replayed[0]["event"] == "notification"
+        assert replayed[0]["id"] != last_id
+        assert replayed[1]["event"] == "unread_count"
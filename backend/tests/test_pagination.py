@@ -0,0 +1,67 @@
+"""
+Alarko Enerji - Keyset Pagination Tests
+Tests cursor-based pagination on list endpoints:
+- omitting cursor/limit keeps the plain list response
+- X-Next-Cursor walks pages without gaps or duplicates
+- invalid cursors are rejected
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+ADMIN_LISTS = [
+    ("/api/admin/users", "user_id"),
+    ("/api/admin/transactions", "transaction_id"),
+    ("/api/admin/trade-requests", "request_id"),
+    ("/api/admin/kyc", "kyc_id"),
+]
+
+
+def walk(path, headers=None, limit=2, max_pages=50):
+    items, cursor = [], None
+    for _ in range(max_pages):
+        params = {"limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = requests.get(f"{BASE_URL}{path}", params=params, headers=headers)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page) <= limit
+        items += page
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    return items
+
+
+class TestKeysetPagination:
+
+    @pytest.mark.parametrize("path,id_field", ADMIN_LISTS)
+    def test_without_cursor_returns_list(self, admin_headers, path, id_field):
+        response = requests.get(f"{BASE_URL}{path}", headers=admin_headers)
+        assert response.status_code == 200
+        assert isinstance(response.json(), list)
+
+    @pytest.mark.parametrize("path,id_field", ADMIN_LISTS)
+    def test_pages_have_no_duplicates(self, admin_headers, path, id_field):
+        items = walk(path, admin_headers)
+        ids = [i[id_field] for i in items]
+        assert len(ids) == len(set(ids))
+
+    def test_projects_pages_cover_full_list(self):
+        full = requests.get(f"{BASE_URL}/api/projects").json()
+        paged = walk("/api/projects", limit=2)
+        assert [p["project_id"] for p in paged] == [p["project_id"] for p in full]
+
+    def test_invalid_cursor_rejected(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/transactions", params={"cursor": "not-a-cursor"}, headers=admin_headers)
+        assert response.status_code == 400
+
+    def test_notifications_include_next_cursor(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/notifications", params={"limit": 1}, headers=admin_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert "next_cursor" in data
+        assert len(data["notifications"]) <= 1
@@ -0,0 +1,70 @@
+"""
+Alarko Enerji - Payout Chunk Tests
+Drives pay_chunk directly against MONGO_URL/DB_NAME:
+- users whose credit was not applied get no transaction, notification or totals
+- users already credited for the period by an interrupted run are still recorded
+- new runs refuse to start on a stale or missing USD rate
+Skipped when MONGO_URL is not set.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+MONGO_URL = os.environ.get('MONGO_URL')
+
+pytestmark = pytest.mark.skipif(not MONGO_URL, reason="MONGO_URL not set")
+
+
+@pytest.fixture(scope="module")
+def server():
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    import server
+    return server
+
+
+def test_only_applied_users_are_recorded(server):
+    period = "2098-01"
+    fresh, resumed, missing = (str(uuid.uuid4()) for _ in range(3))
+    run_doc = {"period": period, "usd_rate": 1.0, "started_by": "test", "dry_run": False}
+    chunk = {uid: [{"monthly_return": 100.0}] for uid in (fresh, resumed, missing)}
+
+    async def run():
+        await server.db.users.insert_many([
+            {"user_id": fresh, "balance": 0.0, "reserved_balance": 0.0},
+            {"user_id": resumed, "balance": 100.0, "reserved_balance": 0.0, "last_payout_period": period}])
+        payouts = await server.pay_chunk(run_doc, chunk)
+        recorded = {t['user_id'] async for t in server.db.transactions.find(
+            {"period": period, "user_id": {"$in": list(chunk)}}, {"_id": 0, "user_id": 1})}
+        balances = {u['user_id']: u['balance'] async for u in server.db.users.find(
+            {"user_id": {"$in": list(chunk)}}, {"_id": 0, "user_id": 1, "balance": 1})}
+        await server.db.users.delete_many({"user_id": {"$in": list(chunk)}})
+        await server.db.transactions.delete_many({"user_id": {"$in": list(chunk)}})
+        return payouts, recorded, balances
+
+    payouts, recorded, balances = asyncio.run(run())
+    assert set(payouts) == {fresh, resumed}
+    assert recorded == {fresh, resumed}
+    assert balances == {fresh: 100.0, resumed: 100.0}
+
+
+def test_new_run_refuses_stale_usd_rate(server):
+    saved = dict(server._usd_cache)
+    try:
+        server._usd_cache["updated_at"] = None
+        with pytest.raises(server.HTTPException) as exc:
+            server.payout_usd_rate()
+        assert exc.value.status_code == 503
+        server._usd_cache["updated_at"] = server.datetime.now(server.timezone.utc)
+        assert server.payout_usd_rate() == server._usd_cache["rate"]
+        # Just past the refresh interval, while the worker is still refreshing, runs can start
+        server._usd_cache["updated_at"] -= server.timedelta(seconds=server.USD_RATE_REFRESH_SECONDS + 1)
+        assert server.payout_usd_rate() == server._usd_cache["rate"]
+        server._usd_cache["updated_at"] -= server.timedelta(seconds=server.PAYOUT_USD_RATE_GRACE_SECONDS)
+        with pytest.raises(server.HTTPException):
+            server.payout_usd_rate()
+    finally:
+        server._usd_cache.update(saved)
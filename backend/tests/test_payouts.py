@@ -0,0 +1,41 @@
+"""
+Alarko Enerji - Monthly Payout Tests
+Tests the payout run endpoints without crediting anyone:
+- the period must be YYYY-MM
+- a dry run reports totals and throughput and writes nothing
+- payout endpoints are admin-only
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+
+class TestPayoutRuns:
+
+    @pytest.mark.parametrize("period", ["2025-13", "2025-1", "202501", "abc"])
+    def test_invalid_period_rejected(self, admin_headers, period):
+        response = requests.post(f"{BASE_URL}/api/admin/payouts/run", json={"period": period, "dry_run": True}, headers=admin_headers)
+        assert response.status_code == 400
+
+    def test_dry_run_reports_without_writing(self, admin_headers):
+        transactions_before = len(requests.get(f"{BASE_URL}/api/admin/transactions", headers=admin_headers).json())
+        response = requests.post(f"{BASE_URL}/api/admin/payouts/run", json={"period": "2099-01", "dry_run": True}, headers=admin_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["dry_run"] is True
+        for field in ("users", "portfolios", "amount", "seconds", "usd_rate"):
+            assert field in data
+        assert data["amount"] >= 0
+        assert len(requests.get(f"{BASE_URL}/api/admin/transactions", headers=admin_headers).json()) == transactions_before
+        assert requests.get(f"{BASE_URL}/api/admin/payouts/runs/2099-01", headers=admin_headers).status_code == 404
+
+    def test_runs_listing(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/payouts/runs", headers=admin_headers)
+        assert response.status_code == 200
+        assert isinstance(response.json(), list)
+
+    def test_requires_admin(self):
+        response = requests.post(f"{BASE_URL}/api/admin/payouts/run", json={"period": "2099-01", "dry_run": True})
+        assert response.status_code == 401
@@ -0,0 +1,58 @@
+"""
+Alarko Enerji - Project Catalog Cache Tests
+Tests the cached /api/projects catalog:
+- list and detail responses carry a strong ETag
+- If-None-Match with the current ETag returns 304 without a body
+- an admin update changes the ETag
+"""
+import pytest
+import requests
+import os
+import time
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+PROJECT_FIELDS = ["name", "type", "description", "location", "capacity", "return_rate", "total_target", "image_url", "details"]
+
+
+class TestProjectCatalog:
+
+    @pytest.mark.parametrize("params", [{}, {"type": "GES"}, {"type": "all"}])
+    def test_list_revalidates_with_304(self, params):
+        response = requests.get(f"{BASE_URL}/api/projects", params=params)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert etag.startswith('"') and not etag.startswith('W/')
+        cached = requests.get(f"{BASE_URL}/api/projects", params=params, headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+
+    def test_type_filter(self):
+        projects = requests.get(f"{BASE_URL}/api/projects", params={"type": "res"}).json()
+        assert projects and all(p["type"] == "RES" for p in projects)
+
+    def test_detail_etag_and_404(self):
+        project = requests.get(f"{BASE_URL}/api/projects").json()[0]
+        response = requests.get(f"{BASE_URL}/api/projects/{project['project_id']}")
+        assert response.status_code == 200
+        assert response.json()["project_id"] == project["project_id"]
+        assert requests.get(f"{BASE_URL}/api/projects/{project['project_id']}",
+                            headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+        assert requests.get(f"{BASE_URL}/api/projects/does-not-exist").status_code == 404
+
+    def test_admin_update_changes_etag(self, admin_headers):
+        project = requests.get(f"{BASE_URL}/api/projects").json()[0]
+        url = f"{BASE_URL}/api/projects/{project['project_id']}"
+        etag = requests.get(url).headers["ETag"]
+        original = {k: project.get(k, "") for k in PROJECT_FIELDS}
+        try:
+            response = requests.put(f"{BASE_URL}/api/admin/projects/{project['project_id']}",
+                                    json={**original, "details": original["details"] + " (test)"}, headers=admin_headers)
+            assert response.status_code == 200
+            time.sleep(1.5)  # other workers pick up the new version within CATALOG_CHECK_SECONDS
+            updated = requests.get(url, headers={"If-None-Match": etag})
+            assert updated.status_code == 200
+            assert updated.json()["details"].endswith("(test)")
+            assert updated.headers["ETag"] != etag
+        finally:
+            requests.put(f"{BASE_URL}/api/admin/projects/{project['project_id']}", json=original, headers=admin_headers)
@@ -0,0 +1,56 @@
+"""
+Alarko Enerji - Project Funding Stats Tests
+Tests the materialized funded_amount / funded_shares / investors_count on projects:
+- admin portfolio adds and deletes move the figures both ways
+- a second holding of the same investor does not add an investor
+- the rebuild job leaves consistent figures unchanged
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+SHARE_PRICE = 25000
+
+
+@pytest.fixture
+def investor_id(make_investor):
+    return make_investor(name="Stats Test")["user_id"]
+
+
+def stats(project_id):
+    project = requests.get(f"{BASE_URL}/api/projects/{project_id}").json()
+    return project["funded_amount"], project["funded_shares"], project["investors_count"]
+
+
+class TestProjectStats:
+
+    def test_portfolio_mutations_update_stats(self, admin_headers, investor_id):
+        project_id = requests.get(f"{BASE_URL}/api/projects").json()[0]["project_id"]
+        amount, shares, investors = stats(project_id)
+
+        first = requests.post(f"{BASE_URL}/api/admin/portfolios/add", json={"user_id": investor_id, "project_id": project_id, "shares": 2}, headers=admin_headers)
+        assert first.status_code == 200
+        assert stats(project_id) == (pytest.approx(amount + 2 * SHARE_PRICE), shares + 2, investors + 1)
+
+        second = requests.post(f"{BASE_URL}/api/admin/portfolios/add", json={"user_id": investor_id, "project_id": project_id, "shares": 1}, headers=admin_headers)
+        assert stats(project_id) == (pytest.approx(amount + 3 * SHARE_PRICE), shares + 3, investors + 1)
+
+        requests.delete(f"{BASE_URL}/api/admin/portfolios/{first.json()['portfolio_id']}", params={"shares": 1}, headers=admin_headers)
+        assert stats(project_id) == (pytest.approx(amount + 2 * SHARE_PRICE), shares + 2, investors + 1)
+
+        requests.delete(f"{BASE_URL}/api/admin/portfolios/{first.json()['portfolio_id']}", headers=admin_headers)
+        requests.delete(f"{BASE_URL}/api/admin/portfolios/{second.json()['portfolio_id']}", headers=admin_headers)
+        assert stats(project_id) == (pytest.approx(amount), shares, investors)
+
+    def test_rebuild_keeps_consistent_stats(self, admin_headers):
+        before = {p["project_id"]: (p["funded_amount"], p["funded_shares"], p["investors_count"])
+                  for p in requests.get(f"{BASE_URL}/api/projects").json()}
+        response = requests.post(f"{BASE_URL}/api/admin/projects/rebuild-stats", headers=admin_headers)
+        assert response.status_code == 200
+        assert response.json()["projects"] >= len(before)
+        after = {p["project_id"]: (p["funded_amount"], p["funded_shares"], p["investors_count"])
+                 for p in requests.get(f"{BASE_URL}/api/projects").json()}
+        for project_id, (amount, shares, investors) in before.items():
+            assert after[project_id] == (pytest.approx(amount), shares, investors)
@@ -0,0 +1,58 @@
+"""
+Alarko Enerji - Project Stats Replay Tests
+Drives record_holding_change directly against MONGO_URL/DB_NAME:
+- a re-driven op whose holder write already landed still updates the project
+- the replay applies the investors_count delta recorded with the holder write
+- further replays change nothing
+Skipped when MONGO_URL is not set.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+MONGO_URL = os.environ.get('MONGO_URL')
+
+pytestmark = pytest.mark.skipif(not MONGO_URL, reason="MONGO_URL not set")
+
+STATS = {"_id": 0, "funded_amount": 1, "funded_shares": 1, "investors_count": 1}
+
+
+@pytest.fixture(scope="module")
+def server():
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    import server
+    return server
+
+
+def test_replay_after_holder_write_updates_project(server):
+    project_id = f"replay_{uuid.uuid4().hex[:8]}"
+    user_id = str(uuid.uuid4())
+    op_id = str(uuid.uuid4())
+
+    async def run():
+        await server.db.projects.insert_one({"project_id": project_id, "funded_amount": 0,
+                                             "funded_shares": 0, "investors_count": 0})
+        await server.record_holding_change(project_id, user_id, 3, 300.0, op_id)
+        applied = await server.db.projects.find_one({"project_id": project_id}, STATS)
+        # Crash between the holder write and the project write: only the holder row kept the op
+        await server.db.projects.update_one({"project_id": project_id}, {
+            "$set": {"funded_amount": 0, "funded_shares": 0, "investors_count": 0},
+            "$pull": {"pending_ops": op_id}})
+        await server.record_holding_change(project_id, user_id, 3, 300.0, op_id)
+        replayed = await server.db.projects.find_one({"project_id": project_id}, STATS)
+        await server.record_holding_change(project_id, user_id, 3, 300.0, op_id)
+        again = await server.db.projects.find_one({"project_id": project_id}, STATS)
+        holder = await server.db.project_investors.find_one({"holder_id": f"{project_id}:{user_id}"}, {"_id": 0})
+        await server.db.projects.delete_one({"project_id": project_id})
+        await server.db.project_investors.delete_many({"project_id": project_id})
+        return applied, replayed, again, holder
+
+    applied, replayed, again, holder = asyncio.run(run())
+    assert applied == {"funded_amount": 300.0, "funded_shares": 3, "investors_count": 1}
+    assert replayed == applied
+    assert again == applied
+    assert holder["shares"] == 3
@@ -0,0 +1,82 @@
+"""
+Alarko Enerji - Reserved Balance Tests
+Tests the holds that pending buy requests and withdrawals place on a balance:
+- filing a request reserves its amount and lowers the available balance
+- requests beyond the available balance are refused at filing time
+- approval or rejection releases the hold
+- concurrent filings cannot oversubscribe the balance
+- an admin subtraction cannot take reserved funds
+- hold and ledger bookkeeping never leaves the server
+"""
+import pytest
+import requests
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+@pytest.fixture
+def investor(make_investor):
+    return make_investor(name="Reserve Test", balance=1000)
+
+
+def me(investor):
+    return requests.get(f"{BASE_URL}/api/auth/me", headers=investor["headers"]).json()
+
+
+def withdraw(investor, amount):
+    return requests.post(f"{BASE_URL}/api/transactions/withdraw", json={"amount": amount}, headers=investor["headers"])
+
+
+class TestReservedBalance:
+
+    def test_request_reserves_amount(self, investor):
+        assert withdraw(investor, 400).status_code == 200
+        user = me(investor)
+        assert user["balance"] == pytest.approx(1000)
+        assert user["reserved_balance"] == pytest.approx(400)
+        assert user["available_balance"] == pytest.approx(600)
+
+    def test_oversubscription_refused(self, investor):
+        assert withdraw(investor, 700).status_code == 200
+        response = withdraw(investor, 700)
+        assert response.status_code == 400
+        assert me(investor)["reserved_balance"] == pytest.approx(700)
+
+    def test_concurrent_requests_cannot_oversubscribe(self, investor):
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            codes = [r.status_code for r in pool.map(lambda _: withdraw(investor, 300), range(10))]
+        assert codes.count(200) == 3
+        assert me(investor)["reserved_balance"] == pytest.approx(900)
+
+    def test_approval_and_rejection_release(self, admin_headers, investor):
+        approved = withdraw(investor, 300).json()["transaction_id"]
+        rejected = withdraw(investor, 500).json()["transaction_id"]
+        assert requests.put(f"{BASE_URL}/api/admin/transactions/{approved}", json={"status": "approved"}, headers=admin_headers).status_code == 200
+        assert requests.put(f"{BASE_URL}/api/admin/transactions/{rejected}", json={"status": "rejected"}, headers=admin_headers).status_code == 200
+        user = me(investor)
+        assert user["balance"] == pytest.approx(700)
+        assert user["reserved_balance"] == pytest.approx(0)
+        assert user["available_balance"] == pytest.approx(700)
+
+    def test_reconcile_keeps_open_holds(self, admin_headers, investor):
+        withdraw(investor, 250)
+        response = requests.post(f"{BASE_URL}/api/admin/users/reconcile-holds", headers=admin_headers)
+        assert response.status_code == 200
+        assert me(investor)["reserved_balance"] == pytest.approx(250)
+
+    def test_admin_subtract_cannot_touch_reserved(self, admin_headers, investor):
+        assert withdraw(investor, 800).status_code == 200
+        balance = f"{BASE_URL}/api/admin/users/{investor['user_id']}/balance"
+        assert requests.put(balance, json={"amount": 300, "type": "subtract"}, headers=admin_headers).status_code == 400
+        assert requests.put(balance, json={"amount": 200, "type": "subtract"}, headers=admin_headers).status_code == 200
+        user = me(investor)
+        assert user["balance"] == pytest.approx(800)
+        assert user["reserved_balance"] == pytest.approx(800)
+
+    def test_bookkeeping_fields_not_exposed(self, admin_headers, investor):
+        assert withdraw(investor, 100).status_code == 200
+        hidden = {"password_hash", "holds", "pending_ops", "ledger_pending", "ledger_seq", "last_payout_period"}
+        assert not hidden & set(me(investor))
+        users = requests.get(f"{BASE_URL}/api/admin/users", headers=admin_headers).json()
+        assert all(not hidden & set(u) for u in users)
@@ -0,0 +1,79 @@
+"""
+Alarko Enerji - Settlement Recovery Tests
+Drives the stale-settlement re-driver directly against MONGO_URL/DB_NAME:
+- concurrent re-drivers credit a stale deposit exactly once
+- a handler whose row was taken over does not finish it or release its markers
+Skipped when MONGO_URL is not set.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+MONGO_URL = os.environ.get('MONGO_URL')
+
+pytestmark = pytest.mark.skipif(not MONGO_URL, reason="MONGO_URL not set")
+
+
+@pytest.fixture(scope="module")
+def server():
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    import server
+    return server
+
+
+def stale_deposit(user_id: str, amount: float) -> dict:
+    return {"transaction_id": str(uuid.uuid4()), "user_id": user_id, "type": "deposit", "amount": amount,
+            "status": "processing", "target_status": "approved", "claim_id": uuid.uuid4().hex,
+            "processing_at": (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()}
+
+
+async def cleanup(server, user_id):
+    await server.db.users.delete_many({"user_id": user_id})
+    await server.db.transactions.delete_many({"user_id": user_id})
+
+
+def test_concurrent_redrives_credit_once(server):
+    user_id = str(uuid.uuid4())
+    txn = stale_deposit(user_id, 500.0)
+
+    async def run():
+        await server.db.users.insert_one({"user_id": user_id, "balance": 0.0, "reserved_balance": 0.0})
+        await server.db.transactions.insert_one(dict(txn))
+        rows = [await server.db.transactions.find_one({"transaction_id": txn["transaction_id"]}, {"_id": 0})]
+        await asyncio.gather(*(server.redrive_batch("transactions", server.settle_transactions, rows) for _ in range(4)))
+        user = await server.db.users.find_one({"user_id": user_id}, {"_id": 0})
+        stored = await server.db.transactions.find_one({"transaction_id": txn["transaction_id"]}, {"_id": 0})
+        await cleanup(server, user_id)
+        return user, stored
+
+    user, stored = asyncio.run(run())
+    assert user["balance"] == pytest.approx(500.0)
+    assert user.get("pending_ops", []) == []
+    assert stored["status"] == "approved"
+
+
+def test_taken_over_row_keeps_markers(server):
+    user_id = str(uuid.uuid4())
+    txn = stale_deposit(user_id, 200.0)
+
+    async def run():
+        await server.db.users.insert_one({"user_id": user_id, "balance": 0.0, "reserved_balance": 0.0})
+        await server.db.transactions.insert_one(dict(txn))
+        [row] = await server.reclaim_stale(server.db.transactions, "transaction_id", [dict(txn)])
+        # The original handler wakes up after the take-over and settles with its old claim
+        await server.settle_transactions([dict(txn)])
+        stored = await server.db.transactions.find_one({"transaction_id": txn["transaction_id"]}, {"_id": 0})
+        user = await server.db.users.find_one({"user_id": user_id}, {"_id": 0})
+        await cleanup(server, user_id)
+        return row, stored, user
+
+    row, stored, user = asyncio.run(run())
+    assert row["claim_id"] != txn["claim_id"]
+    assert stored["status"] == "processing"
+    assert stored["claim_id"] == row["claim_id"]
+    assert txn["transaction_id"] in user["pending_ops"]
@@ -0,0 +1,83 @@
+"""
+Alarko Enerji - Project Share Inventory Tests
+Tests that a project cannot be sold past total_target / SHARE_PRICE shares:
+- concurrent buy requests reserve at most the project's shares
+- a rejected request returns its shares to the project
+- an approved request keeps them sold
+- seeded projects carry an inventory and accept buys
+- admin portfolio adds cannot push funded shares past the inventory
+"""
+import pytest
+import requests
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+SHARE_PRICE = 25000
+PROJECT_SHARES = 3
+
+
+@pytest.fixture
+def project_id(admin_headers):
+    response = requests.post(f"{BASE_URL}/api/admin/projects", json={
+        "name": f"TEST Inventory {uuid.uuid4().hex[:6]}", "type": "GES", "description": "Envanter testi",
+        "location": "Test", "capacity": "1 MW", "return_rate": 7, "total_target": PROJECT_SHARES * SHARE_PRICE,
+        "image_url": "https://example.com/ges.jpg"
+    }, headers=admin_headers)
+    assert response.status_code == 200, response.text
+    return response.json()["project_id"]
+
+
+def funded_buyer(make_investor):
+    return make_investor(name="Inventory Test", balance=SHARE_PRICE, kyc=True)["headers"]
+
+
+def buy(headers, project_id):
+    return requests.post(f"{BASE_URL}/api/portfolio/invest", json={"project_id": project_id, "amount": SHARE_PRICE}, headers=headers)
+
+
+class TestShareInventory:
+
+    def test_concurrent_buys_never_oversell(self, make_investor, project_id):
+        investors = [funded_buyer(make_investor) for _ in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda h: buy(h, project_id), investors))
+        codes = [r.status_code for r in responses]
+        assert codes.count(200) == PROJECT_SHARES
+        assert codes.count(400) == len(investors) - PROJECT_SHARES
+
+    def test_rejection_frees_and_approval_keeps_shares(self, admin_headers, make_investor, project_id):
+        investors = [funded_buyer(make_investor) for _ in range(PROJECT_SHARES + 1)]
+        ids = [buy(h, project_id).json()["request"]["request_id"] for h in investors[:PROJECT_SHARES]]
+        assert buy(investors[-1], project_id).status_code == 400
+
+        requests.put(f"{BASE_URL}/api/admin/trade-requests/{ids[0]}", json={"status": "approved"}, headers=admin_headers)
+        assert buy(investors[-1], project_id).status_code == 400
+
+        requests.put(f"{BASE_URL}/api/admin/trade-requests/{ids[1]}", json={"status": "rejected"}, headers=admin_headers)
+        assert buy(investors[-1], project_id).status_code == 200
+
+        project = requests.get(f"{BASE_URL}/api/projects/{project_id}").json()
+        assert project["funded_shares"] == 1
+
+    def test_admin_add_cannot_oversell(self, admin_headers, make_investor, project_id):
+        user_id = make_investor(name="Inventory Admin Add")["user_id"]
+        add = f"{BASE_URL}/api/admin/portfolios/add"
+        assert requests.post(add, json={"user_id": user_id, "project_id": project_id, "shares": PROJECT_SHARES + 1},
+                             headers=admin_headers).status_code == 400
+        assert requests.post(add, json={"user_id": user_id, "project_id": project_id, "shares": PROJECT_SHARES},
+                             headers=admin_headers).status_code == 200
+        assert buy(funded_buyer(make_investor), project_id).status_code == 400
+        project = requests.get(f"{BASE_URL}/api/projects/{project_id}").json()
+        assert project["funded_shares"] == PROJECT_SHARES
+
+    def test_seeded_project_accepts_buys(self, admin_headers, make_investor):
+        seeded = next(p for p in requests.get(f"{BASE_URL}/api/projects").json()
+                      if p["name"] == "İzmir Güneş Enerjisi Santrali")
+        assert seeded["total_shares"] == seeded["total_target"] // SHARE_PRICE
+        response = buy(funded_buyer(make_investor), seeded["project_id"])
+        assert response.status_code == 200, response.text
+        requests.put(f"{BASE_URL}/api/admin/trade-requests/{response.json()['request']['request_id']}",
+                     json={"status": "rejected"}, headers=admin_headers)
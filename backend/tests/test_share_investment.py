@@ -37,6 +37,28 @@ class TestUsdRateEndpoint:
         # USD/TRY rate should be reasonable (between 20-100 as of 2024-2026)
         assert 20 < data["rate"] < 100, f"USD rate {data['rate']} seems unreasonable"
 
+    def test_usd_rate_reports_staleness(self):
+        """Test /api/usd-rate exposes when the rate was fetched and whether it is stale"""
+        response = requests.get(f"{BASE_URL}/api/usd-rate")
+        assert response.status_code == 200
+        data = response.json()
+        assert "updated_at" in data
+        assert isinstance(data["stale"], bool)
+
+    def test_usd_rate_history_point_in_time(self):
+        """Test /api/usd-rate/history returns the rate in effect at a given time"""
+        current = requests.get(f"{BASE_URL}/api/usd-rate").json()
+        if not current.get("updated_at"):
+            pytest.skip("No rate has been recorded yet")
+        response = requests.get(f"{BASE_URL}/api/usd-rate/history", params={"at": current["updated_at"]})
+        assert response.status_code == 200
+        assert response.json()["rate"] == current["rate"]
+
+    def test_usd_rate_history_before_first_record(self):
+        """Test /api/usd-rate/history returns 404 before any recorded rate"""
+        response = requests.get(f"{BASE_URL}/api/usd-rate/history", params={"at": "2000-01-01T00:00:00+00:00"})
+        assert response.status_code == 404
+
 
 class TestShareBasedInvestment:
     """Tests for POST /api/portfolio/invest with share-based system"""
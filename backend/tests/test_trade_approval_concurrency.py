@@ -0,0 +1,116 @@
+"""
+Alarko Enerji - Trade Approval Concurrency Tests
+Hammers PUT /api/admin/trade-requests/{id} from many threads and checks that:
+- each request is settled exactly once, even when approved by several admins at once
+- the investor's balance is conserved and never goes negative
+- funded buys and portfolio rows stay in step
+"""
+import pytest
+import requests
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+SHARE_PRICE = 25000
+
+
+@pytest.fixture
+def funded_investor(make_investor):
+    """Investor with approved KYC and a balance that covers exactly two shares"""
+    return make_investor(name="Concurrency Test", balance=2 * SHARE_PRICE, kyc=True)
+
+
+class TestConcurrentApprovals:
+
+    def test_balance_conserved_under_concurrent_approvals(self, admin_headers, funded_investor):
+        projects = requests.get(f"{BASE_URL}/api/projects").json()
+        project_id = projects[0]["project_id"]
+        headers = funded_investor["headers"]
+
+        # Two one-share buys reserve the whole balance; further requests are refused up front
+        request_ids = []
+        for _ in range(2):
+            response = requests.post(f"{BASE_URL}/api/portfolio/invest", json={"project_id": project_id, "amount": SHARE_PRICE}, headers=headers)
+            assert response.status_code == 200, response.text
+            request_ids.append(response.json()["request"]["request_id"])
+        response = requests.post(f"{BASE_URL}/api/portfolio/invest", json={"project_id": project_id, "amount": SHARE_PRICE}, headers=headers)
+        assert response.status_code == 400
+        # The balance then drops below the reserved amount, so only one approval can succeed
+        requests.put(f"{BASE_URL}/api/admin/users/{funded_investor['user_id']}/balance",
+                     json={"amount": SHARE_PRICE, "type": "subtract"}, headers=admin_headers)
+
+        # Every request is approved by three "admins" at once
+        def approve(rid):
+            return rid, requests.put(f"{BASE_URL}/api/admin/trade-requests/{rid}", json={"status": "approved"}, headers=admin_headers).status_code
+
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            results = list(pool.map(approve, request_ids * 3))
+
+        for rid in request_ids:
+            codes = [code for r, code in results if r == rid]
+            assert codes.count(200) <= 1, f"{rid} settled more than once: {codes}"
+
+        trades = {t["request_id"]: t for t in requests.get(f"{BASE_URL}/api/trade-requests", headers=headers).json()}
+        statuses = [trades[rid]["status"] for rid in request_ids]
+        assert all(s in ("approved", "rejected") for s in statuses), statuses
+        approved = statuses.count("approved")
+        assert approved == 1
+
+        me = requests.get(f"{BASE_URL}/api/auth/me", headers=headers).json()
+        assert me["balance"] == pytest.approx(SHARE_PRICE - approved * SHARE_PRICE)
+        assert me["balance"] >= 0
+        assert me["reserved_balance"] == pytest.approx(0)
+
+        portfolio = requests.get(f"{BASE_URL}/api/portfolio", headers=headers).json()
+        assert len(portfolio["investments"]) == approved
+        assert portfolio["total_invested"] == pytest.approx(approved * SHARE_PRICE)
+
+
+class TestBulkSettlement:
+    """Tests for POST /api/admin/transactions/bulk and /api/admin/trade-requests/bulk"""
+
+    def test_bulk_deposits_and_isolated_failures(self, admin_headers, funded_investor):
+        headers = funded_investor["headers"]
+        before = requests.get(f"{BASE_URL}/api/auth/me", headers=headers).json()["balance"]
+        ids = []
+        for amount in (100, 200, 300):
+            response = requests.post(f"{BASE_URL}/api/transactions", json={"amount": amount, "type": "deposit"}, headers=headers)
+            assert response.status_code == 200
+            ids.append(response.json()["transaction_id"])
+        # An oversized withdrawal fails on its own without aborting the deposits
+        response = requests.post(f"{BASE_URL}/api/transactions/withdraw", json={"amount": before}, headers=headers)
+        assert response.status_code == 200
+        withdrawal_id = response.json()["transaction_id"]
+        requests.put(f"{BASE_URL}/api/admin/users/{funded_investor['user_id']}/balance",
+                     json={"amount": before, "type": "subtract"}, headers=admin_headers)
+
+        response = requests.post(f"{BASE_URL}/api/admin/transactions/bulk", json={
+            "ids": ids + [withdrawal_id, "does-not-exist"], "status": "approved"
+        }, headers=admin_headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        results = {r["id"]: r for r in data["results"]}
+        assert all(results[i]["status"] == "approved" for i in ids)
+        assert results[withdrawal_id]["status"] == "rejected"
+        assert results["does-not-exist"]["status"] == "skipped"
+        assert data["approved"] == 3
+
+        after = requests.get(f"{BASE_URL}/api/auth/me", headers=headers).json()["balance"]
+        assert after == pytest.approx(600)
+
+        # Replaying the same batch changes nothing
+        replay = requests.post(f"{BASE_URL}/api/admin/transactions/bulk", json={"ids": ids, "status": "approved"}, headers=admin_headers).json()
+        assert replay["skipped"] == 3
+        assert requests.get(f"{BASE_URL}/api/auth/me", headers=headers).json()["balance"] == pytest.approx(600)
+
+    def test_bulk_reject_trade_requests(self, admin_headers, funded_investor):
+        project_id = requests.get(f"{BASE_URL}/api/projects").json()[0]["project_id"]
+        headers = funded_investor["headers"]
+        ids = [requests.post(f"{BASE_URL}/api/portfolio/invest", json={"project_id": project_id, "amount": SHARE_PRICE},
+                             headers=headers).json()["request"]["request_id"] for _ in range(2)]
+        response = requests.post(f"{BASE_URL}/api/admin/trade-requests/bulk", json={"ids": ids, "status": "rejected"}, headers=admin_headers)
+        assert response.status_code == 200
+        assert response.json()["rejected"] == 2
+        notifications = requests.get(f"{BASE_URL}/api/notifications", headers=headers).json()["notifications"]
+        assert sum(1 for n in notifications if n["type"] == "trade_rejected") >= 2
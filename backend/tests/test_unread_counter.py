@@ -0,0 +1,53 @@
+"""
+Alarko Enerji - Unread Notification Counter Tests
+Tests the denormalized users.unread_count behind /api/notifications:
+- every new notification increments the badge
+- marking the same notification read twice decrements it once
+- read-all brings the badge to zero
+- the admin reconcile endpoint reports no drift afterwards
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://res-ges-hub.preview.emergentagent.com')
+
+@pytest.fixture
+def investor(make_investor):
+    return make_investor(name="Unread Test")
+
+
+def unread(headers):
+    response = requests.get(f"{BASE_URL}/api/notifications", headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+class TestUnreadCounter:
+
+    def test_counter_follows_inserts_and_reads(self, admin_headers, investor):
+        headers = investor["headers"]
+        start = unread(headers)["unread_count"]
+        assert start >= 1  # welcome notification
+
+        requests.put(f"{BASE_URL}/api/admin/users/{investor['user_id']}/balance", json={"amount": 1000, "type": "add"}, headers=admin_headers)
+        data = unread(headers)
+        assert data["unread_count"] == start + 1
+
+        notification_id = data["notifications"][0]["notification_id"]
+        for _ in range(2):
+            requests.post(f"{BASE_URL}/api/notifications/{notification_id}/read", headers=headers)
+        assert unread(headers)["unread_count"] == start
+
+        requests.post(f"{BASE_URL}/api/notifications/read-all", headers=headers)
+        assert unread(headers)["unread_count"] == 0
+
+    def test_reconcile_reports_no_drift(self, admin_headers, investor):
+        unread(investor["headers"])
+        response = requests.post(f"{BASE_URL}/api/admin/notifications/reconcile-unread", headers=admin_headers)
+        assert response.status_code == 200
+        assert "corrected" in response.json()
+
+    def test_reconcile_requires_admin(self, investor):
+        response = requests.post(f"{BASE_URL}/api/admin/notifications/reconcile-unread", headers=investor["headers"])
+        assert response.status_code == 403
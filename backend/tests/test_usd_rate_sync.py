@@ -0,0 +1,67 @@
+"""
+Alarko Enerji - USD Rate Sync Tests
+Drives the USD/TRY refresh directly against MONGO_URL/DB_NAME:
+- rates recorded by other workers reach this worker's point-in-time history
+- concurrent stale refreshes call the provider once
+Skipped when MONGO_URL is not set.
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+MONGO_URL = os.environ.get('MONGO_URL')
+
+pytestmark = pytest.mark.skipif(not MONGO_URL, reason="MONGO_URL not set")
+
+
+@pytest.fixture(scope="module")
+def server():
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    import server
+    return server
+
+
+def test_other_workers_rates_are_synced(server):
+    async def run():
+        await server.load_usd_rate_history()
+        newest = datetime.fromtimestamp(server._usd_history["ts"][-1], timezone.utc) if server._usd_history["ts"] \
+            else datetime.now(timezone.utc) - timedelta(days=1)
+        between = [newest + timedelta(seconds=1), newest + timedelta(seconds=2)]
+        await server.db.usd_rates.insert_many([{"rate": 41.0 + i, "fetched_at": at, "source": "test"} for i, at in enumerate(between)])
+        await server.sync_usd_rate_history()
+        points = [server.usd_rate_at(at) for at in between]
+        await server.db.usd_rates.delete_many({"source": "test"})
+        return points
+
+    first, second = asyncio.run(run())
+    assert first["rate"] == 41.0
+    assert second["rate"] == 42.0
+
+
+def test_concurrent_refreshes_call_provider_once(server, monkeypatch):
+    calls = []
+
+    async def provider():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return server._usd_cache["rate"]
+
+    monkeypatch.setattr(server, "USD_RATE_REFRESH_SECONDS", 0)
+    server.set_usd_rate_provider(provider)
+    started = datetime.now(timezone.utc) - timedelta(seconds=1)
+
+    async def run():
+        await server.db.usd_rate_lease.delete_many({})
+        await asyncio.gather(*(server._refresh_usd_rate_once() for _ in range(5)))
+        await server.db.usd_rate_lease.delete_many({})
+        await server.db.usd_rates.delete_many({"fetched_at": {"$gte": started}, "source": server.USD_RATE_URL})
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.set_usd_rate_provider(server.fetch_usd_rate_er_api)
+    assert len(calls) == 1
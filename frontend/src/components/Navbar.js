@@ -25,12 +25,36 @@ export default function Navbar({ transparent = false }) {
   }, []);
 
   useEffect(() => {
-    if (token) {
-      axios.get(`${API}/notifications`, { headers: { Authorization: `Bearer ${token}` } })
-        .then(res => setUnreadCount(res.data.unread_count))
-        .catch(() => {});
-    }
-  }, [token, location.pathname]);
+    if (!token) return;
+    const headers = { Authorization: `Bearer ${token}` };
+    let source = null;
+    let retry = null;
+    let active = true;
+    // A REST read gives the badge its first value and keeps it current while the stream is down
+    const fetchCount = () => axios.get(`${API}/notifications`, { headers, params: { limit: 1 } })
+      .then(res => { if (active) setUnreadCount(res.data.unread_count); })
+      .catch(() => {});
+    // The stream takes a short-lived token scoped to it, never the login token
+    const connect = () => axios.post(`${API}/notifications/stream-token`, null, { headers })
+      .then(res => {
+        if (!active) return;
+        source = new EventSource(`${API}/notifications/stream?token=${encodeURIComponent(res.data.token)}`);
+        source.addEventListener('unread_count', (e) => setUnreadCount(JSON.parse(e.data).unread_count));
+        source.onerror = () => {
+          source.close();
+          fetchCount();
+          retry = setTimeout(connect, 5000);
+        };
+      })
+      .catch(() => { if (active) retry = setTimeout(connect, 30000); });
+    fetchCount();
+    connect();
+    return () => {
+      active = false;
+      clearTimeout(retry);
+      if (source) source.close();
+    };
+  }, [token]);
 
   const handleLogout = () => { logout(); navigate('/'); };
 
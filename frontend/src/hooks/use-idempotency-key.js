@@ -0,0 +1,19 @@
+import { useRef } from "react"
+
+// One Idempotency-Key per submission: retries and double clicks of the same payload reuse it,
+// a changed payload or a completed request starts a new one.
+export function useIdempotencyKey() {
+  const current = useRef(null)
+
+  const headerFor = (payload) => {
+    const body = JSON.stringify(payload)
+    if (!current.current || current.current.body !== body) {
+      current.current = { body, key: crypto.randomUUID() }
+    }
+    return { "Idempotency-Key": current.current.key }
+  }
+
+  const reset = () => { current.current = null }
+
+  return { headerFor, reset }
+}
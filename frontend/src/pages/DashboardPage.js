@@ -11,6 +11,7 @@ import { Wallet, TrendingUp, Briefcase, ArrowUpRight, ArrowDownRight, Plus, Minu
 import { PieChart, Pie, Cell, BarChart, Bar, XAxis, YAxis, Tooltip, ResponsiveContainer, Legend, CartesianGrid } from 'recharts';
 import { toast } from 'sonner';
 import axios from 'axios';
+import { useIdempotencyKey } from '@/hooks/use-idempotency-key';
 
 const COLORS = ['#10B981', '#3B82F6', '#F59E0B', '#8B5CF6', '#EF4444', '#EC4899'];
 
@@ -23,6 +24,7 @@ export default function DashboardPage() {
   const [sellShares, setSellShares] = useState('');
   const [sellLoading, setSellLoading] = useState(false);
   const headers = { Authorization: `Bearer ${token}` };
+  const idempotency = useIdempotencyKey();
 
   const fetchData = () => {
     Promise.all([
@@ -54,7 +56,9 @@ export default function DashboardPage() {
     if (shares > (sellDialog.shares || 1)) { toast.error(`En fazla ${sellDialog.shares} hisse satabilirsiniz`); return; }
     setSellLoading(true);
     try {
-      await axios.post(`${API}/portfolio/sell`, { portfolio_id: sellDialog.portfolio_id, shares }, { headers });
+      const payload = { portfolio_id: sellDialog.portfolio_id, shares };
+      await axios.post(`${API}/portfolio/sell`, payload, { headers: { ...headers, ...idempotency.headerFor(payload) } });
+      idempotency.reset();
       toast.success('Satım talebi oluşturuldu.');
       setSellDialog(null);
       fetchData();
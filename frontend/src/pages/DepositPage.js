@@ -8,19 +8,23 @@ import { Input } from '@/components/ui/input';
 import { ArrowLeft, Wallet, CheckCircle2, AlertTriangle } from 'lucide-react';
 import { toast } from 'sonner';
 import axios from 'axios';
+import { useIdempotencyKey } from '@/hooks/use-idempotency-key';
 
 export default function DepositPage() {
   const { user, token, API } = useAuth();
   const [amount, setAmount] = useState('');
   const [loading, setLoading] = useState(false);
   const [success, setSuccess] = useState(false);
+  const idempotency = useIdempotencyKey();
 
   const handleDeposit = async () => {
     const val = parseFloat(amount);
     if (!val || val <= 0) { toast.error('Geçerli bir tutar girin'); return; }
     setLoading(true);
     try {
-      await axios.post(`${API}/transactions`, { amount: val, type: 'deposit' }, { headers: { Authorization: `Bearer ${token}` } });
+      const payload = { amount: val, type: 'deposit' };
+      await axios.post(`${API}/transactions`, payload, { headers: { Authorization: `Bearer ${token}`, ...idempotency.headerFor(payload) } });
+      idempotency.reset();
       toast.success('Yatırma talebi oluşturuldu');
       setSuccess(true);
     } catch (err) {
@@ -12,6 +12,7 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from
 import { Sun, Wind, MapPin, Users, TrendingUp, Zap, ArrowLeft, Wallet, DollarSign } from 'lucide-react';
 import { toast } from 'sonner';
 import axios from 'axios';
+import { useIdempotencyKey } from '@/hooks/use-idempotency-key';
 
 export default function ProjectDetailPage() {
   const { id } = useParams();
@@ -23,6 +24,7 @@ export default function ProjectDetailPage() {
   const [dialogOpen, setDialogOpen] = useState(false);
   const [investing, setInvesting] = useState(false);
   const [usdRate, setUsdRate] = useState(38);
+  const idempotency = useIdempotencyKey();
 
   useEffect(() => {
     axios.get(`${API}/projects/${id}`).then(r => setProject(r.data)).catch(() => toast.error('Proje bulunamadı')).finally(() => setLoading(false));
@@ -39,7 +41,9 @@ export default function ProjectDetailPage() {
     if (!user) { navigate('/login'); return; }
     setInvesting(true);
     try {
-      await axios.post(`${API}/portfolio/invest`, { project_id: id, amount: investAmount }, { headers: { Authorization: `Bearer ${token}` } });
+      const payload = { project_id: id, amount: investAmount };
+      await axios.post(`${API}/portfolio/invest`, payload, { headers: { Authorization: `Bearer ${token}`, ...idempotency.headerFor(payload) } });
+      idempotency.reset();
       toast.success('Alım talebi oluşturuldu.');
       setDialogOpen(false);
     } catch (err) {
@@ -123,7 +127,7 @@ export default function ProjectDetailPage() {
                   <DialogContent>
                     <DialogHeader><DialogTitle className="font-[Poppins]">Alım Talebi - {project.name}</DialogTitle></DialogHeader>
                     <div className="space-y-4 pt-4">
-                      {user && <p className="text-sm text-slate-500">Mevcut Bakiye: <span className="font-semibold text-slate-900">{(user.balance || 0).toLocaleString('tr-TR')} TL</span></p>}
+                      {user && <p className="text-sm text-slate-500">Kullanılabilir Bakiye: <span className="font-semibold text-slate-900">{(user.available_balance ?? user.balance ?? 0).toLocaleString('tr-TR')} TL</span></p>}
                       <div>
                         <label className="text-sm font-medium text-slate-700">Hisse Adedi</label>
                         <div className="flex items-center gap-3 mt-1">
@@ -9,6 +9,7 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle } from '@/components/u
 import { ArrowLeft, Wallet, CheckCircle2, AlertTriangle } from 'lucide-react';
 import { toast } from 'sonner';
 import axios from 'axios';
+import { useIdempotencyKey } from '@/hooks/use-idempotency-key';
 
 export default function WithdrawalPage() {
   const { user, token, API } = useAuth();
@@ -17,11 +18,12 @@ export default function WithdrawalPage() {
   const [success, setSuccess] = useState(false);
   const [warningDialog, setWarningDialog] = useState(false);
   const headers = { Authorization: `Bearer ${token}` };
+  const idempotency = useIdempotencyKey();
 
   const handleWithdraw = async () => {
     const val = parseFloat(amount);
     if (!val || val <= 0) { toast.error('Geçerli bir tutar girin'); return; }
-    if (val > (user?.balance || 0)) { toast.error('Yetersiz bakiye'); return; }
+    if (val > (user?.available_balance ?? user?.balance ?? 0)) { toast.error('Yetersiz bakiye'); return; }
     try {
       const check = await axios.get(`${API}/portfolio/withdrawal-check`, { headers });
       if (check.data.has_recent_investments) {
@@ -37,7 +39,8 @@ export default function WithdrawalPage() {
     setWarningDialog(false);
     setLoading(true);
     try {
-      await axios.post(`${API}/transactions/withdraw`, { amount: val }, { headers });
+      await axios.post(`${API}/transactions/withdraw`, { amount: val }, { headers: { ...headers, ...idempotency.headerFor({ amount: val }) } });
+      idempotency.reset();
       toast.success('Çekme talebi oluşturuldu');
       setSuccess(true);
     } catch (err) {
@@ -63,8 +66,8 @@ export default function WithdrawalPage() {
               <Wallet className="w-6 h-6 text-emerald-600" />
             </div>
             <div>
-              <p className="text-sm text-slate-500">Mevcut Bakiye</p>
-              <p className="text-2xl font-bold text-slate-900 font-[Poppins]" data-testid="user-balance">{(user?.balance || 0).toLocaleString('tr-TR')} TL</p>
+              <p className="text-sm text-slate-500">Kullanılabilir Bakiye</p>
+              <p className="text-2xl font-bold text-slate-900 font-[Poppins]" data-testid="user-balance">{(user?.available_balance ?? user?.balance ?? 0).toLocaleString('tr-TR')} TL</p>
             </div>
           </CardContent>
         </Card>